@@ -1,19 +1,32 @@
-from flask import Flask, request, jsonify, Blueprint, abort, render_template, redirect
+from flask import Flask, request, jsonify, Blueprint, abort, g, has_request_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-from services.email_service import enviar_email, validar_configuracoes
+from services.email_service import enviar_email, validar_configuracoes, PoolSMTP
+from services.documento_cacheado import DocumentoCacheado, modificacao_dos_arquivos
+from services import json_codec
+from services.esquema import criar_esquema_envio
+from services.chaves_api import ChaveApi, RegistroChaves, hash_chave
+from services.agendador import Agendador, novo_id
+from services.filas import FilaEncerrada, FilaPrioridade, faixas_padrao
+from services.concorrencia import LimiteAdaptativo
+from services.metricas import METRICAS
+from services.supressao import ListaSupressao
+from services.anexos import ArmazemAnexos
+from services.webhooks import NotificadorWebhooks, tipo_do_resultado
+from services.mensagens import Mensagem, RegistroMensagens, STATUS, AGENDADO, CANCELADO, ENFILEIRADO, FALHOU
+from services.memoria import DepositoDisco, RastreadorMemoria, atualizar_metricas as atualizar_metricas_memoria
+from services.transportes import fechar_transportes
+from services.rastreamento import ID_REQUISICAO, SERVIDOR, Rastreador, propagar, rastrear
 import logging
+import sqlite3
 import time
 import os
-import re
 import secrets
-from functools import wraps
-import bleach
-from email_validator import validate_email, EmailNotValidError
-import json
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import datetime, timezone
+from functools import wraps, lru_cache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from werkzeug.exceptions import BadRequest
-from flask_swagger_ui import get_swaggerui_blueprint
 
 # Configurações de aplicação
 SERVICE_PORT = int(os.getenv("SERVICE_PORT", "5000"))
@@ -21,12 +34,52 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 DEBUG_MODE = os.getenv("FLASK_DEBUG", "False").lower() == "true"
 APPLICATION_ROOT = os.getenv("APPLICATION_ROOT", "")
 API_KEY = os.getenv("API_KEY", "")  # Chave de API para autenticação
+API_KEYS_FILE = os.getenv("API_KEYS_FILE", "")  # Registro de chaves por cliente (JSON ou SQLite)
+AGENDADOR_DB = os.getenv("AGENDADOR_DB", "data/agendamentos.db")  # Envios agendados
+AGENDADOR_TAXA = float(os.getenv("AGENDADOR_TAXA", "20"))  # Liberações por segundo
+FILA_WORKERS = int(os.getenv("FILA_WORKERS", "4"))  # Envios simultâneos (e conexões SMTP) por worker
+FILA_CONCORRENCIA_MAX = int(os.getenv("FILA_CONCORRENCIA_MAX", "16"))  # Teto do limite adaptativo (0: fixo em FILA_WORKERS)
+FILA_TAXA_BAIXA = float(os.getenv("FILA_TAXA_BAIXA", "5"))  # Envios por segundo da faixa "baixa"
+ENVIO_TIMEOUT = float(os.getenv("ENVIO_TIMEOUT", "30"))  # Espera máxima pelo envio síncrono
+ENCERRAMENTO_PRAZO = float(os.getenv("ENCERRAMENTO_PRAZO", "20"))  # Drenagem da fila ao encerrar o worker
+FILA_MEMORIA = int(float(os.getenv("FILA_MEMORIA_MB", "0")) * 1024 * 1024)  # Acima disso a fila vai para o disco (0: sem limite)
+FILA_DEPOSITO_DIR = os.getenv("FILA_DEPOSITO_DIR", "data")  # Depósito temporário da fila em disco
+MEMORIA_DEBUG = os.getenv("MEMORIA_DEBUG", "False").lower() == "true"  # tracemalloc por etapa do envio
+MEMORIA_DEBUG_AMOSTRAGEM = int(os.getenv("MEMORIA_DEBUG_AMOSTRAGEM", "100"))  # Snapshot a cada N execuções
+SUPRESSAO_ARQUIVO = os.getenv("SUPRESSAO_ARQUIVO", "data/supressao.idx")  # Índice da lista de supressão
+ANEXOS_DIR = os.getenv("ANEXOS_DIR", "data/anexos")  # Armazém de anexos endereçado por conteúdo
+LIMITE_ANEXOS = int(os.getenv("LIMITE_ANEXOS_MB", "25")) * 1024 * 1024  # Upload e total por email
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Webhook de eventos da chave global API_KEY
+WEBHOOK_SEGREDO = os.getenv("WEBHOOK_SEGREDO", "")  # Segredo HMAC desse webhook
+WEBHOOK_INTERVALO = float(os.getenv("WEBHOOK_INTERVALO", "1"))  # Espera máxima para formar um lote
+MENSAGENS_DB = os.getenv("MENSAGENS_DB", "data/mensagens.db")  # Histórico de status das mensagens
+MENSAGENS_RETENCAO_DIAS = float(os.getenv("MENSAGENS_RETENCAO_DIAS", "30"))  # 0 mantém para sempre
+RASTREAMENTO_ARQUIVO = os.getenv("RASTREAMENTO_ARQUIVO", "")  # Spans em OTLP-JSON (vazio: desligado)
+RASTREAMENTO_AMOSTRAGEM = float(os.getenv("RASTREAMENTO_AMOSTRAGEM", "0.1"))  # Fração das requisições rastreadas
 
 # Listas de origens permitidas
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 
+# Limite de tamanho do corpo aceito no envio de email (100KB)
+LIMITE_PAYLOAD_EMAIL = 100 * 1024
+
+# Provedor JSON do Flask baseado no codec do serviço (orjson quando disponível),
+# usado tanto por jsonify quanto pela decodificação das requisições
+class CodecJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return json_codec.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return json_codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Evita a ida e volta bytes -> str -> bytes de dumps()
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_codec.dumps(obj), mimetype="application/json")
+
 # Configuração do Flask
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
 app.config['JSON_SORT_KEYS'] = False  # Previne que o JSON seja reordenado
 app.config['MAX_CONTENT_LENGTH'] = 1 * 1024 * 1024  # Limite de tamanho do payload (1MB)
 app.config['API_KEY'] = API_KEY  # Adicionar API_KEY ao config
@@ -43,8 +96,8 @@ limiter = Limiter(
 CORS(app, resources={
     r"/*": {  # Alterado para cobrir todos os endpoints
         "origins": ALLOWED_ORIGINS,
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization", "X-API-KEY"],
+        "methods": ["GET", "POST", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "Authorization", "X-API-KEY", "traceparent"],
         "expose_headers": ["Content-Length", "X-Request-ID"],
         "supports_credentials": False,  # Não permite cookies de autenticação
         "max_age": 600  # Cache CORS por 10 minutos
@@ -67,12 +120,20 @@ logging.basicConfig(
 # Filtro personalizado para adicionar request_id aos logs
 class RequestIdFilter(logging.Filter):
     def filter(self, record):
-        record.request_id = getattr(request, 'id', 'no-request-id')
+        # Fora de uma requisição (threads de envio em segundo plano) não há request
+        if has_request_context():
+            record.request_id = getattr(request, 'id', 'no-request-id')
+        else:
+            # Envios da fila rodam no contexto da requisição que os enfileirou
+            record.request_id = ID_REQUISICAO.get() or 'no-request-id'
         return True
 
 logger = logging.getLogger("email-api")
 logger.addFilter(RequestIdFilter())
 
+# Rastreamento das requisições pelo caminho de envio (RASTREAMENTO_ARQUIVO)
+RASTREADOR = Rastreador(RASTREAMENTO_ARQUIVO, amostragem=RASTREAMENTO_AMOSTRAGEM)
+
 # Configuração do Swagger
 # SWAGGER_URL = '/api/docs'  # URL para acessar a UI do Swagger
 # API_URL = '/static/swagger.json'  # Onde o arquivo de especificação Swagger está localizado
@@ -107,54 +168,131 @@ def swagger_docs():
 @app.before_request
 def before_request():
     request.id = secrets.token_hex(8)  # ID único para cada solicitação
+    g.token_id_requisicao = ID_REQUISICAO.set(request.id)
+    # Span raiz da requisição; continua o trace do cliente se vier um traceparent
+    regra = request.url_rule.rule if request.url_rule is not None else request.path
+    g.span_requisicao = RASTREADOR.iniciar_span(
+        f"{request.method} {regra}", {"http.method": request.method, "http.route": regra,
+                                      "request.id": request.id},
+        pai=request.headers.get("traceparent"), tipo=SERVIDOR
+    )
     
     # Log de todas as requisições recebidas
     logger.debug(f"Requisição recebida: {request.method} {request.path} de {request.remote_addr}")
     
     # Verificar apenas para os endpoints não-OPTIONS
     if request.method != 'OPTIONS':
-        # Verificar o tamanho do conteúdo
+        # Verificar o tamanho do conteúdo (algumas rotas aceitam corpos maiores)
+        limite = LIMITES_POR_ENDPOINT.get(request.endpoint, app.config['MAX_CONTENT_LENGTH'])
+        request.max_content_length = limite
         content_length = request.headers.get('Content-Length')
-        if content_length and int(content_length) > app.config['MAX_CONTENT_LENGTH']:
+        if content_length and int(content_length) > limite:
             abort(413)  # Payload too large
 
+@app.after_request
+def after_request(response):
+    # Outros before_request (ex.: limitador) podem interromper antes do nosso
+    if getattr(request, 'id', None):
+        response.headers['X-Request-ID'] = request.id
+    span = g.get('span_requisicao')
+    if span is not None:
+        span.definir("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.marcar_erro(response.status)
+    return response
+
+@app.teardown_request
+def teardown_request(erro):
+    span = g.pop('span_requisicao', None)
+    if span is not None:
+        if erro is not None:
+            span.marcar_erro(str(erro))
+        span.finalizar()
+    token = g.pop('token_id_requisicao', None)
+    if token is not None:
+        ID_REQUISICAO.reset(token)
+
+# Registro de chaves de API por cliente, recarregado quando o arquivo muda
+REGISTRO_CHAVES = RegistroChaves(API_KEYS_FILE or None)
+
+@lru_cache(maxsize=4)
+def _chave_padrao(api_key):
+    return ChaveApi(prefixo="padrao", hash=hash_chave(api_key), nome="padrão", admin=True)
+
+def chave_da_requisicao():
+    """
+    Autentica o cabeçalho X-API-KEY uma única vez por requisição (resultado
+    guardado em flask.g). Aceita as chaves do registro e, por compatibilidade,
+    a chave global API_KEY.
+    """
+    if "chave_api" not in g:
+        provided_key = request.headers.get('X-API-KEY')
+        chave = None
+        if provided_key:
+            chave = REGISTRO_CHAVES.autenticar(provided_key)
+            api_key = app.config.get('API_KEY', API_KEY)  # Prefer config value
+            if chave is None and api_key and secrets.compare_digest(provided_key, api_key):
+                chave = _chave_padrao(api_key)
+        g.chave_api = chave
+    return g.chave_api
+
+def chave_tem_cota_propria():
+    """Chaves com cota própria não usam o limite padrão por IP da rota."""
+    chave = chave_da_requisicao()
+    return chave is not None and bool(chave.limites)
+
 # Função para proteger rotas com autenticação por API key
 def require_api_key(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        provided_key = request.headers.get('X-API-KEY')
-        api_key = app.config.get('API_KEY', API_KEY)  # Prefer config value
-        if not provided_key or not secrets.compare_digest(provided_key, api_key):
+        chave = chave_da_requisicao()
+        if chave is None:
             logger.warning(f"Tentativa de acesso não autorizado de {request.remote_addr}")
             return jsonify({"sucesso": False, "mensagem": "Não autorizado"}), 401
         return f(*args, **kwargs)
     return decorated_function
 
-# Função para sanitizar entrada
-def sanitize_input(data, skip_fields=None):
-    # Garantir que skip_fields é uma lista, mesmo que None
-    if skip_fields is None:
-        skip_fields = []
-    
-    if isinstance(data, dict):
-        sanitized_data = {}
-        for k, v in data.items():
-            # Pular a sanitização para campos na lista skip_fields
-            if k in skip_fields:
-                sanitized_data[k] = v  # Manter o valor original
-            else:
-                # Sanitizar todos os outros campos normalmente
-                sanitized_data[k] = sanitize_input(v, skip_fields)
-        return sanitized_data
-    elif isinstance(data, list):
-        # Sanitizar listas recursivamente
-        return [sanitize_input(item, skip_fields) for item in data]
-    elif isinstance(data, str):
-        # Sanitizar strings removendo todas as tags HTML
-        return bleach.clean(data, tags=[], attributes={}, strip=True)
-    else:
-        # Outros tipos de dados (int, float, bool, None) são retornados como estão
-        return data
+# Rotas que afetam todos os clientes (supressão, métricas, memória): só a chave
+# global API_KEY ou chaves com admin. Aplicado depois de require_api_key.
+def require_admin(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        chave = chave_da_requisicao()
+        if chave is None or not chave.admin:
+            logger.warning(f"Chave {getattr(chave, 'prefixo', None)} sem permissão de administração em {request.path}")
+            return jsonify({"sucesso": False, "mensagem": "Chave de API sem permissão para esta operação"}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Cota de envios da chave; aplicada só à rota de envio, para consultas não a consumirem
+def cobrar_cota_da_chave(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        chave = chave_da_requisicao()
+        # Mesmo armazenamento do limitador de taxa
+        if chave is not None and chave.limites and limiter.enabled:
+            for limite in chave.limites:
+                if not limiter.limiter.hit(limite, "chave-api", chave.prefixo):
+                    logger.warning(f"Cota excedida para a chave {chave.prefixo}")
+                    abort(429)
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Módulos pesados (bleach/html5lib e email_validator) são importados sob demanda,
+# no primeiro uso, para não atrasar a inicialização dos workers
+@lru_cache(maxsize=None)
+def _carregar_bleach():
+    import bleach
+    return bleach
+
+@lru_cache(maxsize=None)
+def _carregar_email_validator():
+    import email_validator
+    return email_validator
+
+# Função para sanitizar texto removendo todas as tags HTML
+def sanitizar_texto(valor):
+    return _carregar_bleach().clean(valor, tags=[], attributes={}, strip=True)
 
 # def sanitize_input(data):
 #     if isinstance(data, dict):
@@ -179,12 +317,284 @@ def sanitize_input(data, skip_fields=None):
 
 # Função para validar email
 def validate_email_address(email):
+    email_validator = _carregar_email_validator()
     try:
-        validate_email(email)
+        email_validator.validate_email(email)
         return True
-    except EmailNotValidError:
+    except email_validator.EmailNotValidError:
         return False
 
+class ErroRequisicao(Exception):
+    """Erro de entrada detectado na decodificação da requisição."""
+    def __init__(self, mensagem, status=400, erros=None):
+        super().__init__(mensagem)
+        self.mensagem = mensagem
+        self.status = status
+        self.erros = erros
+
+def decodificar_json(limite_bytes):
+    """
+    Lê o corpo da requisição uma única vez, verifica o tamanho a partir dos bytes
+    e decodifica com o codec JSON do serviço. Retorna o objeto JSON decodificado.
+    """
+    if not request.is_json:
+        raise ErroRequisicao("Formato de requisição inválido, esperado application/json", 415)
+
+    # Rejeitar antes de ler o corpo quando o tamanho já é conhecido
+    if request.content_length is not None and request.content_length > limite_bytes:
+        raise ErroRequisicao("Payload excede o limite permitido", 413)
+
+    # cache=False: o Flask não guarda uma segunda referência aos bytes
+    corpo = request.get_data(cache=False)
+    if not corpo:
+        raise ErroRequisicao("Nenhum dado fornecido")
+    if len(corpo) > limite_bytes:
+        raise ErroRequisicao("Payload excede o limite permitido", 413)
+
+    try:
+        dados = json_codec.loads(corpo)
+    except (json_codec.JSONDecodeError, UnicodeDecodeError):
+        raise ErroRequisicao("JSON inválido")
+
+    if not dados:
+        raise ErroRequisicao("Nenhum dado fornecido")
+    if not isinstance(dados, dict):
+        raise ErroRequisicao("JSON inválido, esperado um objeto")
+    return dados
+
+# Esquema do envio de email, compilado uma única vez na importação. O validador
+# de email é resolvido a cada chamada para que possa ser substituído nos testes.
+ESQUEMA_ENVIO = criar_esquema_envio(
+    validar_email=lambda email: validate_email_address(email),
+    sanitizador=sanitizar_texto,
+)
+
+def validar_payload(esquema, dados):
+    """Valida e sanitiza `dados`; levanta ErroRequisicao com todos os erros encontrados."""
+    dados, erros = esquema.validar(dados)
+    if erros:
+        raise ErroRequisicao("; ".join(erros), erros=erros)
+    return dados
+
+# Endereços que não devem mais receber emails (bounces, descadastros)
+LISTA_SUPRESSAO = ListaSupressao(SUPRESSAO_ARQUIVO)
+LIMITE_PAYLOAD_IMPORTACAO = 10 * 1024 * 1024  # 10MB
+
+# Anexos enviados em /api/anexos e referenciados pelo hash no envio
+ARMAZEM_ANEXOS = ArmazemAnexos(ANEXOS_DIR)
+
+# Rotas com limite de corpo acima de MAX_CONTENT_LENGTH
+LIMITES_POR_ENDPOINT = {
+    'api.api_importar_supressoes': LIMITE_PAYLOAD_IMPORTACAO,
+    'api.api_enviar_anexo': LIMITE_ANEXOS,
+}
+
+def verificar_anexos(referencias):
+    """Confere se os anexos referenciados existem e cabem no limite por email."""
+    total = 0
+    for referencia in referencias or ():
+        if not ARMAZEM_ANEXOS.existe(referencia['hash']):
+            raise ErroRequisicao(f"Anexo não encontrado: {referencia['hash']}")
+        total += ARMAZEM_ANEXOS.tamanho(referencia['hash'])
+    if total > LIMITE_ANEXOS:
+        raise ErroRequisicao("Anexos excedem o tamanho máximo por email", 413)
+
+# Envios simultâneos ajustados pela latência e pelas falhas temporárias do
+# servidor SMTP, partindo de FILA_WORKERS
+LIMITE_CONCORRENCIA = LimiteAdaptativo(
+    inicial=FILA_WORKERS, maximo=max(FILA_CONCORRENCIA_MAX, FILA_WORKERS)
+) if FILA_CONCORRENCIA_MAX else None
+
+# Pool de conexões SMTP compartilhado pelos workers da fila de envio
+POOL_SMTP = PoolSMTP(tamanho=LIMITE_CONCORRENCIA.maximo if LIMITE_CONCORRENCIA else FILA_WORKERS)
+
+def _destino_webhook(prefixo):
+    """Webhook (url, segredo) da chave de API, resolvido no momento da entrega."""
+    if prefixo == "padrao":
+        return (WEBHOOK_URL, WEBHOOK_SEGREDO or None) if WEBHOOK_URL else None
+    chave = REGISTRO_CHAVES.por_prefixo(prefixo)
+    if chave is None or not chave.webhook_url:
+        return None
+    return chave.webhook_url, chave.webhook_segredo
+
+# Eventos de envio entregues em lotes aos webhooks, fora do laço de envio SMTP
+NOTIFICADOR_WEBHOOKS = NotificadorWebhooks(resolver=_destino_webhook, intervalo=WEBHOOK_INTERVALO)
+
+# Histórico de status das mensagens, gravado em lote fora do caminho do envio
+HISTORICO_MENSAGENS = RegistroMensagens(MENSAGENS_DB, retencao=MENSAGENS_RETENCAO_DIAS * 86400)
+
+def _registrar_resultado(dados, resultado):
+    """Registra o resultado no histórico e o publica no webhook da chave (sem bloquear)."""
+    tipo = tipo_do_resultado(resultado)
+    HISTORICO_MENSAGENS.registrar(
+        dados.id, tipo, chave=dados.chave, destinatario=dados.destinatario,
+        assunto=dados.assunto, detalhe=resultado.get("mensagem")
+    )
+    NOTIFICADOR_WEBHOOKS.publicar(dados.chave, {
+        "evento": tipo,
+        "id": dados.id,
+        "destinatario": dados.destinatario,
+        "mensagem": resultado.get("mensagem"),
+    })
+    return resultado
+
+# Medição de memória por etapa do envio (MEMORIA_DEBUG)
+RASTREADOR_MEMORIA = RastreadorMemoria(MEMORIA_DEBUG, amostragem=MEMORIA_DEBUG_AMOSTRAGEM)
+
+def _enviar_da_fila(dados):
+    """Envia uma mensagem retirada da fila (chamado pelos workers da fila)."""
+    with rastrear("enviar", {"mensagem.id": dados.id}) as span:
+        resultado = _enviar_mensagem(dados)
+        if not resultado["sucesso"]:
+            span.marcar_erro(resultado.get("mensagem"))
+        return resultado
+
+def _enviar_mensagem(dados):
+    # Agendamentos podem vencer depois de o destinatário ter sido suprimido
+    if LISTA_SUPRESSAO.contem(dados.destinatario):
+        logger.info(f"Email {dados.id} descartado: destinatário na lista de supressão")
+        return _registrar_resultado(dados, {"sucesso": False, "mensagem": "Destinatário na lista de supressão",
+                                  "detalhes": None})
+    try:
+        anexos = ARMAZEM_ANEXOS.resolver(dados.anexos)
+    except ValueError as e:
+        logger.error(f"Falha ao enviar email {dados.id}: {e}")
+        return _registrar_resultado(dados, {"sucesso": False, "mensagem": str(e), "detalhes": None})
+    with RASTREADOR_MEMORIA.etapa("enviar"):
+        resultado = enviar_email(
+            destinatario=dados.destinatario,
+            assunto=dados.assunto,
+            corpo=dados.corpo,
+            debug=False,  # Nunca permitir debug em produção
+            remetente=dados.remetente,
+            pool=POOL_SMTP,
+            anexos=anexos
+        )
+    # Criar log do resultado sem expor detalhes sensíveis
+    if resultado["sucesso"]:
+        logger.info(f"Email {dados.id} enviado com sucesso para {dados.destinatario}")
+    else:
+        logger.error(f"Falha ao enviar email {dados.id}: {resultado.get('mensagem', 'Erro desconhecido')}")
+    return _registrar_resultado(dados, resultado)
+
+# Fila de envio com faixas de prioridade (alta/normal/baixa)
+FILA_ENVIO = FilaPrioridade(
+    enviar=_enviar_da_fila,
+    faixas=faixas_padrao(taxa_baixa=FILA_TAXA_BAIXA),
+    workers=FILA_WORKERS,
+    limitador=LIMITE_CONCORRENCIA,
+    limite_memoria=FILA_MEMORIA,
+    deposito=DepositoDisco(os.path.join(FILA_DEPOSITO_DIR, f"fila-{os.getpid()}.db")) if FILA_MEMORIA else None,
+)
+
+def _enviar_agendado(dados):
+    """Enfileira um agendamento vencido (chamado pela thread do agendador)."""
+    mensagem = Mensagem.de_dict(dados)
+    # O envio segue no trace (e com o ID) da requisição que o agendou
+    with RASTREADOR.retomar(mensagem.rastro):
+        return FILA_ENVIO.submeter(mensagem, mensagem.prioridade)
+
+# Agendador persistente de envios com data marcada (campo enviar_em)
+AGENDADOR = Agendador(AGENDADOR_DB, enviar=_enviar_agendado, taxa_maxima=AGENDADOR_TAXA)
+
+def iniciar_servicos():
+    """
+    Inicia os serviços em segundo plano do worker. Chamado pelo Gunicorn
+    (post_worker_init, em gunicorn.conf.py) e, sob demanda, pelas rotas.
+    """
+    FILA_ENVIO.iniciar()
+    AGENDADOR.iniciar()
+    NOTIFICADOR_WEBHOOKS.iniciar()
+    HISTORICO_MENSAGENS.iniciar()
+    RASTREADOR.iniciar()
+
+def _registrar_status(mensagem, status):
+    HISTORICO_MENSAGENS.registrar(
+        mensagem.id, status, chave=mensagem.chave,
+        destinatario=mensagem.destinatario, assunto=mensagem.assunto
+    )
+
+def _descarregar_logs():
+    """Grava o que estiver nos buffers de todos os handlers de log."""
+    loggers = [logging.getLogger()] + [
+        item for item in logging.Logger.manager.loggerDict.values() if isinstance(item, logging.Logger)
+    ]
+    for item in loggers:
+        for handler in item.handlers:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+
+def verificar_prazos_encerramento(graceful_timeout):
+    """
+    Confere se o encerramento cabe no --graceful-timeout do Gunicorn: as
+    requisições em andamento esperam até ENVIO_TIMEOUT pelo envio e só depois
+    a fila é drenada por ENCERRAMENTO_PRAZO. Se não couber, o worker é morto
+    antes de persistir a fila.
+    """
+    if ENVIO_TIMEOUT + ENCERRAMENTO_PRAZO >= graceful_timeout:
+        raise ValueError(
+            f"ENVIO_TIMEOUT ({ENVIO_TIMEOUT:.0f}s) + ENCERRAMENTO_PRAZO ({ENCERRAMENTO_PRAZO:.0f}s) "
+            f"deve ser menor que GUNICORN_GRACEFUL_TIMEOUT ({graceful_timeout:.0f}s)"
+        )
+
+def interromper_entrada():
+    """
+    Primeira etapa do encerramento, chamada pelo Gunicorn ao receber SIGTERM
+    (gunicorn.conf.py), antes de esperar as requisições em andamento. O
+    agendador para de liberar mensagens e a fila deixa de aceitar novas (as
+    requisições recebem 503), mas continua enviando as que já aceitou.
+
+    Roda dentro de um tratador de sinal: não registra log nem espera threads.
+    """
+    AGENDADOR.parar(timeout=0)
+    FILA_ENVIO.fechar_entrada()
+
+def encerrar_servicos(prazo=None):
+    """
+    Encerramento gracioso do worker. Chamado pelo Gunicorn (worker_exit, em
+    gunicorn.conf.py) depois que as requisições em andamento terminaram; a
+    entrada de mensagens já foi fechada por interromper_entrada.
+
+    O agendador para de liberar mensagens e a fila de envio é drenada por até
+    `prazo` segundos; o que não for enviado a tempo é persistido no banco do
+    agendador e enviado por outro worker (ou após o reinício). Em seguida, as
+    conexões SMTP são encerradas com QUIT, o transporte grava o que tiver
+    pendente (EMAIL_TRANSPORTE=arquivo), os eventos de webhook, o histórico e
+    os spans pendentes são gravados e os logs descarregados.
+    """
+    prazo = ENCERRAMENTO_PRAZO if prazo is None else prazo
+    limite = time.monotonic() + prazo
+    logger.info(f"Encerrando serviços (prazo de {prazo:.0f}s)")
+    
+    AGENDADOR.parar(timeout=prazo)
+    restantes = FILA_ENVIO.drenar(max(limite - time.monotonic(), 0.0))
+    if restantes:
+        # Resolver os futuros antes de persistir: o agendador remove a reserva
+        # de uma mensagem agendada quando o futuro dela termina
+        for tarefa in restantes:
+            tarefa.futuro.set_exception(FilaEncerrada("Mensagem persistida para envio após o reinício"))
+        try:
+            persistidas = AGENDADOR.devolver(tarefa.dados.para_dict() for tarefa in restantes)
+            logger.warning(f"{persistidas} mensagens da fila persistidas para envio posterior")
+        except sqlite3.Error:
+            logger.exception(f"Falha ao persistir {len(restantes)} mensagens da fila")
+    
+    # Envios que passaram do prazo não são interrompidos: terminam na própria
+    # conexão, que o pool já fechado encerra com QUIT quando ela é devolvida
+    em_andamento = FILA_ENVIO.em_andamento()
+    if em_andamento:
+        logger.warning(f"{em_andamento} envios ainda em andamento; suas conexões SMTP serão encerradas ao terminarem")
+    POOL_SMTP.fechar()
+    fechar_transportes()
+    NOTIFICADOR_WEBHOOKS.parar(timeout=max(limite - time.monotonic(), 1.0))
+    HISTORICO_MENSAGENS.parar(timeout=max(limite - time.monotonic(), 1.0))
+    RASTREADOR.parar(timeout=max(limite - time.monotonic(), 1.0))
+    atualizar_metricas_memoria(METRICAS)
+    logger.info(f"Métricas no encerramento: {json_codec.dumps(METRICAS.instantaneo()).decode('utf-8')}")
+    _descarregar_logs()
+
 # Criar Blueprint para a API principal
 api_bp = Blueprint('api', __name__)
 
@@ -205,93 +615,272 @@ def health_check():
         return jsonify({"status": "error", "message": "Serviço indisponível"}), 500
 
 @api_bp.route('/enviar-email', methods=['POST', 'OPTIONS'])
-@limiter.limit("10 per minute")  # Limite de taxa específico para envio de email
+@limiter.limit("10 per minute", exempt_when=chave_tem_cota_propria)  # Limite de taxa específico para envio de email
 @require_api_key  # Proteção com API key
+@cobrar_cota_da_chave
 def api_enviar_email():
     if request.method == 'OPTIONS':
         return '', 204  # Resposta para pré-requisição CORS
     
-    # Verificar Content-Type
-    if not request.is_json:
-        return jsonify({
-            "sucesso": False,
-            "mensagem": "Formato de requisição inválido, esperado application/json"
-        }), 415
+    logger.info(f"Requisição recebida de {request.remote_addr}")
+    
+    # Ler, verificar o tamanho e decodificar o corpo em uma única etapa.
+    # Erros de entrada (ErroRequisicao) são tratados pelo errorhandler.
+    with RASTREADOR_MEMORIA.etapa("decodificar"), rastrear("decodificar"):
+        dados = decodificar_json(LIMITE_PAYLOAD_EMAIL)
+    
+    # Validar e sanitizar todos os campos em uma única passagem
+    with RASTREADOR_MEMORIA.etapa("validar"), rastrear("validar"):
+        dados = validar_payload(ESQUEMA_ENVIO, dados)
+    if LISTA_SUPRESSAO.contem(dados['destinatario']):
+        raise ErroRequisicao("Destinatário na lista de supressão", 422)
+    verificar_anexos(dados.get('anexos'))
+    
+    # Aplicar as políticas da chave de API
+    chave = chave_da_requisicao()
+    if not chave.permite_destinatario(dados['destinatario']):
+        return jsonify({"sucesso": False, "mensagem": "Destinatário não permitido para esta chave de API"}), 403
     
-    # Verificar se há dados no corpo da requisição
-    if not request.data or request.data == b'':
+    # Registro compacto; o corpo é compartilhado com mensagens iguais já na fila
+    mensagem = Mensagem(
+        id=novo_id(),
+        chave=chave.prefixo,
+        destinatario=dados['destinatario'],
+        assunto=dados['assunto'],
+        corpo=dados['corpo'],
+        remetente=chave.remetente,
+        prioridade=dados.get('prioridade'),
+        anexos=dados.get('anexos'),
+        rastro=propagar()
+    )
+    
+    # Envio agendado: persistir e responder imediatamente
+    enviar_em = dados.get('enviar_em')
+    if enviar_em is not None and enviar_em > time.time():
+        AGENDADOR.agendar(enviar_em, mensagem.para_dict(), chave=chave.prefixo, id=mensagem.id)
+        _registrar_status(mensagem, AGENDADO)
+        iniciar_servicos()
+        logger.info(f"Email {mensagem.id} agendado para {dados['destinatario']}")
         return jsonify({
-            "sucesso": False,
-            "mensagem": "Nenhum dado fornecido"
-        }), 400
+            "sucesso": True,
+            "mensagem": "Email agendado com sucesso!",
+            "id": mensagem.id,
+            "enviar_em": datetime.fromtimestamp(enviar_em, tz=timezone.utc).isoformat()
+        }), 202
     
     try:
-        logger.info(f"Requisição recebida de {request.remote_addr}")
-        
-        # Limitar tamanho do payload
-        if len(request.data) > 100 * 1024:  # 100KB para o corpo da mensagem
+        # Processar envio do email pela fila da faixa de prioridade
+        _registrar_status(mensagem, ENFILEIRADO)
+        try:
+            with RASTREADOR_MEMORIA.etapa("enfileirar"), rastrear("enfileirar", {"mensagem.id": mensagem.id}):
+                futuro = FILA_ENVIO.submeter(mensagem, mensagem.prioridade)
+        except FilaEncerrada:
+            # Worker em encerramento: o cliente tenta de novo e cai em outro worker
+            HISTORICO_MENSAGENS.registrar(mensagem.id, FALHOU, chave=chave.prefixo,
+                                          detalhe="Serviço em reinicialização")
             return jsonify({
                 "sucesso": False,
-                "mensagem": "Payload excede o limite permitido"
-            }), 413
-        
-        # Validar e sanitizar a entrada
+                "mensagem": "Serviço em reinicialização, tente novamente"
+            }), 503, {"Retry-After": "5"}
         try:
-            dados = request.get_json()
-            if not dados:
-                return jsonify({"sucesso": False, "mensagem": "Nenhum dado fornecido"}), 400
-            
-            # Sanitizar todos os dados de entrada
-            dados = sanitize_input(dados, skip_fields=['corpo'])
-        except json.JSONDecodeError:
-            return jsonify({"sucesso": False, "mensagem": "JSON inválido"}), 400
-        
-        # Validar campos obrigatórios
-        campos_obrigatorios = ['destinatario', 'assunto', 'corpo']
-        for campo in campos_obrigatorios:
-            if campo not in dados:
-                return jsonify({"sucesso": False, "mensagem": f"Campo obrigatório ausente: {campo}"}), 400
-        
-        # Validar email do destinatário
-        if not validate_email_address(dados['destinatario']):
-            return jsonify({"sucesso": False, "mensagem": "Email do destinatário inválido"}), 400
-        
-        
-        # Verificar tamanho dos campos
-        if len(dados['assunto']) > 200:
-            return jsonify({"sucesso": False, "mensagem": "Assunto muito longo"}), 400
-        
-        if len(dados['corpo']) > 50000:
-            return jsonify({"sucesso": False, "mensagem": "Corpo do email muito longo"}), 400
-        
-        # Processar envio do email
-        resultado = enviar_email(
-            destinatario=dados['destinatario'],
-            assunto=dados['assunto'],
-            corpo=dados['corpo'],
-            debug=False  # Nunca permitir debug em produção
-        )
-        
-        # Criar log do resultado sem expor detalhes sensíveis
-        if resultado["sucesso"]:
-            logger.info(f"Email enviado com sucesso para {dados['destinatario']}")
-        else:
-            logger.error(f"Falha ao enviar email: {resultado.get('mensagem', 'Erro desconhecido')}")
+            resultado = futuro.result(timeout=ENVIO_TIMEOUT)
+        except (FuturesTimeoutError, FilaEncerrada):
+            # O envio continua na fila (ou foi persistido no encerramento);
+            # o cliente não fica preso esperando
+            return jsonify({
+                "sucesso": True,
+                "mensagem": "Email enfileirado para envio",
+                "id": mensagem.id
+            }), 202
         
+        resultado["id"] = mensagem.id
         return jsonify(resultado), 200 if resultado["sucesso"] else 500
-    except BadRequest:
-        return jsonify({"sucesso": False, "mensagem": "JSON malformado"}), 400
     except Exception as e:
         logger.exception("Erro não tratado na API")
         return jsonify({"sucesso": False, "mensagem": "Erro no servidor"}), 500
 
-# Rota para documentação de endpoints
-@api_bp.route('/endpoints', methods=['GET'])
-def api_endpoints():
+@api_bp.route('/metricas', methods=['GET'])
+@require_api_key
+@require_admin
+def api_metricas():
+    """Métricas do worker: tamanho das filas e latências por faixa de prioridade."""
+    atualizar_metricas_memoria(METRICAS)
+    return jsonify(METRICAS.instantaneo())
+
+@api_bp.route('/memoria', methods=['GET'])
+@require_api_key
+@require_admin
+def api_memoria():
+    """Memória do worker e, com MEMORIA_DEBUG, as maiores alocações de cada etapa do envio."""
+    return jsonify(RASTREADOR_MEMORIA.relatorio())
+
+@api_bp.route('/agendamentos/<id_agendamento>', methods=['GET', 'DELETE'])
+@require_api_key
+def api_agendamento(id_agendamento):
+    """Consulta ou cancela um envio agendado pela mesma chave de API."""
+    chave = chave_da_requisicao()
+    if request.method == 'DELETE':
+        if AGENDADOR.cancelar(id_agendamento, chave=chave.prefixo):
+            HISTORICO_MENSAGENS.registrar(id_agendamento, CANCELADO, chave=chave.prefixo)
+            logger.info(f"Agendamento {id_agendamento} cancelado")
+            return jsonify({"sucesso": True, "mensagem": "Agendamento cancelado"})
+        return jsonify({"sucesso": False, "mensagem": "Agendamento não encontrado ou já enviado"}), 404
+    
+    agendamento = AGENDADOR.consultar(id_agendamento)
+    if agendamento is None or agendamento["chave"] != chave.prefixo:
+        return jsonify({"sucesso": False, "mensagem": "Agendamento não encontrado ou já enviado"}), 404
+    return jsonify({
+        "sucesso": True,
+        "id": agendamento["id"],
+        "status": agendamento["status"],
+        "enviar_em": datetime.fromtimestamp(agendamento["enviar_em"], tz=timezone.utc).isoformat()
+    })
+
+def _formatar_mensagem(registro):
+    for campo in ('criado_em', 'atualizado_em'):
+        registro[campo] = datetime.fromtimestamp(registro[campo], tz=timezone.utc).isoformat()
+    return registro
+
+def _data_da_consulta(nome):
+    """Data ISO 8601 de um parâmetro da consulta, como timestamp (ou None)."""
+    valor = request.args.get(nome)
+    if not valor:
+        return None
+    try:
+        if valor.endswith(("Z", "z")):
+            valor = valor[:-1] + "+00:00"
+        return datetime.fromisoformat(valor).timestamp()
+    except ValueError:
+        raise ErroRequisicao(f"Data inválida no parâmetro {nome}")
+
+@api_bp.route('/mensagens', methods=['GET'])
+@require_api_key
+def api_buscar_mensagens():
     """
-    Retorna uma listagem e documentação dos endpoints disponíveis.
+    Busca as mensagens da chave de API, das mais recentes para as mais antigas,
+    com filtros opcionais e paginação por cursor (parâmetro cursor da resposta).
+    """
+    chave = chave_da_requisicao()
+    status = request.args.get('status') or None
+    if status is not None and status not in STATUS:
+        raise ErroRequisicao(f"Status inválido. Use um de: {', '.join(STATUS)}")
+    try:
+        limite = int(request.args.get('limite', 50))
+    except ValueError:
+        raise ErroRequisicao("Parâmetro limite deve ser um número inteiro")
+    if not 1 <= limite <= 500:
+        raise ErroRequisicao("Parâmetro limite deve estar entre 1 e 500")
+    try:
+        itens, cursor = HISTORICO_MENSAGENS.buscar(
+            chave=chave.prefixo,
+            destinatario=request.args.get('destinatario') or None,
+            status=status,
+            desde=_data_da_consulta('desde'),
+            ate=_data_da_consulta('ate'),
+            limite=limite,
+            cursor=request.args.get('cursor') or None
+        )
+    except ValueError as e:
+        raise ErroRequisicao(str(e))
+    return jsonify({
+        "sucesso": True,
+        "mensagens": [_formatar_mensagem(item) for item in itens],
+        "cursor": cursor
+    })
+
+@api_bp.route('/mensagens/<id_mensagem>', methods=['GET'])
+@require_api_key
+def api_consultar_mensagem(id_mensagem):
+    """Status de uma mensagem enviada pela mesma chave de API."""
+    chave = chave_da_requisicao()
+    registro = HISTORICO_MENSAGENS.consultar(id_mensagem, chave=chave.prefixo)
+    if registro is None:
+        return jsonify({"sucesso": False, "mensagem": "Mensagem não encontrada"}), 404
+    return jsonify(dict(_formatar_mensagem(registro), sucesso=True))
+
+@api_bp.route('/anexos', methods=['POST'])
+@require_api_key
+def api_enviar_anexo():
+    """
+    Recebe anexos por upload multipart (campo arquivo, pode repetir) e retorna
+    as referências a usar no campo anexos do envio. Arquivos grandes são
+    mantidos em disco pelo Werkzeug e copiados em blocos para o armazém.
     """
-    endpoints = [
+    arquivos = request.files.getlist('arquivo')
+    if not arquivos:
+        raise ErroRequisicao("Nenhum arquivo enviado no campo arquivo")
+    
+    anexos = []
+    for arquivo in arquivos:
+        hash_anexo = ARMAZEM_ANEXOS.salvar(arquivo.stream)
+        anexos.append({
+            "hash": hash_anexo,
+            "nome": os.path.basename(arquivo.filename or "")[:255] or hash_anexo,
+            "tipo": arquivo.mimetype or "application/octet-stream",
+            "tamanho": ARMAZEM_ANEXOS.tamanho(hash_anexo)
+        })
+        logger.info(f"Anexo {hash_anexo} armazenado ({anexos[-1]['tamanho']} bytes)")
+    return jsonify({"sucesso": True, "anexos": anexos}), 201
+
+@api_bp.route('/supressoes', methods=['POST'])
+@require_api_key
+@require_admin
+def api_adicionar_supressao():
+    """Adiciona um endereço à lista de supressão."""
+    dados = decodificar_json(LIMITE_PAYLOAD_EMAIL)
+    endereco = dados.get('endereco')
+    if not isinstance(endereco, str) or '@' not in endereco or len(endereco) > 254:
+        raise ErroRequisicao("Campo endereco ausente ou inválido")
+    if LISTA_SUPRESSAO.adicionar(endereco):
+        logger.info(f"Endereço {endereco} adicionado à lista de supressão")
+        return jsonify({"sucesso": True, "mensagem": "Endereço suprimido"}), 201
+    return jsonify({"sucesso": True, "mensagem": "Endereço já estava suprimido"})
+
+@api_bp.route('/supressoes/importar', methods=['POST'])
+@require_api_key
+@require_admin
+def api_importar_supressoes():
+    """
+    Importa endereços em lote: JSON {"enderecos": [...]} ou text/plain com um
+    endereço por linha (lido em fluxo, sem carregar o corpo inteiro).
+    """
+    if request.mimetype == 'text/plain':
+        if request.content_length is not None and request.content_length > LIMITE_PAYLOAD_IMPORTACAO:
+            raise ErroRequisicao("Payload excede o limite permitido", 413)
+        enderecos = (
+            linha.decode('utf-8', 'replace').strip()
+            for linha in request.stream
+        )
+    else:
+        enderecos = decodificar_json(LIMITE_PAYLOAD_IMPORTACAO).get('enderecos')
+        if not isinstance(enderecos, list) or not all(isinstance(e, str) for e in enderecos):
+            raise ErroRequisicao("Campo enderecos deve ser uma lista de textos")
+    
+    novos = LISTA_SUPRESSAO.importar(e for e in enderecos if '@' in e and len(e) <= 254)
+    logger.info(f"{novos} endereços importados para a lista de supressão")
+    return jsonify({"sucesso": True, "adicionados": novos, "total": len(LISTA_SUPRESSAO)})
+
+@api_bp.route('/supressoes/<endereco>', methods=['GET', 'DELETE'])
+@require_api_key
+@require_admin
+def api_supressao(endereco):
+    """Consulta ou remove um endereço da lista de supressão."""
+    if request.method == 'DELETE':
+        if LISTA_SUPRESSAO.remover(endereco):
+            logger.info(f"Endereço {endereco} removido da lista de supressão")
+            return jsonify({"sucesso": True, "mensagem": "Endereço removido da lista de supressão"})
+        return jsonify({"sucesso": False, "mensagem": "Endereço não está na lista de supressão"}), 404
+    return jsonify({"sucesso": True, "endereco": endereco, "suprimido": LISTA_SUPRESSAO.contem(endereco)})
+
+# Documentos estáticos da API: montados e serializados uma única vez, na
+# inicialização, e servidos com ETag/Last-Modified e variante gzip. O
+# Last-Modified vem do mtime dos arquivos de origem, igual em todos os workers
+DOCUMENTACAO_MODIFICADA_EM = modificacao_dos_arquivos(__file__)
+
+DOCUMENTACAO_ENDPOINTS = {
+    "serviço": "API de Envio de Email",
+    "versão": "1.0",
+    "endpoints": [
         {
             "endpoint": "/api/health",
             "método": "GET",
@@ -300,7 +889,7 @@ def api_endpoints():
             "parâmetros": [],
             "resposta_exemplo": {
                 "status": "ok",
-                "timestamp": time.time(),
+                "timestamp": 1647012345.678,
                 "service": "email-service",
                 "version": "1.0",
                 "environment": "production"
@@ -315,17 +904,89 @@ def api_endpoints():
                 {"nome": "X-API-KEY", "descrição": "Chave de API para autenticação"},
                 {"nome": "Content-Type", "descrição": "Deve ser application/json"}
             ],
-            "parâmetros": [
-                {"nome": "destinatario", "tipo": "string", "descrição": "Email do destinatário"},
-                {"nome": "assunto", "tipo": "string", "descrição": "Assunto do email (máximo 200 caracteres)"},
-                {"nome": "corpo", "tipo": "string", "descrição": "Corpo do email em HTML (máximo 50000 caracteres)"}
-            ],
+            "parâmetros": ESQUEMA_ENVIO.para_documentacao(),
             "resposta_exemplo": {
                 "sucesso": True,
                 "mensagem": "Email enviado com sucesso!"
             },
             "limites": "50 requisições por minuto"
         },
+        {
+            "endpoint": "/api/agendamentos/<id>",
+            "método": "GET, DELETE",
+            "descrição": "Consulta ou cancela um envio agendado com enviar_em",
+            "requer_autenticação": True,
+            "parâmetros": []
+        },
+        {
+            "endpoint": "/api/mensagens",
+            "método": "GET",
+            "descrição": "Busca as mensagens enviadas pela chave de API, com paginação por cursor",
+            "requer_autenticação": True,
+            "parâmetros": [
+                {"nome": "destinatario", "tipo": "string", "obrigatório": False, "descrição": "Endereço do destinatário"},
+                {"nome": "status", "tipo": "string", "obrigatório": False, "descrição": ", ".join(STATUS)},
+                {"nome": "desde", "tipo": "string", "obrigatório": False, "descrição": "Data ISO 8601 inicial"},
+                {"nome": "ate", "tipo": "string", "obrigatório": False, "descrição": "Data ISO 8601 final (exclusiva)"},
+                {"nome": "limite", "tipo": "integer", "obrigatório": False, "descrição": "Itens por página (1 a 500, padrão 50)"},
+                {"nome": "cursor", "tipo": "string", "obrigatório": False, "descrição": "Cursor da página anterior"}
+            ]
+        },
+        {
+            "endpoint": "/api/mensagens/<id>",
+            "método": "GET",
+            "descrição": "Status de uma mensagem pelo id retornado no envio",
+            "requer_autenticação": True,
+            "parâmetros": []
+        },
+        {
+            "endpoint": "/api/anexos",
+            "método": "POST",
+            "descrição": "Envia anexos (multipart/form-data) e retorna as referências para o campo anexos",
+            "requer_autenticação": True,
+            "parâmetros": [
+                {"nome": "arquivo", "tipo": "file", "obrigatório": True, "descrição": "Arquivo a anexar (pode repetir)"}
+            ]
+        },
+        {
+            "endpoint": "/api/supressoes",
+            "método": "POST",
+            "descrição": "Adiciona um endereço à lista de supressão",
+            "requer_autenticação": True,
+            "parâmetros": [
+                {"nome": "endereco", "tipo": "string", "obrigatório": True, "descrição": "Endereço a suprimir"}
+            ]
+        },
+        {
+            "endpoint": "/api/supressoes/importar",
+            "método": "POST",
+            "descrição": "Importa endereços em lote (JSON com a lista enderecos, ou text/plain com um por linha)",
+            "requer_autenticação": True,
+            "parâmetros": [
+                {"nome": "enderecos", "tipo": "array", "obrigatório": True, "descrição": "Endereços a suprimir"}
+            ]
+        },
+        {
+            "endpoint": "/api/supressoes/<endereco>",
+            "método": "GET, DELETE",
+            "descrição": "Consulta ou remove um endereço da lista de supressão",
+            "requer_autenticação": True,
+            "parâmetros": []
+        },
+        {
+            "endpoint": "/api/metricas",
+            "método": "GET",
+            "descrição": "Métricas do worker: filas e latências por faixa de prioridade",
+            "requer_autenticação": True,
+            "parâmetros": []
+        },
+        {
+            "endpoint": "/api/memoria",
+            "método": "GET",
+            "descrição": "Memória do worker (RSS atual e de pico) e, com MEMORIA_DEBUG, as maiores alocações por etapa do envio",
+            "requer_autenticação": True,
+            "parâmetros": []
+        },
         {
             "endpoint": "/api/endpoints",
             "método": "GET",
@@ -341,30 +1002,57 @@ def api_endpoints():
             "requer_autenticação": False,
             "parâmetros": []
         }
-    ]
-    
+    ],
     # Adicionar informação sobre a base da URL
-    base_url_info = {
+    "informações_adicionais": {
         "nota": "Estes endpoints podem ser acessados via o prefixo '/services' no domínio principal, por exemplo: https://fsw-ifc.brdrive.net/services/api/health"
     }
-    
-    return jsonify({
-        "serviço": "API de Envio de Email",
-        "versão": "1.0",
-        "endpoints": endpoints,
-        "informações_adicionais": base_url_info
-    })
+}
+
+DOCUMENTACAO_RAIZ = {
+    "mensagem": "API de Envio de Email",
+    "versão": "1.0",
+    "documentação": "/api/docs",
+    "endpoints": "/api/endpoints",
+    "status": "/api/health"
+}
+
+DOC_ENDPOINTS = DocumentoCacheado.de_objeto(DOCUMENTACAO_ENDPOINTS, DOCUMENTACAO_MODIFICADA_EM)
+DOC_RAIZ = DocumentoCacheado.de_objeto(DOCUMENTACAO_RAIZ, DOCUMENTACAO_MODIFICADA_EM)
+def montar_especificacao_swagger():
+    """Carrega static/swagger.json e injeta as definições geradas pelos esquemas."""
+    with open(os.path.join(app.static_folder, 'swagger.json'), 'rb') as arquivo:
+        especificacao = json_codec.loads(arquivo.read())
+    especificacao.setdefault("definitions", {})[ESQUEMA_ENVIO.nome] = ESQUEMA_ENVIO.para_swagger()
+    return especificacao
+
+# As definições injetadas vêm de services/esquema.py e de app.py
+DOC_SWAGGER = DocumentoCacheado.de_objeto(
+    montar_especificacao_swagger(),
+    modificacao_dos_arquivos(
+        os.path.join(app.static_folder, 'swagger.json'),
+        __file__,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'services', 'esquema.py'),
+    ),
+)
+
+# Rota para documentação de endpoints
+@api_bp.route('/endpoints', methods=['GET'])
+def api_endpoints():
+    """
+    Retorna uma listagem e documentação dos endpoints disponíveis.
+    """
+    return DOC_ENDPOINTS.responder(request)
 
 # Rota raiz para redirecionamento para a documentação
 @app.route('/', methods=['GET'])
 def root():
-    return jsonify({
-        "mensagem": "API de Envio de Email",
-        "versão": "1.0",
-        "documentação": "/api/docs",
-        "endpoints": "/api/endpoints",
-        "status": "/api/health"
-    })
+    return DOC_RAIZ.responder(request)
+
+# Especificação Swagger (tem precedência sobre a rota genérica de /static)
+@app.route('/static/swagger.json', methods=['GET'])
+def swagger_spec():
+    return DOC_SWAGGER.responder(request)
 
 # Registrar os blueprints
 app.register_blueprint(api_bp, url_prefix='/api')  # Mantém o url_prefix /api
@@ -396,6 +1084,13 @@ def server_error(e):
 def unsupported_media_type(error):
     return jsonify({"sucesso": False, "mensagem": "Content-Type não suportado"}), 415
 
+@app.errorhandler(ErroRequisicao)
+def erro_requisicao(e):
+    resposta = {"sucesso": False, "mensagem": e.mensagem}
+    if e.erros:
+        resposta["erros"] = e.erros
+    return jsonify(resposta), e.status
+
 @app.errorhandler(400)
 def bad_request(error):
     return jsonify({"sucesso": False, "mensagem": "Requisição inválida"}), 400
@@ -0,0 +1,70 @@
+"""
+Benchmark de inicialização a frio da aplicação.
+
+Cada rodada sobe um interpretador Python novo e mede, em milissegundos:
+  - import: tempo para importar o módulo `app` (o que o worker do Gunicorn faz)
+  - primeira_resposta: import + primeira requisição a /api/health
+
+Uso:
+    python benchmarks/startup_benchmark.py [--rodadas 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Código executado em cada subprocesso; imprime os tempos em JSON
+SONDA = """
+import json, time
+inicio = time.perf_counter()
+import app
+importado = time.perf_counter()
+with app.app.test_client() as cliente:
+    cliente.get('/api/health')
+respondido = time.perf_counter()
+print(json.dumps({
+    "import": (importado - inicio) * 1000,
+    "primeira_resposta": (respondido - inicio) * 1000,
+}))
+"""
+
+
+def medir_rodada() -> dict:
+    env = dict(os.environ)
+    # Valores fictícios apenas para que a aplicação suba sem um .env real
+    env.setdefault("EMAIL_HOST_USER", "benchmark@example.com")
+    env.setdefault("EMAIL_HOST_PASSWORD", "benchmark")
+    env.setdefault("LOG_LEVEL", "ERROR")
+    saida = subprocess.run(
+        [sys.executable, "-c", SONDA],
+        cwd=RAIZ,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rodadas", type=int, default=10, help="Número de inicializações medidas")
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.join(RAIZ, "logs"), exist_ok=True)
+    medidas = [medir_rodada() for _ in range(args.rodadas)]
+
+    print(f"Inicialização a frio ({args.rodadas} rodadas, em ms)")
+    print(f"{'etapa':<20}{'mín':>10}{'mediana':>10}{'máx':>10}")
+    for etapa in ("import", "primeira_resposta"):
+        valores = [m[etapa] for m in medidas]
+        print(f"{etapa:<20}{min(valores):>10.1f}{statistics.median(valores):>10.1f}{max(valores):>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,33 +4,36 @@
 # Mostrar informações iniciais
 echo "Starting application..."
 
-# Execute run_swagger.sh
-./run_swagger.sh
-
 # Verificar se está em modo de teste
-if [ "${TESTING}" != "True" ]; then
-    echo "Running tests before starting the application..."
-    
-    # Executar testes
-    ./run_tests.sh
-    
-    # Verificar resultado dos testes
-    TEST_RESULT=$?
-    if [ $TEST_RESULT -ne 0 ]; then
-        echo "Tests failed with exit code $TEST_RESULT. Aborting application startup."
-        exit $TEST_RESULT
-    fi
-    
-    echo "Tests passed successfully! Starting Gunicorn..."
-    
-    # Iniciar o Gunicorn
-    exec gunicorn \
-        --bind 0.0.0.0:${SERVICE_PORT:-5000} \
-        --workers ${GUNICORN_WORKERS:-2} \
-        --timeout ${GUNICORN_TIMEOUT:-120} \
-        --access-logfile - \
-        --error-logfile - \
-        app:app
-else
+if [ "${TESTING}" == "True" ]; then
     echo "Running in test mode. Skipping application startup."
-fi
\ No newline at end of file
+    exit 0
+fi
+
+# Os arquivos do Swagger UI e os testes são tratados na build da imagem
+# (ver Dockerfile); a imagem de produção não tem as dependências de teste.
+# RUN_STARTUP_CHECKS=True refaz a cópia do Swagger UI a cada inicialização.
+if [ "${RUN_STARTUP_CHECKS:-False}" == "True" ]; then
+    ./run_swagger.sh
+elif [ ! -f /app/static/swagger-ui/index.html ]; then
+    # Imagem antiga ou diretório static sobrescrito por volume
+    echo "Swagger UI assets not found in image, copying..."
+    ./run_swagger.sh
+fi
+
+echo "Starting Gunicorn..."
+
+# Iniciar o Gunicorn. Workers com threads: cada requisição de envio espera o
+# resultado na fila, e só com várias simultâneas por worker a fila acumula
+# mensagens para as faixas de prioridade ordenarem
+exec gunicorn \
+    --config gunicorn.conf.py \
+    --bind 0.0.0.0:${SERVICE_PORT:-5000} \
+    --workers ${GUNICORN_WORKERS:-2} \
+    --worker-class gthread \
+    --threads ${GUNICORN_THREADS:-16} \
+    --timeout ${GUNICORN_TIMEOUT:-120} \
+    --graceful-timeout ${GUNICORN_GRACEFUL_TIMEOUT:-60} \
+    --access-logfile - \
+    --error-logfile - \
+    app:app
@@ -0,0 +1,43 @@
+# gunicorn.conf.py
+# Hooks do ciclo de vida dos workers. As demais opções (bind, workers, timeout)
+# são passadas pelo entrypoint.sh.
+import signal
+import sys
+
+
+def post_worker_init(worker):
+    from gunicorn.arbiter import Arbiter
+    from app import iniciar_servicos, interromper_entrada, verificar_prazos_encerramento
+    try:
+        verificar_prazos_encerramento(worker.cfg.graceful_timeout)
+    except ValueError as e:
+        worker.log.error(str(e))
+        # Falha de boot: o arbiter encerra o Gunicorn em vez de recriar o worker
+        sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+    # Serviços em segundo plano (agendador) rodam em cada worker
+    iniciar_servicos()
+
+    # O SIGTERM do Gunicorn só marca o worker para sair e espera as requisições
+    # em andamento; a entrada de mensagens é fechada já nesse momento
+    tratador_gunicorn = signal.getsignal(signal.SIGTERM)
+
+    def ao_receber_sigterm(signum, frame):
+        interromper_entrada()
+        if callable(tratador_gunicorn):
+            tratador_gunicorn(signum, frame)
+
+    signal.signal(signal.SIGTERM, ao_receber_sigterm)
+
+
+def worker_int(worker):
+    # SIGINT/SIGQUIT: encerramento imediato, seguido do worker_exit
+    from app import interromper_entrada
+    interromper_entrada()
+
+
+def worker_exit(server, worker):
+    # Drena a fila de envio, persiste o que sobrar e fecha as conexões SMTP.
+    # ENVIO_TIMEOUT + ENCERRAMENTO_PRAZO deve ser menor que o --graceful-timeout.
+    from app import encerrar_servicos
+    encerrar_servicos()
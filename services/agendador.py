@@ -0,0 +1,331 @@
+# services/agendador.py
+"""
+Agendador de envios com data marcada.
+
+Os agendamentos ficam em uma tabela SQLite indexada por (status, enviar_em),
+que funciona como um heap persistente: sobrevive a reinicializações e é
+compartilhada entre os workers do Gunicorn. Em memória, cada worker mantém um
+min-heap (heapq) apenas com a janela dos próximos minutos, reabastecida
+periodicamente por uma consulta ao índice; inserção e remoção custam O(log n)
+mesmo com centenas de milhares de agendamentos pendentes.
+
+Um agendamento vencido só é enviado pelo worker que conseguir reservá-lo no
+banco (UPDATE condicional), o que evita envios duplicados entre processos e
+torna o cancelamento válido de qualquer worker. As liberações passam por um
+balde de fichas (`taxa_maxima` por segundo), espalhando os picos de horário
+cheio em vez de despejá-los de uma vez no envio.
+"""
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger("agendador")
+
+PENDENTE = "pendente"
+ENVIANDO = "enviando"
+CANCELADO = "cancelado"
+
+ESQUEMA_SQL = """
+CREATE TABLE IF NOT EXISTS agendamentos (
+    id TEXT PRIMARY KEY,
+    enviar_em REAL NOT NULL,
+    status TEXT NOT NULL,
+    chave TEXT,
+    dados TEXT NOT NULL,
+    criado_em REAL NOT NULL,
+    reservado_em REAL
+);
+CREATE INDEX IF NOT EXISTS idx_agendamentos_status_enviar_em
+    ON agendamentos (status, enviar_em);
+"""
+
+
+def novo_id() -> str:
+    """Identificador de mensagem usado em todo o fluxo de envio."""
+    return uuid.uuid4().hex
+
+
+class Agendador:
+    """
+    Agendador persistente de envios.
+
+    Args:
+        caminho_db: Arquivo SQLite dos agendamentos
+        enviar: Função chamada com os dados de cada agendamento vencido; pode
+            retornar um Future quando apenas enfileira o envio
+        taxa_maxima: Liberações por segundo para o envio
+        janela: Segundos à frente carregados no heap em memória
+        tempo_reserva: Segundos após os quais uma reserva abandonada (worker
+            que morreu no meio do envio) volta a ficar pendente
+    """
+
+    def __init__(self, caminho_db: str, enviar: Callable[[Dict[str, Any]], Any],
+                 taxa_maxima: float = 20.0, janela: float = 300.0,
+                 tempo_reserva: float = 600.0):
+        self.caminho_db = caminho_db
+        self.enviar = enviar
+        self.taxa_maxima = taxa_maxima
+        self.janela = janela
+        self.tempo_reserva = tempo_reserva
+        self._heap: List[Tuple[float, str]] = []
+        self._no_heap: Set[str] = set()
+        self._cancelados: Set[str] = set()
+        self._condicao = threading.Condition()
+        self._lock_db = threading.Lock()
+        self._conexao: Optional[sqlite3.Connection] = None
+        self._thread: Optional[threading.Thread] = None
+        self._parar = threading.Event()
+        self._fichas = 1.0
+        self._ultima_ficha = time.monotonic()
+
+    # Banco de dados
+
+    def _db(self) -> sqlite3.Connection:
+        # Conexão aberta sob demanda: importar a aplicação não cria arquivos
+        if self._conexao is None:
+            diretorio = os.path.dirname(self.caminho_db)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            conexao = sqlite3.connect(self.caminho_db, timeout=30, check_same_thread=False,
+                                      isolation_level=None)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            conexao.executescript(ESQUEMA_SQL)
+            self._conexao = conexao
+        return self._conexao
+
+    def _alterar(self, sql: str, parametros: tuple = ()) -> int:
+        """Executa um comando e retorna o número de linhas afetadas."""
+        with self._lock_db:
+            return self._db().execute(sql, parametros).rowcount
+
+    def _consultar(self, sql: str, parametros: tuple = ()) -> List[tuple]:
+        with self._lock_db:
+            return self._db().execute(sql, parametros).fetchall()
+
+    # API pública
+
+    def agendar(self, enviar_em: float, dados: Dict[str, Any], chave: Optional[str] = None,
+                id: Optional[str] = None) -> str:
+        """Persiste um agendamento e o coloca no heap se estiver dentro da janela."""
+        id = id or novo_id()
+        self._alterar(
+            "INSERT INTO agendamentos (id, enviar_em, status, chave, dados, criado_em) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (id, enviar_em, PENDENTE, chave, json.dumps(dados, ensure_ascii=False), time.time()),
+        )
+        if enviar_em <= time.time() + self.janela:
+            self._empilhar(enviar_em, id)
+        return id
+
+    def devolver(self, mensagens: Iterable[Dict[str, Any]]) -> int:
+        """
+        Persiste mensagens que não chegaram a ser enviadas (ex.: as que ficaram
+        na fila no encerramento do worker) para envio imediato por qualquer
+        worker. Substitui a reserva de um agendamento com o mesmo id.
+        """
+        agora = time.time()
+        linhas = [
+            (dados["id"], agora, PENDENTE, dados.get("chave"), json.dumps(dados, ensure_ascii=False), agora)
+            for dados in mensagens
+        ]
+        with self._lock_db:
+            self._db().executemany(
+                "INSERT INTO agendamentos (id, enviar_em, status, chave, dados, criado_em) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET enviar_em = excluded.enviar_em, "
+                "status = excluded.status, dados = excluded.dados, reservado_em = NULL",
+                linhas,
+            )
+        return len(linhas)
+
+    def cancelar(self, id: str, chave: Optional[str] = None) -> bool:
+        """Cancela um agendamento pendente. Com `chave`, só cancela os daquela chave."""
+        if chave is None:
+            alterados = self._alterar(
+                "UPDATE agendamentos SET status = ? WHERE id = ? AND status = ?",
+                (CANCELADO, id, PENDENTE),
+            )
+        else:
+            alterados = self._alterar(
+                "UPDATE agendamentos SET status = ? WHERE id = ? AND status = ? AND chave = ?",
+                (CANCELADO, id, PENDENTE, chave),
+            )
+        if alterados:
+            # Remoção preguiçosa: a entrada do heap é descartada quando sair. Ids
+            # fora do heap deste worker não entram no conjunto (ficariam nele para
+            # sempre); se outro worker já os carregou, a reserva em _despachar falha.
+            with self._condicao:
+                if id in self._no_heap:
+                    self._cancelados.add(id)
+            return True
+        return False
+
+    def consultar(self, id: str) -> Optional[Dict[str, Any]]:
+        linhas = self._consultar(
+            "SELECT id, enviar_em, status, chave FROM agendamentos WHERE id = ?", (id,)
+        )
+        if not linhas:
+            return None
+        linha = linhas[0]
+        return {"id": linha[0], "enviar_em": linha[1], "status": linha[2], "chave": linha[3]}
+
+    def pendentes(self) -> int:
+        return self._consultar(
+            "SELECT COUNT(*) FROM agendamentos WHERE status = ?", (PENDENTE,)
+        )[0][0]
+
+    def iniciar(self) -> None:
+        """Inicia a thread de despacho (idempotente)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar_laco, name="agendador", daemon=True)
+        self._thread.start()
+        logger.info(f"Agendador iniciado ({self.caminho_db})")
+
+    def parar(self, timeout: Optional[float] = None) -> None:
+        self._parar.set()
+        with self._condicao:
+            self._condicao.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def executar_vencidos(self, agora: Optional[float] = None) -> int:
+        """Despacha, na thread atual, todos os agendamentos vencidos. Retorna quantos foram enviados."""
+        agora = agora if agora is not None else time.time()
+        self._recarregar_janela(agora)
+        enviados = 0
+        while True:
+            id = self._desempilhar_vencido(agora)
+            if id is None:
+                return enviados
+            if self._despachar(id):
+                enviados += 1
+
+    # Heap em memória
+
+    def _empilhar(self, enviar_em: float, id: str) -> None:
+        with self._condicao:
+            if id in self._no_heap:
+                return
+            heapq.heappush(self._heap, (enviar_em, id))
+            self._no_heap.add(id)
+            # Acordar o laço se este passou a ser o próximo da fila
+            if self._heap[0][1] == id:
+                self._condicao.notify()
+
+    def _desempilhar_vencido(self, agora: float) -> Optional[str]:
+        with self._condicao:
+            while self._heap and self._heap[0][0] <= agora:
+                _, id = heapq.heappop(self._heap)
+                self._no_heap.discard(id)
+                if id in self._cancelados:
+                    self._cancelados.discard(id)
+                    continue
+                return id
+            return None
+
+    def _recarregar_janela(self, agora: float) -> None:
+        # Reservas abandonadas por um worker que morreu voltam para a fila
+        self._alterar(
+            "UPDATE agendamentos SET status = ?, reservado_em = NULL "
+            "WHERE status = ? AND reservado_em < ?",
+            (PENDENTE, ENVIANDO, agora - self.tempo_reserva),
+        )
+        linhas = self._consultar(
+            "SELECT enviar_em, id FROM agendamentos WHERE status = ? AND enviar_em <= ? "
+            "ORDER BY enviar_em",
+            (PENDENTE, agora + self.janela),
+        )
+        for enviar_em, id in linhas:
+            self._empilhar(enviar_em, id)
+
+    # Despacho
+
+    def _aguardar_ficha(self) -> None:
+        # Balde de fichas: no máximo `taxa_maxima` liberações por segundo
+        while not self._parar.is_set():
+            agora = time.monotonic()
+            self._fichas = min(1.0, self._fichas + (agora - self._ultima_ficha) * self.taxa_maxima)
+            self._ultima_ficha = agora
+            if self._fichas >= 1.0:
+                self._fichas -= 1.0
+                return
+            time.sleep((1.0 - self._fichas) / self.taxa_maxima)
+
+    def _despachar(self, id: str) -> bool:
+        # Reserva atômica: só um worker ganha o agendamento
+        reservado = self._alterar(
+            "UPDATE agendamentos SET status = ?, reservado_em = ? WHERE id = ? AND status = ?",
+            (ENVIANDO, time.time(), id, PENDENTE),
+        )
+        if not reservado:
+            return False
+        linhas = self._consultar("SELECT dados FROM agendamentos WHERE id = ?", (id,))
+        dados = json.loads(linhas[0][0])
+        dados["id"] = id
+        try:
+            retorno = self.enviar(dados)
+        except Exception:
+            if self._parar.is_set():
+                # Encerrando: o destino pode já recusar mensagens; o agendamento
+                # volta a ficar pendente em vez de ser perdido
+                self._alterar(
+                    "UPDATE agendamentos SET status = ?, reservado_em = NULL WHERE id = ?",
+                    (PENDENTE, id),
+                )
+                return False
+            logger.exception(f"Erro ao enviar agendamento {id}")
+            retorno = None
+        # O resultado do envio é registrado pelo próprio fluxo de envio. Se o
+        # envio foi apenas enfileirado (retornou um Future), o agendamento só
+        # sai do banco quando terminar; se o processo morrer antes, a reserva
+        # expira e ele volta a ficar pendente.
+        if hasattr(retorno, "add_done_callback"):
+            retorno.add_done_callback(lambda _: self._remover(id))
+        else:
+            self._remover(id)
+        return True
+
+    def _remover(self, id: str) -> None:
+        try:
+            self._alterar("DELETE FROM agendamentos WHERE id = ?", (id,))
+        except sqlite3.Error:
+            logger.exception(f"Falha ao remover agendamento {id}")
+
+    def _executar_laco(self) -> None:
+        proxima_recarga = 0.0
+        while not self._parar.is_set():
+            agora = time.time()
+            if agora >= proxima_recarga:
+                try:
+                    self._recarregar_janela(agora)
+                except sqlite3.Error:
+                    logger.exception("Falha ao recarregar agendamentos")
+                proxima_recarga = agora + self.janela / 2
+
+            id = self._desempilhar_vencido(agora)
+            if id is None:
+                with self._condicao:
+                    # Conferido sob o lock: parar() pode ter notificado antes
+                    # de o laço chegar ao wait
+                    if self._parar.is_set():
+                        break
+                    espera = proxima_recarga - agora
+                    if self._heap:
+                        espera = min(espera, self._heap[0][0] - agora)
+                    self._condicao.wait(timeout=max(espera, 0.0))
+                continue
+
+            self._aguardar_ficha()
+            try:
+                self._despachar(id)
+            except sqlite3.Error:
+                logger.exception(f"Falha ao despachar agendamento {id}")
@@ -0,0 +1,275 @@
+# services/anexos.py
+"""
+Anexos endereçados por conteúdo e transmitidos em fluxo para o servidor SMTP.
+
+Cada arquivo enviado é guardado uma única vez, com o nome igual ao seu hash
+SHA-256; enviar a mesma fatura para milhares de destinatários reaproveita o
+mesmo arquivo. Na primeira vez em que é anexado, o conteúdo é codificado em
+base64 (linhas de 76 caracteres, CRLF) em blocos lidos por mmap, e o
+resultado também fica guardado ao lado do original.
+
+No envio, a mensagem é montada como uma sequência de segmentos: os
+cabeçalhos e a parte HTML em memória, e cada anexo lido do arquivo já
+codificado por mmap e escrito em blocos direto no socket SMTP. O consumo de
+memória não depende do tamanho dos anexos.
+"""
+import base64
+import hashlib
+import mimetypes
+import mmap
+import os
+import re
+import smtplib
+import tempfile
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.policy import compat32
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Union
+
+# Política padrão das mensagens MIME, com fins de linha CRLF como no SMTP
+POLITICA_SMTP = compat32.clone(linesep="\r\n")
+
+# Blocos de 57 bytes viram exatamente uma linha de 76 caracteres em base64
+BLOCO_LEITURA = 57 * 1024
+BLOCO_ENVIO = 64 * 1024
+
+_HASH_VALIDO = re.compile(r"^[0-9a-f]{64}$")
+# Tipo MIME (RFC 6838, restricted-name): só ASCII, pois vai no cabeçalho e na chave do corpo
+_TIPO_VALIDO = re.compile(r"^[A-Za-z0-9][A-Za-z0-9!#$&^_.+-]{0,126}/[A-Za-z0-9][A-Za-z0-9!#$&^_.+-]{0,126}\Z")
+_INICIO_DE_LINHA_COM_PONTO = re.compile(rb"(?m)^\.")
+
+
+def hash_valido(valor: Any) -> bool:
+    return isinstance(valor, str) and _HASH_VALIDO.match(valor) is not None
+
+
+def referencias_validas(referencias: List[Any]) -> bool:
+    """Valida as referências de anexos do payload: [{"hash", "nome", "tipo"?}]."""
+    for referencia in referencias:
+        if not isinstance(referencia, dict) or not hash_valido(referencia.get("hash")):
+            return False
+        nome = referencia.get("nome")
+        if not isinstance(nome, str) or not 0 < len(nome) <= 255 or not nome.isprintable():
+            return False
+        tipo = referencia.get("tipo")
+        if tipo is not None and (not isinstance(tipo, str) or not _TIPO_VALIDO.match(tipo)):
+            return False
+    return True
+
+
+def _copiar_em_blocos(origem: bytes, destino: BinaryIO) -> None:
+    # origem é um mmap (ou bytes): cada fatia é um bloco lido sob demanda
+    for inicio in range(0, len(origem), BLOCO_LEITURA):
+        bloco = base64.encodebytes(origem[inicio:inicio + BLOCO_LEITURA])
+        destino.write(bloco.replace(b"\n", b"\r\n"))
+
+
+class Anexo:
+    """Anexo resolvido no armazém, pronto para ser transmitido."""
+
+    def __init__(self, armazem: "ArmazemAnexos", hash: str, nome: str, tipo: Optional[str] = None):
+        self.armazem = armazem
+        self.hash = hash
+        self.nome = nome
+        self.tipo = tipo or mimetypes.guess_type(nome)[0] or "application/octet-stream"
+
+    def cabecalhos(self) -> bytes:
+        """Cabeçalhos MIME da parte do anexo, terminados pela linha em branco."""
+        principal, _, secundario = self.tipo.partition("/")
+        parte = MIMEBase(principal, secundario or "octet-stream")
+        parte["Content-Transfer-Encoding"] = "base64"
+        nome = self.nome if self.nome.isascii() else ("utf-8", "", self.nome)
+        parte.add_header("Content-Disposition", "attachment", filename=nome)
+        # Sem corpo, o gerador emite apenas os cabeçalhos e a linha em branco
+        return parte.as_bytes(policy=POLITICA_SMTP)
+
+    def transmitir(self, escrever: Callable[[memoryview], Any]) -> None:
+        """Escreve o conteúdo codificado em blocos, sem copiá-lo para a memória."""
+        with open(self.armazem.codificado(self.hash), "rb") as arquivo:
+            if os.fstat(arquivo.fileno()).st_size == 0:
+                return
+            with mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                with memoryview(mapa) as visao:
+                    for inicio in range(0, len(visao), BLOCO_ENVIO):
+                        # Cada fatia é liberada logo após a escrita, para o mmap poder fechar
+                        with visao[inicio:inicio + BLOCO_ENVIO] as bloco:
+                            escrever(bloco)
+
+    def para_dict(self) -> Dict[str, str]:
+        return {"hash": self.hash, "nome": self.nome, "tipo": self.tipo}
+
+
+class ArmazemAnexos:
+    """
+    Armazém de anexos endereçado por conteúdo.
+
+    Args:
+        diretorio: Diretório dos arquivos (um subdiretório por prefixo do hash)
+    """
+
+    def __init__(self, diretorio: str):
+        self.diretorio = diretorio
+
+    def caminho(self, hash: str) -> str:
+        return os.path.join(self.diretorio, hash[:2], hash)
+
+    def existe(self, hash: str) -> bool:
+        return hash_valido(hash) and os.path.exists(self.caminho(hash))
+
+    def tamanho(self, hash: str) -> int:
+        return os.path.getsize(self.caminho(hash))
+
+    def _gravar_atomico(self, caminho: str, escrever: Callable[[BinaryIO], None]) -> None:
+        # Arquivo temporário no mesmo diretório + os.replace: leitores nunca veem
+        # um arquivo pela metade, e gravações simultâneas do mesmo hash são inofensivas
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix=".tmp")
+        try:
+            with os.fdopen(descritor, "wb") as arquivo:
+                escrever(arquivo)
+            os.replace(temporario, caminho)
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+    def salvar(self, fluxo: BinaryIO) -> str:
+        """Copia o fluxo em blocos para o armazém e retorna o hash do conteúdo."""
+        os.makedirs(self.diretorio, exist_ok=True)
+        resumo = hashlib.sha256()
+        descritor, temporario = tempfile.mkstemp(dir=self.diretorio, suffix=".tmp")
+        try:
+            with os.fdopen(descritor, "wb") as arquivo:
+                while True:
+                    bloco = fluxo.read(BLOCO_LEITURA)
+                    if not bloco:
+                        break
+                    resumo.update(bloco)
+                    arquivo.write(bloco)
+            hash = resumo.hexdigest()
+            destino = self.caminho(hash)
+            if os.path.exists(destino):
+                # Conteúdo já armazenado: deduplicado
+                os.remove(temporario)
+            else:
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                os.replace(temporario, destino)
+            return hash
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+    def codificado(self, hash: str) -> str:
+        """Caminho do conteúdo em base64, codificado na primeira vez em que é pedido."""
+        caminho = self.caminho(hash) + ".b64"
+        if not os.path.exists(caminho):
+            def codificar(destino: BinaryIO) -> None:
+                with open(self.caminho(hash), "rb") as origem:
+                    if os.fstat(origem.fileno()).st_size == 0:
+                        return
+                    with mmap.mmap(origem.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                        _copiar_em_blocos(mapa, destino)
+            self._gravar_atomico(caminho, codificar)
+        return caminho
+
+    def resolver(self, referencias: Optional[Iterable[Dict[str, Any]]]) -> List[Anexo]:
+        """Converte as referências do payload ({"hash", "nome", "tipo"}) em anexos."""
+        anexos = []
+        for referencia in referencias or ():
+            if not self.existe(referencia.get("hash")):
+                raise ValueError(f"Anexo não encontrado: {referencia.get('hash')}")
+            anexos.append(Anexo(self, referencia["hash"], referencia.get("nome") or referencia["hash"],
+                                referencia.get("tipo")))
+        return anexos
+
+
+Segmento = Union[bytes, Anexo]
+
+
+def chave_do_corpo(corpo: str, anexos: Optional[List[Anexo]] = None) -> bytes:
+    """
+    Resumo de tudo que determina os bytes do corpo MIME (HTML e anexos), sem os
+    cabeçalhos: é o mesmo para todos os destinatários de um envio em massa.
+    """
+    resumo = hashlib.blake2b(corpo.encode("utf-8"), digest_size=16)
+    for anexo in anexos or ():
+        resumo.update(b"\0" + anexo.hash.encode("ascii") + b"\0" + anexo.nome.encode("utf-8")
+                      + b"\0" + anexo.tipo.encode("ascii"))
+    return resumo.digest()
+
+
+def fronteira_para(chave_corpo: bytes) -> str:
+    """
+    Fronteira MIME determinística: o mesmo corpo gera sempre os mesmos bytes
+    (em uma nova tentativa e para cada destinatário). "=_" não ocorre em
+    base64 nem em quoted-printable, então a fronteira não aparece dentro das partes.
+    """
+    return f"=_fsw_{chave_corpo.hex()[:32]}"
+
+
+def definir_fronteiras(mensagem: MIMEMultipart, fronteira: str) -> None:
+    """Aplica `fronteira` à mensagem e fronteiras derivadas às partes multipart internas."""
+    mensagem.set_boundary(fronteira)
+    for i, parte in enumerate(mensagem.walk()):
+        if parte is not mensagem and parte.is_multipart():
+            parte.set_boundary(f"{fronteira}_{i}")
+
+
+def montar_segmentos(mensagem: MIMEMultipart, anexos: List[Anexo], fronteira: str) -> List[Segmento]:
+    """
+    Serializa `mensagem` (cabeçalhos e partes de texto, codificadas em base64) e
+    intercala os anexos como segmentos a serem transmitidos em fluxo.
+    """
+    definir_fronteiras(mensagem, fronteira)
+    serializada = mensagem.as_bytes(policy=POLITICA_SMTP)
+    fechamento = f"--{fronteira}--".encode("ascii")
+    corte = serializada.rindex(fechamento)
+
+    segmentos: List[Segmento] = [serializada[:corte]]
+    for anexo in anexos:
+        segmentos.append(f"--{fronteira}\r\n".encode("ascii") + anexo.cabecalhos())
+        segmentos.append(anexo)
+    segmentos.append(fechamento + b"\r\n")
+    return segmentos
+
+
+def _preparar_dados(segmento: bytes) -> bytes:
+    # Mesmo tratamento do smtplib.sendmail: fins de linha CRLF e ponto duplicado
+    # no início de linha. Os anexos em base64 dispensam os dois.
+    segmento = re.sub(rb"\r\n|\r|\n", b"\r\n", segmento)
+    return _INICIO_DE_LINHA_COM_PONTO.sub(b"..", segmento)
+
+
+def transmitir_mensagem(servidor: smtplib.SMTP, remetente: str, destinatario: str,
+                        segmentos: List[Segmento]) -> Dict[str, Any]:
+    """
+    Envia a mensagem em segmentos pela conexão SMTP. Equivalente ao
+    `sendmail` para um destinatário, mas sem montar a mensagem inteira em memória.
+    """
+    servidor.ehlo_or_helo_if_needed()
+    codigo, resposta = servidor.mail(remetente)
+    if codigo != 250:
+        servidor.rset()
+        raise smtplib.SMTPSenderRefused(codigo, resposta, remetente)
+    codigo, resposta = servidor.rcpt(destinatario)
+    if codigo not in (250, 251):
+        servidor.rset()
+        raise smtplib.SMTPRecipientsRefused({destinatario: (codigo, resposta)})
+    servidor.putcmd("data")
+    codigo, resposta = servidor.getreply()
+    if codigo != 354:
+        servidor.rset()
+        raise smtplib.SMTPDataError(codigo, resposta)
+
+    escrever = servidor.sock.sendall
+    for segmento in segmentos:
+        if isinstance(segmento, Anexo):
+            segmento.transmitir(escrever)
+        else:
+            escrever(_preparar_dados(segmento))
+    escrever(b".\r\n")
+    codigo, resposta = servidor.getreply()
+    if codigo != 250:
+        raise smtplib.SMTPDataError(codigo, resposta)
+    return {}
@@ -0,0 +1,273 @@
+# services/chaves_api.py
+"""
+Registro de chaves de API com múltiplos clientes.
+
+As chaves têm o formato `<prefixo>.<segredo>`. O prefixo é público e indexa o
+registro em um dicionário (busca O(1)); apenas o hash SHA-256 da chave completa
+é armazenado e comparado em tempo constante. Como as chaves são geradas com
+alta entropia, um hash rápido é suficiente e mantém a autenticação na casa dos
+microssegundos.
+
+O registro é carregado de um arquivo JSON ou de um banco SQLite (pela extensão
+.db/.sqlite/.sqlite3) e recarregado automaticamente quando o arquivo muda.
+
+Formato do arquivo JSON:
+
+    {"chaves": [{"prefixo": "fsk_1a2b3c4d", "hash": "<sha256 da chave>",
+                 "nome": "Portal", "limite": "100 per hour",
+                 "remetente": "Portal <portal@example.com>",
+                 "dominios_permitidos": ["example.com"], "ativa": true,
+                 "webhook_url": "https://portal.example.com/eventos",
+                 "webhook_segredo": "<segredo HMAC>", "admin": false}]}
+
+Chaves com "admin": true (e a chave global API_KEY) também administram o que é
+compartilhado por todos os clientes: lista de supressão, métricas e memória.
+
+Uso pela linha de comando, para gerar uma nova chave:
+
+    python -m services.chaves_api gerar --arquivo config/api_keys.json --nome Portal
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from limits import RateLimitItem, parse_many
+
+logger = logging.getLogger("chaves_api")
+
+EXTENSOES_SQLITE = (".db", ".sqlite", ".sqlite3")
+
+
+def hash_chave(chave: str) -> str:
+    """Hash armazenado para uma chave de API."""
+    return hashlib.sha256(chave.encode("utf-8")).hexdigest()
+
+
+class ChaveApi:
+    """Registro de uma chave de API e das políticas associadas a ela."""
+
+    def __init__(self, prefixo: str, hash: str, nome: str = "",
+                 limite: Optional[str] = None, remetente: Optional[str] = None,
+                 dominios_permitidos: Optional[Iterable[str]] = None,
+                 ativa: bool = True, webhook_url: Optional[str] = None,
+                 webhook_segredo: Optional[str] = None, admin: bool = False):
+        self.prefixo = prefixo
+        self.hash = hash
+        self.nome = nome or prefixo
+        self.limite = limite
+        # Limites já convertidos, para não reprocessar o texto a cada requisição
+        self.limites: Tuple[RateLimitItem, ...] = tuple(parse_many(limite)) if limite else ()
+        self.remetente = remetente
+        self.dominios_permitidos: FrozenSet[str] = frozenset(
+            d.lower() for d in (dominios_permitidos or ())
+        )
+        self.ativa = ativa
+        # Destino dos eventos de envio (services.webhooks) e segredo da assinatura HMAC
+        self.webhook_url = webhook_url
+        self.webhook_segredo = webhook_segredo
+        # Acesso às rotas que afetam todos os clientes
+        self.admin = admin
+
+    def permite_destinatario(self, destinatario: str) -> bool:
+        """Verifica a política de domínios permitidos para o destinatário."""
+        if not self.dominios_permitidos:
+            return True
+        return destinatario.rpartition("@")[2].lower() in self.dominios_permitidos
+
+    @classmethod
+    def de_dict(cls, dados: Dict) -> "ChaveApi":
+        return cls(
+            prefixo=dados["prefixo"],
+            hash=dados["hash"],
+            nome=dados.get("nome", ""),
+            limite=dados.get("limite"),
+            remetente=dados.get("remetente"),
+            dominios_permitidos=dados.get("dominios_permitidos"),
+            ativa=dados.get("ativa", True),
+            webhook_url=dados.get("webhook_url"),
+            webhook_segredo=dados.get("webhook_segredo"),
+            admin=bool(dados.get("admin", False)),
+        )
+
+    def para_dict(self) -> Dict:
+        return {
+            "prefixo": self.prefixo,
+            "hash": self.hash,
+            "nome": self.nome,
+            "limite": self.limite,
+            "remetente": self.remetente,
+            "dominios_permitidos": sorted(self.dominios_permitidos),
+            "ativa": self.ativa,
+            "webhook_url": self.webhook_url,
+            "webhook_segredo": self.webhook_segredo,
+            "admin": self.admin,
+        }
+
+
+def gerar_chave(nome: str, **politicas) -> Tuple[str, ChaveApi]:
+    """Gera uma nova chave. Retorna a chave em texto (exibida uma única vez) e o registro."""
+    prefixo = f"fsk_{secrets.token_hex(4)}"
+    chave = f"{prefixo}.{secrets.token_urlsafe(32)}"
+    return chave, ChaveApi(prefixo=prefixo, hash=hash_chave(chave), nome=nome, **politicas)
+
+
+def _ler_json(caminho: str) -> List[ChaveApi]:
+    with open(caminho, "r", encoding="utf-8") as arquivo:
+        dados = json.load(arquivo)
+    return [ChaveApi.de_dict(item) for item in dados.get("chaves", [])]
+
+
+def _ler_sqlite(caminho: str) -> List[ChaveApi]:
+    # Tabela esperada: chaves_api(prefixo, hash, nome, limite, remetente,
+    # dominios_permitidos [JSON], ativa[, webhook_url, webhook_segredo, admin])
+    conexao = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)
+    try:
+        conexao.row_factory = sqlite3.Row
+        linhas = conexao.execute("SELECT * FROM chaves_api").fetchall()
+    finally:
+        conexao.close()
+    chaves = []
+    for linha in linhas:
+        dados = dict(linha)
+        dados["dominios_permitidos"] = json.loads(dados.get("dominios_permitidos") or "[]")
+        dados["ativa"] = bool(dados.get("ativa", 1))
+        chaves.append(ChaveApi.de_dict(dados))
+    return chaves
+
+
+class RegistroChaves:
+    """
+    Índice de chaves de API por prefixo, com recarga automática.
+
+    A verificação de mudança no arquivo (um os.stat) acontece no máximo uma vez
+    a cada `intervalo_recarga` segundos; entre verificações, autenticar é só uma
+    busca em dicionário mais um hash.
+    """
+
+    def __init__(self, caminho: Optional[str] = None, intervalo_recarga: float = 5.0):
+        self.caminho = caminho
+        self.intervalo_recarga = intervalo_recarga
+        self._chaves: Dict[str, ChaveApi] = {}
+        self._mtime: Optional[float] = None
+        self._proxima_verificacao = 0.0
+        self._lock = threading.Lock()
+        if caminho:
+            self.recarregar()
+
+    def __len__(self) -> int:
+        return len(self._chaves)
+
+    def recarregar(self) -> None:
+        """Relê o arquivo de chaves. Em caso de erro, mantém as chaves atuais."""
+        try:
+            mtime = os.path.getmtime(self.caminho)
+            if self.caminho.endswith(EXTENSOES_SQLITE):
+                chaves = _ler_sqlite(self.caminho)
+            else:
+                chaves = _ler_json(self.caminho)
+        except FileNotFoundError:
+            logger.warning(f"Arquivo de chaves de API não encontrado: {self.caminho}")
+            return
+        except Exception as e:
+            logger.error(f"Falha ao carregar chaves de API de {self.caminho}: {str(e)}")
+            return
+        # Troca atômica da referência: leitores nunca veem um índice parcial
+        self._chaves = {chave.prefixo: chave for chave in chaves}
+        self._mtime = mtime
+        logger.info(f"{len(chaves)} chaves de API carregadas de {self.caminho}")
+
+    def _verificar_recarga(self) -> None:
+        agora = time.monotonic()
+        if agora < self._proxima_verificacao:
+            return
+        # Apenas uma thread verifica; as demais seguem com o índice atual
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._proxima_verificacao = agora + self.intervalo_recarga
+            try:
+                mtime = os.path.getmtime(self.caminho)
+            except OSError:
+                return
+            if mtime != self._mtime:
+                self.recarregar()
+        finally:
+            self._lock.release()
+
+    def autenticar(self, chave: str) -> Optional[ChaveApi]:
+        """Retorna o registro da chave, ou None se ela for desconhecida, inválida ou inativa."""
+        if self.caminho:
+            self._verificar_recarga()
+        prefixo, separador, _ = chave.partition(".")
+        if not separador:
+            return None
+        registro = self._chaves.get(prefixo)
+        if registro is None or not registro.ativa:
+            return None
+        if not secrets.compare_digest(hash_chave(chave), registro.hash):
+            return None
+        return registro
+
+    def por_prefixo(self, prefixo: str) -> Optional[ChaveApi]:
+        """Registro da chave com o prefixo, sem autenticação (ex.: para achar o webhook)."""
+        if self.caminho:
+            self._verificar_recarga()
+        return self._chaves.get(prefixo)
+
+
+def _adicionar_ao_arquivo(caminho: str, registro: ChaveApi) -> None:
+    dados = {"chaves": []}
+    if os.path.exists(caminho):
+        with open(caminho, "r", encoding="utf-8") as arquivo:
+            dados = json.load(arquivo)
+    dados.setdefault("chaves", []).append(registro.para_dict())
+    # Escrita atômica para que a recarga nunca leia um arquivo pela metade
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "w", encoding="utf-8") as arquivo:
+        json.dump(dados, arquivo, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Gerenciamento de chaves de API")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    gerar = subcomandos.add_parser("gerar", help="Gera uma nova chave e a adiciona ao arquivo JSON")
+    gerar.add_argument("--arquivo", required=True, help="Arquivo JSON de chaves")
+    gerar.add_argument("--nome", required=True, help="Nome do cliente")
+    gerar.add_argument("--limite", help='Cota da chave, ex.: "100 per hour;1000 per day"')
+    gerar.add_argument("--remetente", help="Remetente usado nos emails desta chave")
+    gerar.add_argument("--dominio", action="append", dest="dominios_permitidos",
+                       help="Domínio de destinatário permitido (pode repetir)")
+    gerar.add_argument("--webhook", dest="webhook_url",
+                       help="URL que recebe os eventos de envio desta chave")
+    gerar.add_argument("--admin", action="store_true",
+                       help="Permite administrar a lista de supressão e ver métricas e memória")
+    args = parser.parse_args(argv)
+
+    chave, registro = gerar_chave(
+        args.nome,
+        limite=args.limite,
+        remetente=args.remetente,
+        dominios_permitidos=args.dominios_permitidos,
+        webhook_url=args.webhook_url,
+        webhook_segredo=secrets.token_urlsafe(32) if args.webhook_url else None,
+        admin=args.admin,
+    )
+    _adicionar_ao_arquivo(args.arquivo, registro)
+    print(f"Chave gerada para {registro.nome} (guarde-a, ela não será exibida novamente):")
+    print(chave)
+    if registro.webhook_segredo:
+        print(f"Segredo da assinatura dos webhooks: {registro.webhook_segredo}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
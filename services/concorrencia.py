@@ -0,0 +1,121 @@
+# services/concorrencia.py
+"""
+Limite adaptativo de envios simultâneos.
+
+Um número fixo de envios em paralelo é baixo demais quando o relay responde
+rápido e alto demais quando ele começa a nos estrangular. O LimiteAdaptativo
+observa a duração de cada envio e as falhas temporárias (conexão recusada ou
+derrubada, timeout, respostas 4xx como 421 e 451) e ajusta o limite sozinho,
+na linha do Gradient2 da biblioteca concurrency-limits da Netflix:
+
+- As durações são agrupadas em janelas de `amostras` envios. A média da
+  janela (RTT curto) é comparada com uma média móvel lenta (RTT longo):
+  gradiente = tolerancia * longo / curto, entre 0,5 e 1. Com o relay folgado
+  o gradiente é 1 e o limite cresce `sqrt(limite)` por janela; quando as
+  respostas ficam mais lentas que o normal, o limite encolhe na proporção.
+- Uma janela com falha temporária reduz o limite multiplicativamente
+  (`recuo`), como no AIMD.
+- Enquanto menos da metade do limite está em uso, ele não cresce: a vazão
+  está limitada pela demanda, não pelo relay.
+
+O limite atual fica no medidor `concorrencia_limite`.
+"""
+import math
+import threading
+from typing import List
+
+from services.metricas import METRICAS, Metricas
+
+
+class LimiteAdaptativo:
+    """
+    Limite de envios simultâneos ajustado pela latência e pelas falhas.
+
+    Args:
+        inicial: Limite de partida
+        minimo: Menor limite permitido
+        maximo: Maior limite permitido
+        tolerancia: Quanto o RTT curto pode exceder o longo sem reduzir o limite
+        suavizacao: Peso de cada novo cálculo sobre o limite atual (0 a 1)
+        recuo: Fator aplicado ao limite em uma janela com falha temporária
+        amostras: Envios por janela de medição
+        janela_longa: Janelas consideradas pela média do RTT longo
+        nome: Rótulo das métricas
+        metricas: Registro de métricas
+    """
+
+    def __init__(self, inicial: int = 4, minimo: int = 1, maximo: int = 64,
+                 tolerancia: float = 1.5, suavizacao: float = 0.2, recuo: float = 0.9,
+                 amostras: int = 10, janela_longa: int = 60, nome: str = "envio",
+                 metricas: Metricas = METRICAS):
+        if not minimo <= inicial <= maximo:
+            raise ValueError("O limite inicial deve estar entre o mínimo e o máximo")
+        self.minimo = minimo
+        self.maximo = maximo
+        self.tolerancia = tolerancia
+        self.suavizacao = suavizacao
+        self.recuo = recuo
+        self.amostras = amostras
+        self.metricas = metricas
+        self.rotulos = {"nome": nome}
+        self._limite = float(inicial)
+        self._peso_longo = 2.0 / (janela_longa + 1)
+        self._rtt_longo = None
+        self._janela: List[float] = []
+        self._sobrecarga = False
+        self._em_uso_maximo = 0
+        self._lock = threading.Lock()
+        self.metricas.definir("concorrencia_limite", self.limite, self.rotulos)
+
+    @property
+    def limite(self) -> int:
+        return int(self._limite)
+
+    def registrar(self, duracao: float, sobrecarga: bool = False, em_andamento: int = 0) -> int:
+        """
+        Registra um envio concluído e retorna o limite (recalculado ao fim de cada janela).
+
+        Args:
+            duracao: Segundos que o envio levou
+            sobrecarga: Se terminou em falha temporária do servidor
+            em_andamento: Envios simultâneos no momento em que este terminou
+        """
+        with self._lock:
+            self._janela.append(duracao)
+            self._sobrecarga = self._sobrecarga or sobrecarga
+            self._em_uso_maximo = max(self._em_uso_maximo, em_andamento + 1)
+            if len(self._janela) < self.amostras:
+                return self.limite
+            rtt_curto = sum(self._janela) / len(self._janela)
+            sobrecarga, em_uso = self._sobrecarga, self._em_uso_maximo
+            self._janela = []
+            self._sobrecarga = False
+            self._em_uso_maximo = 0
+            self._ajustar(rtt_curto, sobrecarga, em_uso)
+            return self.limite
+
+    def _ajustar(self, rtt_curto: float, sobrecarga: bool, em_uso: int) -> None:
+        # Chamado com a trava adquirida, uma vez por janela
+        if self._rtt_longo is None:
+            self._rtt_longo = rtt_curto
+        else:
+            self._rtt_longo += self._peso_longo * (rtt_curto - self._rtt_longo)
+            # Depois de uma lentidão longa, a média lenta não deve prender o limite para sempre
+            if self._rtt_longo > 2 * rtt_curto:
+                self._rtt_longo *= 0.95
+
+        if sobrecarga:
+            novo = self._limite * self.recuo
+            self.metricas.incrementar("concorrencia_reducoes", rotulos=self.rotulos)
+        else:
+            gradiente = max(0.5, min(1.0, self.tolerancia * self._rtt_longo / max(rtt_curto, 1e-6)))
+            if gradiente >= 1.0 and em_uso * 2 < self._limite:
+                # Limitado pela demanda: nada indica que um limite maior ajudaria
+                novo = self._limite
+            else:
+                novo = self._limite * gradiente + math.sqrt(self._limite)
+                novo = self._limite * (1 - self.suavizacao) + novo * self.suavizacao
+
+        self._limite = float(min(self.maximo, max(self.minimo, novo)))
+        self.metricas.definir("concorrencia_limite", self.limite, self.rotulos)
+        self.metricas.definir("concorrencia_rtt_longo_segundos", self._rtt_longo, self.rotulos)
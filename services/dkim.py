@@ -0,0 +1,246 @@
+# services/dkim.py
+"""
+Assinatura DKIM (RFC 6376) com rsa-sha256 ou ed25519-sha256 (RFC 8463) e
+canonicalização relaxed/relaxed.
+
+A chave privada é lida e interpretada uma única vez (e de novo só se o
+arquivo mudar). O hash do corpo canonicalizado (bh=) é guardado em cache pela
+chave do corpo (services.anexos.chave_do_corpo): em um envio em massa, o
+corpo — inclusive anexos grandes — é canonicalizado e resumido uma única vez,
+e cada destinatário custa só a assinatura dos cabeçalhos.
+"""
+import argparse
+import base64
+import hashlib
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+
+from services.anexos import Anexo, Segmento
+
+# Cabeçalhos assinados, quando presentes na mensagem
+CABECALHOS_ASSINADOS = (
+    "from", "to", "subject", "date", "message-id", "reply-to", "cc",
+    "mime-version", "content-type", "content-transfer-encoding",
+)
+
+_ESPACOS = re.compile(rb"[ \t]+")
+
+
+def _mtime(caminho: str) -> int:
+    return os.stat(caminho).st_mtime_ns
+
+
+@lru_cache(maxsize=8)
+def _carregar_chave_versao(caminho: str, versao: int):
+    with open(caminho, "rb") as arquivo:
+        chave = serialization.load_pem_private_key(arquivo.read(), password=None)
+    if not isinstance(chave, (rsa.RSAPrivateKey, ed25519.Ed25519PrivateKey)):
+        raise ValueError("Chave DKIM deve ser RSA ou Ed25519")
+    return chave
+
+
+def carregar_chave(caminho: str):
+    """Chave privada PEM, interpretada uma vez por versão do arquivo."""
+    return _carregar_chave_versao(caminho, _mtime(caminho))
+
+
+def canonicalizar_cabecalho(nome: bytes, valor: bytes) -> bytes:
+    """Canonicalização relaxed de um cabeçalho (sem o CRLF final)."""
+    valor = valor.replace(b"\r\n", b"").replace(b"\n", b"")
+    valor = _ESPACOS.sub(b" ", valor).strip(b" \t")
+    return nome.strip().lower() + b":" + valor
+
+
+class _CorpoRelaxed:
+    """Canonicalização relaxed do corpo, incremental, alimentando um hash."""
+
+    def __init__(self):
+        self.hash = hashlib.sha256()
+        self._linhas_vazias = 0
+        self._resto = b""
+
+    def texto(self, dados: bytes) -> None:
+        dados = self._resto + dados
+        linhas = dados.split(b"\r\n")
+        self._resto = linhas.pop()
+        for linha in linhas:
+            self._linha(_ESPACOS.sub(b" ", linha).rstrip(b" "))
+
+    def _linha(self, linha: bytes) -> None:
+        # Linhas vazias só entram se vier conteúdo depois (as finais são ignoradas)
+        if not linha:
+            self._linhas_vazias += 1
+            return
+        if self._linhas_vazias:
+            self.hash.update(b"\r\n" * self._linhas_vazias)
+            self._linhas_vazias = 0
+        self.hash.update(linha + b"\r\n")
+
+    def anexo(self, anexo: Anexo) -> None:
+        # O anexo codificado já está canônico: linhas base64 sem espaços, em CRLF
+        if self._resto:
+            self.texto(b"\r\n")
+        with open(anexo.armazem.codificado(anexo.hash), "rb") as arquivo:
+            if os.fstat(arquivo.fileno()).st_size == 0:
+                return
+            if self._linhas_vazias:
+                self.hash.update(b"\r\n" * self._linhas_vazias)
+                self._linhas_vazias = 0
+            with mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                self.hash.update(mapa)
+
+    def resumo(self) -> bytes:
+        if self._resto:
+            self._linha(_ESPACOS.sub(b" ", self._resto).rstrip(b" "))
+            self._resto = b""
+        return self.hash.digest()
+
+
+def _separar_cabecalhos(mensagem: bytes) -> Tuple[List[Tuple[bytes, bytes]], bytes]:
+    """Retorna ([(nome, valor)], início do corpo) de uma mensagem em CRLF."""
+    fim = mensagem.find(b"\r\n\r\n")
+    bloco, corpo = (mensagem, b"") if fim < 0 else (mensagem[:fim + 2], mensagem[fim + 4:])
+    cabecalhos: List[Tuple[bytes, bytes]] = []
+    for linha in bloco.split(b"\r\n")[:-1]:
+        if linha[:1] in (b" ", b"\t") and cabecalhos:
+            nome, valor = cabecalhos[-1]
+            cabecalhos[-1] = (nome, valor + b"\r\n" + linha)
+        else:
+            nome, _, valor = linha.partition(b":")
+            cabecalhos.append((nome, valor))
+    return cabecalhos, corpo
+
+
+class AssinadorDKIM:
+    """
+    Assina mensagens com DKIM.
+
+    Args:
+        dominio: Domínio assinante (d=)
+        seletor: Seletor da chave pública no DNS (s=)
+        caminho_chave: Chave privada PEM (RSA ou Ed25519)
+        cabecalhos: Cabeçalhos a assinar, quando presentes
+        cache_maximo: Quantidade de hashes de corpo guardados
+    """
+
+    def __init__(self, dominio: str, seletor: str, caminho_chave: str,
+                 cabecalhos: Sequence[str] = CABECALHOS_ASSINADOS, cache_maximo: int = 1024):
+        self.dominio = dominio
+        self.seletor = seletor
+        self.caminho_chave = caminho_chave
+        self.cabecalhos = tuple(cabecalho.lower() for cabecalho in cabecalhos)
+        self.cache_maximo = cache_maximo
+        self._hashes_corpo: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hash_corpo(self, partes: Iterable[Segmento], chave_corpo: Optional[bytes] = None) -> bytes:
+        """Hash SHA-256 do corpo canonicalizado, reaproveitado por `chave_corpo`."""
+        if chave_corpo is not None:
+            with self._lock:
+                resumo = self._hashes_corpo.get(chave_corpo)
+                if resumo is not None:
+                    self._hashes_corpo.move_to_end(chave_corpo)
+                    return resumo
+        corpo = _CorpoRelaxed()
+        for parte in partes:
+            if isinstance(parte, Anexo):
+                corpo.anexo(parte)
+            else:
+                corpo.texto(parte)
+        resumo = corpo.resumo()
+        if chave_corpo is not None:
+            with self._lock:
+                self._hashes_corpo[chave_corpo] = resumo
+                while len(self._hashes_corpo) > self.cache_maximo:
+                    self._hashes_corpo.popitem(last=False)
+        return resumo
+
+    def assinar(self, segmentos: List[Segmento], chave_corpo: Optional[bytes] = None) -> bytes:
+        """
+        Retorna o cabeçalho DKIM-Signature (com CRLF) para a mensagem formada
+        pelos segmentos, cujo primeiro contém todos os cabeçalhos em CRLF.
+        """
+        chave = carregar_chave(self.caminho_chave)
+        cabecalhos, inicio_corpo = _separar_cabecalhos(segmentos[0])
+        bh = self.hash_corpo([inicio_corpo] + list(segmentos[1:]), chave_corpo)
+
+        # Cada nome assinado uma vez, na ocorrência mais de baixo (RFC 6376, 5.4.2)
+        presentes = {}
+        for nome, valor in cabecalhos:
+            presentes[nome.strip().lower().decode("ascii", "replace")] = (nome, valor)
+        assinados = [nome for nome in self.cabecalhos if nome in presentes]
+
+        algoritmo = "ed25519-sha256" if isinstance(chave, ed25519.Ed25519PrivateKey) else "rsa-sha256"
+        campos = (
+            f"v=1; a={algoritmo}; c=relaxed/relaxed; d={self.dominio}; s={self.seletor};\r\n"
+            f"\tt={int(time.time())}; h={':'.join(assinados)};\r\n"
+            f"\tbh={base64.b64encode(bh).decode('ascii')};\r\n"
+            f"\tb="
+        ).encode("ascii")
+
+        dados = b"".join(
+            canonicalizar_cabecalho(*presentes[nome]) + b"\r\n" for nome in assinados
+        ) + canonicalizar_cabecalho(b"DKIM-Signature", b" " + campos)
+        if algoritmo == "rsa-sha256":
+            assinatura = chave.sign(dados, padding.PKCS1v15(), hashes.SHA256())
+        else:
+            assinatura = chave.sign(hashlib.sha256(dados).digest())
+
+        b = base64.b64encode(assinatura).decode("ascii")
+        b = "\r\n\t ".join(b[i:i + 72] for i in range(0, len(b), 72))
+        return b"DKIM-Signature: " + campos + b.encode("ascii") + b"\r\n"
+
+
+def registro_dns(caminho_chave: str) -> str:
+    """Conteúdo do registro TXT <seletor>._domainkey.<domínio> para a chave."""
+    chave = carregar_chave(caminho_chave)
+    publica = chave.public_key()
+    if isinstance(chave, ed25519.Ed25519PrivateKey):
+        tipo = "ed25519"
+        bruta = publica.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    else:
+        tipo = "rsa"
+        bruta = publica.public_bytes(serialization.Encoding.DER,
+                                     serialization.PublicFormat.SubjectPublicKeyInfo)
+    return f"v=DKIM1; k={tipo}; p={base64.b64encode(bruta).decode('ascii')}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Chaves DKIM")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    gerar = subcomandos.add_parser("gerar", help="Gera uma chave privada e mostra o registro DNS")
+    gerar.add_argument("--arquivo", required=True, help="Arquivo PEM a criar")
+    gerar.add_argument("--tipo", choices=("rsa", "ed25519"), default="rsa")
+    gerar.add_argument("--bits", type=int, default=2048, help="Tamanho da chave RSA")
+    dns = subcomandos.add_parser("dns", help="Mostra o registro DNS de uma chave existente")
+    dns.add_argument("--arquivo", required=True, help="Arquivo PEM da chave privada")
+    args = parser.parse_args(argv)
+
+    if args.comando == "gerar":
+        if args.tipo == "rsa":
+            chave = rsa.generate_private_key(public_exponent=65537, key_size=args.bits)
+        else:
+            chave = ed25519.Ed25519PrivateKey.generate()
+        pem = chave.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption())
+        descritor = os.open(args.arquivo, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(descritor, "wb") as arquivo:
+            arquivo.write(pem)
+        print(f"Chave gravada em {args.arquivo}")
+    print("Publique o registro TXT <seletor>._domainkey.<domínio>:")
+    print(registro_dns(args.arquivo))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
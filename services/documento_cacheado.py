@@ -0,0 +1,69 @@
+# services/documento_cacheado.py
+"""
+Documentos estáticos da API (listagem de endpoints, especificação Swagger)
+servidos a partir de bytes prontos, com variante gzip e validadores HTTP.
+
+Os validadores precisam ser os mesmos em todos os workers do gunicorn: a ETag
+vem do conteúdo e o Last-Modified do mtime dos arquivos de origem do
+documento (ver `modificacao_dos_arquivos`), nunca do horário de início do
+processo.
+"""
+import gzip
+import os
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from flask import Response, Request
+
+from services import json_codec
+
+
+def modificacao_dos_arquivos(*caminhos: str) -> float:
+    """Maior mtime entre os arquivos dos quais um documento é montado."""
+    return max(os.path.getmtime(caminho) for caminho in caminhos)
+
+
+class DocumentoCacheado:
+    """
+    Documento estático serializado uma única vez, com variante gzip e
+    validadores HTTP (ETag/Last-Modified) calculados na criação.
+
+    Servir o documento custa apenas a montagem dos cabeçalhos; requisições
+    condicionais (If-None-Match/If-Modified-Since) recebem 304 sem corpo.
+    """
+
+    def __init__(self, conteudo: bytes, modificado_em: float,
+                 mimetype: str = "application/json", max_age: int = 300):
+        self.conteudo = conteudo
+        self.conteudo_gzip = gzip.compress(conteudo, compresslevel=9, mtime=0)
+        self.mimetype = mimetype
+        self.max_age = max_age
+        # Last-Modified tem resolução de segundos
+        self.modificado_em = datetime.fromtimestamp(int(modificado_em), tz=timezone.utc)
+        # ETags distintas por representação, como exige o RFC 9110
+        self.etag = hashlib.sha256(conteudo).hexdigest()[:32]
+        self.etag_gzip = f"{self.etag}-gzip"
+
+    @classmethod
+    def de_objeto(cls, dados: Any, modificado_em: float, **kwargs) -> "DocumentoCacheado":
+        """Cria o documento a partir de um objeto serializável em JSON."""
+        return cls(json_codec.dumps(dados), modificado_em, **kwargs)
+
+    def responder(self, request: Request, status: Optional[int] = None) -> Response:
+        """Monta a resposta, escolhendo a variante gzip quando o cliente aceita."""
+        usar_gzip = request.accept_encodings["gzip"] > 0
+        resposta = Response(
+            self.conteudo_gzip if usar_gzip else self.conteudo,
+            status=status,
+            mimetype=self.mimetype,
+        )
+        if usar_gzip:
+            resposta.headers["Content-Encoding"] = "gzip"
+        resposta.headers["Vary"] = "Accept-Encoding"
+        resposta.set_etag(self.etag_gzip if usar_gzip else self.etag)
+        resposta.last_modified = self.modificado_em
+        resposta.cache_control.public = True
+        resposta.cache_control.max_age = self.max_age
+        # Converte em 304 quando os validadores do cliente ainda valem
+        return resposta.make_conditional(request)
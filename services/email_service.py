@@ -1,11 +1,25 @@
 # services/email_service.py
 import smtplib
 import logging
+import socket
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
-from typing import Optional, Dict, Any
+from typing import TYPE_CHECKING, Optional, Dict, Any, List
 from dotenv import load_dotenv
+from functools import lru_cache
+from services.anexos import (
+    POLITICA_SMTP, Anexo, chave_do_corpo, definir_fronteiras, fronteira_para,
+    montar_segmentos
+)
+from services.rastreamento import CLIENTE, rastrear
+from services.texto_alternativo import texto_alternativo
+from services.transportes import (
+    TRANSPORTES, TRANSPORTES_SEM_REDE, PoolSMTP, Transporte, obter_transporte
+)
+
+if TYPE_CHECKING:
+    from services.dkim import AssinadorDKIM
 
 # Configurar logging
 logging.basicConfig(
@@ -28,18 +42,44 @@ def validar_configuracoes() -> Dict[str, Any]:
         "porta": int(os.getenv("SMTP_PORT", "587")),
         "remetente": os.getenv("EMAIL_HOST_USER", ""),
         "senha": os.getenv("EMAIL_HOST_PASSWORD", ""),
-        "use_tls": os.getenv("EMAIL_USE_TLS", "True").lower() == "true"
+        "use_tls": os.getenv("EMAIL_USE_TLS", "True").lower() == "true",
+        "transporte": os.getenv("EMAIL_TRANSPORTE", "smtp").strip().lower(),
+        "dkim": None
     }
     
     # Verificar valores obrigatórios
     if not config["remetente"]:
         raise ValueError("EMAIL_HOST_USER não está configurado no arquivo .env")
-    if not config["senha"]:
+    if config["transporte"] not in TRANSPORTES:
+        raise ValueError(f"EMAIL_TRANSPORTE inválido: {config['transporte']} (use {', '.join(TRANSPORTES)})")
+    # Os transportes sem rede (arquivo e nulo) não se autenticam
+    if not config["senha"] and config["transporte"] not in TRANSPORTES_SEM_REDE:
         raise ValueError("EMAIL_HOST_PASSWORD não está configurado no arquivo .env")
     
+    # Assinatura DKIM (opcional), ao enviar pelo próprio domínio
+    dkim_dominio = os.getenv("DKIM_DOMINIO", "")
+    if dkim_dominio:
+        config["dkim"] = {
+            "dominio": dkim_dominio,
+            "seletor": os.getenv("DKIM_SELETOR", ""),
+            "chave": os.getenv("DKIM_CHAVE", "")
+        }
+        if not config["dkim"]["seletor"] or not config["dkim"]["chave"]:
+            raise ValueError("DKIM_SELETOR e DKIM_CHAVE são obrigatórios quando DKIM_DOMINIO está configurado")
+    
     return config
 
-def enviar_email(destinatario: str, assunto: str, corpo: str, debug: bool = False) -> Dict[str, Any]:
+@lru_cache(maxsize=4)
+def _assinador_dkim(dominio: str, seletor: str, chave: str) -> "AssinadorDKIM":
+    # Um assinador por configuração: guarda a chave e o cache de hashes de corpo.
+    # Importado aqui para que o cryptography só seja carregado com DKIM_DOMINIO definido
+    from services.dkim import AssinadorDKIM
+    return AssinadorDKIM(dominio, seletor, chave)
+
+def enviar_email(destinatario: str, assunto: str, corpo: str, debug: bool = False,
+                 remetente: Optional[str] = None, pool: Optional[PoolSMTP] = None,
+                 anexos: Optional[List[Anexo]] = None,
+                 transporte: Optional[Transporte] = None) -> Dict[str, Any]:
     """
     Envia um email e retorna um dicionário com o status e informações adicionais.
     
@@ -48,6 +88,10 @@ def enviar_email(destinatario: str, assunto: str, corpo: str, debug: bool = Fals
         assunto: Assunto do email
         corpo: Corpo do email em HTML
         debug: Modo debug para exibir informações sensíveis em logs
+        remetente: Remetente exibido no cabeçalho From (padrão: EMAIL_HOST_USER)
+        pool: Pool de conexões SMTP a reutilizar (sem pool, abre e fecha uma conexão)
+        anexos: Anexos do armazém, transmitidos em fluxo direto no socket SMTP
+        transporte: Transporte da entrega (padrão: o de EMAIL_TRANSPORTE)
         
     Returns:
         Dict contendo o status do envio e informações adicionais
@@ -78,15 +122,22 @@ def enviar_email(destinatario: str, assunto: str, corpo: str, debug: bool = Fals
         # Obter e validar configurações
         config = validar_configuracoes()
         
-        # Criando mensagem
-        mensagem = MIMEMultipart()
-        mensagem["From"] = config["remetente"]
+        # Corpo em multipart/alternative: texto puro (gerado do HTML, com cache)
+        # e HTML. Com anexos, as versões vão dentro de um multipart/mixed.
+        # Com anexos, utf-8 codifica as partes em base64, onde a fronteira "=_..." não ocorre
+        charset = "utf-8" if anexos else None
+        alternativa = MIMEMultipart("alternative")
+        alternativa.attach(MIMEText(texto_alternativo(corpo), "plain", charset))
+        alternativa.attach(MIMEText(corpo, "html", charset))
+        if anexos:
+            mensagem = MIMEMultipart()
+            mensagem.attach(alternativa)
+        else:
+            mensagem = alternativa
+        mensagem["From"] = remetente or config["remetente"]
         mensagem["To"] = destinatario
         mensagem["Subject"] = assunto
         
-        # Anexando corpo da mensagem
-        mensagem.attach(MIMEText(corpo, "html"))
-        
         # Log de informações (omitindo detalhes sensíveis no modo não-debug)
         logger.info(f"Preparando envio para: {destinatario}")
         logger.info(f"Assunto: {assunto}")
@@ -95,42 +146,44 @@ def enviar_email(destinatario: str, assunto: str, corpo: str, debug: bool = Fals
             logger.debug(f"Remetente: {config['remetente']}")
             logger.debug(f"Corpo: {corpo[:100]}...")
         
-        # Conectando ao servidor com timeout
-        servidor = smtplib.SMTP(config["smtp_server"], config["porta"], timeout=10)
-        
-        # Verificar status da conexão
-        status_code, _ = servidor.ehlo()
-        if status_code != 250:
-            raise smtplib.SMTPConnectError(status_code, "Falha na conexão com o servidor SMTP")
-        
-        # Ativar TLS se configurado
-        if config["use_tls"]:
-            servidor.starttls()
-            status_code, _ = servidor.ehlo()
-            if status_code != 250:
-                raise smtplib.SMTPException("Falha ao iniciar TLS")
-        
-        # Login
-        servidor.login(config["remetente"], config["senha"])
-        
-        # Enviar email
-        texto = mensagem.as_string()
-        status = servidor.sendmail(config["remetente"], destinatario, texto)
+        # Montar a mensagem final. Com anexos, ela é transmitida em segmentos sem
+        # nunca ser montada inteira em memória. Com anexos ou DKIM, as fronteiras
+        # derivam do corpo, que fica idêntico para todos os destinatários e tem o
+        # hash DKIM (bh=) calculado uma única vez.
+        assinador = _assinador_dkim(**config["dkim"]) if config["dkim"] else None
+        segmentos = None
+        if anexos or assinador:
+            chave_corpo = chave_do_corpo(corpo, anexos)
+            fronteira = fronteira_para(chave_corpo)
+            if anexos:
+                segmentos = montar_segmentos(mensagem, anexos, fronteira)
+            else:
+                definir_fronteiras(mensagem, fronteira)
+                segmentos = [mensagem.as_bytes(policy=POLITICA_SMTP)]
+            if assinador:
+                segmentos[0] = assinador.assinar(segmentos, chave_corpo) + segmentos[0]
+        
+        # Entregar pelo transporte configurado (SMTP, ou um dos sem rede)
+        if transporte is None:
+            # O smtp_async mantém tantas conexões quanto o pool da aplicação, que
+            # acompanha o teto de envios simultâneos
+            transporte = obter_transporte(config["transporte"], pool.tamanho if pool is not None else None)
+        with rastrear("entregar", {"transporte": transporte.nome}, tipo=CLIENTE) as span:
+            status = transporte.entregar(config, destinatario, mensagem, segmentos, pool)
+            span.definir("smtp.recusados", len(status))
         
         # Verificar resultado do envio
         if status:
             # O método sendmail retorna um dicionário vazio se todos os destinatários foram aceitos
             resultado["mensagem"] = f"Problemas com alguns destinatários: {status}"
             resultado["detalhes"] = status
+            resultado["devolvido"] = True
             logger.warning(f"Email enviado com avisos: {status}")
         else:
             resultado["sucesso"] = True
             resultado["mensagem"] = "Email enviado com sucesso!"
             logger.info("Email enviado com sucesso!")
         
-        # Fechar conexão
-        servidor.quit()
-        
     except ValueError as e:
         # Erro de configuração
         resultado["mensagem"] = f"Erro de configuração: {str(e)}"
@@ -147,24 +200,38 @@ def enviar_email(destinatario: str, assunto: str, corpo: str, debug: bool = Fals
         # Erro de conexão
         resultado["mensagem"] = "Não foi possível conectar ao servidor SMTP."
         resultado["detalhes"] = str(e)
+        resultado["temporario"] = True
         logger.error(f"Erro de conexão SMTP: {str(e)}")
         
     except smtplib.SMTPServerDisconnected as e:
         # Servidor desconectou
         resultado["mensagem"] = "Servidor SMTP desconectou inesperadamente."
         resultado["detalhes"] = str(e)
+        resultado["temporario"] = True
         logger.error(f"Servidor SMTP desconectou: {str(e)}")
         
+    except smtplib.SMTPRecipientsRefused as e:
+        # Destinatário recusado pelo servidor (devolução imediata)
+        resultado["mensagem"] = f"Destinatário recusado pelo servidor: {e.recipients}"
+        resultado["detalhes"] = str(e.recipients)
+        resultado["devolvido"] = True
+        logger.error(f"Destinatário recusado: {e.recipients}")
+        
     except smtplib.SMTPException as e:
         # Outros erros SMTP
         resultado["mensagem"] = f"Erro SMTP: {str(e)}"
         resultado["detalhes"] = str(e)
+        # Respostas 4xx (421, 451, 452...) indicam servidor sobrecarregado ou limitando a taxa
+        if 400 <= getattr(e, "smtp_code", 0) < 500:
+            resultado["temporario"] = True
         logger.error(f"Erro SMTP: {str(e)}")
         
     except Exception as e:
         # Erros genéricos
         resultado["mensagem"] = f"Erro inesperado: {str(e)}"
         resultado["detalhes"] = str(e)
+        if isinstance(e, (socket.timeout, ConnectionError)):
+            resultado["temporario"] = True
         logger.error(f"Erro inesperado ao enviar email: {str(e)}", exc_info=True)
         
     return resultado
\ No newline at end of file
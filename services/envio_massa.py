@@ -0,0 +1,361 @@
+# services/envio_massa.py
+"""
+Envio em massa pela linha de comando, direto pelo email_service (sem HTTP,
+autenticação ou limitador de taxa da API).
+
+O arquivo de destinatários (CSV com cabeçalho, ou NDJSON com um objeto por
+linha) é lido em fluxo: só as mensagens em andamento ficam em memória. Assunto
+e corpo são modelos string.Template ($nome, ${nome}) preenchidos com as
+colunas de cada registro; no corpo, os valores são escapados para HTML.
+
+O progresso é gravado em `<entrada>.progresso` como uma marca d'água: o maior
+número de registro até o qual todos já foram processados. Uma execução
+interrompida retoma a partir da marca; mensagens concluídas além dela, fora
+de ordem, podem ser enviadas de novo (entrega "pelo menos uma vez").
+
+    python -m services.envio_massa campanha.csv --assunto "Olá, $nome" \\
+        --corpo-arquivo modelo.html --workers 8 --taxa 20
+    python -m services.envio_massa campanha.ndjson --assunto "..." --corpo "..." --simular
+"""
+import argparse
+import csv
+import html
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from string import Template
+from typing import Any, Dict, Iterator, Optional, TextIO, Tuple
+
+from services.email_service import PoolSMTP, enviar_email
+from services.esquema import Esquema, criar_esquema_envio
+from services.supressao import ListaSupressao
+from services.transportes import fechar_transportes
+
+
+def ler_registros(entrada: TextIO, formato: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Registros do arquivo, numerados a partir de 1, lidos em fluxo."""
+    if formato == "csv":
+        for numero, linha in enumerate(csv.DictReader(entrada), start=1):
+            yield numero, linha
+        return
+    numero = 0
+    for linha in entrada:
+        if not linha.strip():
+            continue
+        numero += 1
+        try:
+            registro = json.loads(linha)
+        except ValueError:
+            registro = None
+        # Linhas inválidas seguem numeradas e são reportadas como falha
+        yield numero, registro if isinstance(registro, dict) else {}
+
+
+def formato_do_arquivo(caminho: str) -> str:
+    return "ndjson" if caminho.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+class Modelo:
+    """Assunto e corpo a preencher com as variáveis de cada destinatário."""
+
+    def __init__(self, assunto: str, corpo: str):
+        self.assunto = Template(assunto)
+        self.corpo = Template(corpo)
+
+    def renderizar(self, variaveis: Dict[str, Any]) -> Tuple[str, str]:
+        """Retorna (assunto, corpo). Levanta ValueError se faltar uma variável."""
+        texto = {chave: "" if valor is None else str(valor) for chave, valor in variaveis.items()}
+        try:
+            assunto = self.assunto.substitute(texto)
+            corpo = self.corpo.substitute({chave: html.escape(valor) for chave, valor in texto.items()})
+        except KeyError as e:
+            raise ValueError(f"Variável ausente no registro: {e.args[0]}") from None
+        except ValueError as e:
+            raise ValueError(f"Modelo inválido: {e}") from None
+        return assunto, corpo
+
+
+class Progresso:
+    """
+    Marca d'água do progresso, gravada de forma atômica.
+
+    Registros concluídos fora de ordem ficam em um conjunto até a marca
+    alcançá-los, então o conjunto nunca passa do número de envios simultâneos.
+    """
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self.marca = 0
+        self._concluidos = set()
+        self._lock = threading.Lock()
+        if os.path.exists(caminho):
+            with open(caminho, encoding="utf-8") as arquivo:
+                self.marca = int(json.load(arquivo).get("marca", 0))
+        self._gravada = self.marca
+
+    def concluir(self, numero: int) -> None:
+        with self._lock:
+            self._concluidos.add(numero)
+            while self.marca + 1 in self._concluidos:
+                self.marca += 1
+                self._concluidos.discard(self.marca)
+
+    def gravar(self) -> None:
+        with self._lock:
+            marca = self.marca
+        if marca == self._gravada:
+            return
+        temporario = f"{self.caminho}.tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump({"marca": marca, "atualizado_em": time.time()}, arquivo)
+        os.replace(temporario, self.caminho)
+        self._gravada = marca
+
+
+class Painel:
+    """Contadores do envio e vazão, exibidos periodicamente na saída de erro."""
+
+    def __init__(self, saida: Optional[TextIO] = None, intervalo: float = 1.0):
+        self.saida = saida or sys.stderr
+        self.intervalo = intervalo
+        self.contagens = {"enviados": 0, "validos": 0, "falhas": 0, "suprimidos": 0, "invalidos": 0}
+        self._lock = threading.Lock()
+        self._inicio = time.monotonic()
+        self._ultima_exibicao = 0.0
+
+    def contar(self, nome: str) -> None:
+        with self._lock:
+            self.contagens[nome] += 1
+
+    def linha(self) -> str:
+        decorrido = max(time.monotonic() - self._inicio, 1e-9)
+        c = self.contagens
+        # "validos" só é contado na simulação, no lugar de "enviados"
+        processados = "validos" if c["validos"] else "enviados"
+        return (f"{c[processados]} {processados}, {c['falhas']} falhas, {c['suprimidos']} suprimidos, "
+                f"{c['invalidos']} inválidos | {c[processados] / decorrido:.1f} msg/s | {decorrido:.0f}s")
+
+    def exibir(self, final: bool = False) -> None:
+        agora = time.monotonic()
+        if not final and agora - self._ultima_exibicao < self.intervalo:
+            return
+        self._ultima_exibicao = agora
+        interativo = self.saida.isatty()
+        fim = "\n" if final or not interativo else ""
+        self.saida.write(("\r" if interativo else "") + self.linha() + fim)
+        self.saida.flush()
+
+
+def criar_esquema() -> Esquema:
+    """Mesmo esquema da API. O email é validado só pela sintaxe, sem consultar o DNS."""
+    import bleach
+    import email_validator
+
+    def validar_email(endereco: str) -> bool:
+        try:
+            email_validator.validate_email(endereco, check_deliverability=False)
+            return True
+        except email_validator.EmailNotValidError:
+            return False
+
+    return criar_esquema_envio(
+        validar_email=validar_email,
+        sanitizador=lambda valor: bleach.clean(valor, tags=[], attributes={}, strip=True),
+    )
+
+
+class EnvioMassa:
+    """
+    Execução de um envio em massa.
+
+    Args:
+        modelo: Assunto e corpo do email
+        coluna_destinatario: Coluna (ou chave NDJSON) com o endereço
+        remetente: Remetente dos emails (padrão: o da configuração SMTP)
+        workers: Envios simultâneos, cada um com sua conexão SMTP reutilizada
+        taxa: Envios por segundo (None para ilimitado)
+        supressao: Lista de supressão a respeitar
+        simular: Apenas renderiza e valida, sem enviar nem gravar progresso
+        falhas: Arquivo NDJSON onde os registros com falha são anotados
+        painel: Exibição do progresso
+    """
+
+    def __init__(self, modelo: Modelo, coluna_destinatario: str = "email",
+                 remetente: Optional[str] = None, workers: int = 4, taxa: Optional[float] = None,
+                 supressao: Optional[ListaSupressao] = None, simular: bool = False,
+                 falhas: Optional[TextIO] = None, painel: Optional[Painel] = None):
+        self.modelo = modelo
+        self.coluna_destinatario = coluna_destinatario
+        self.remetente = remetente
+        self.workers = workers
+        self.taxa = taxa
+        self.supressao = supressao
+        self.simular = simular
+        self.falhas = falhas
+        self.painel = painel or Painel()
+        self.esquema = criar_esquema()
+        self.pool = PoolSMTP(tamanho=workers)
+        self._lock_falhas = threading.Lock()
+
+    def preparar(self, registro: Dict[str, Any]) -> Dict[str, Any]:
+        """Renderiza e valida a mensagem de um registro. Levanta ValueError se inválida."""
+        assunto, corpo = self.modelo.renderizar(registro)
+        dados, erros = self.esquema.validar({
+            "destinatario": str(registro.get(self.coluna_destinatario) or "").strip(),
+            "assunto": assunto,
+            "corpo": corpo,
+        })
+        if erros:
+            raise ValueError("; ".join(erros))
+        return dados
+
+    def _anotar_falha(self, numero: int, destinatario: Any, mensagem: str) -> None:
+        if self.falhas is None:
+            return
+        linha = json.dumps({"registro": numero, "destinatario": destinatario, "mensagem": mensagem},
+                           ensure_ascii=False)
+        with self._lock_falhas:
+            self.falhas.write(linha + "\n")
+            self.falhas.flush()
+
+    def _enviar(self, dados: Dict[str, Any]) -> Dict[str, Any]:
+        return enviar_email(dados["destinatario"], dados["assunto"], dados["corpo"],
+                            remetente=self.remetente, pool=self.pool)
+
+    def executar(self, registros: Iterator[Tuple[int, Dict[str, Any]]],
+                 progresso: Optional[Progresso] = None) -> Dict[str, int]:
+        """Processa os registros e retorna as contagens finais."""
+        inicio_marca = progresso.marca if progresso else 0
+        # Limita as mensagens em memória: a leitura espera quando há muitas em andamento
+        vagas = threading.BoundedSemaphore(self.workers * 2)
+        proximo_envio = time.monotonic()
+
+        def concluir(numero: int, destinatario: Any, futuro: Future) -> None:
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                resultado = {"sucesso": False, "mensagem": f"Erro inesperado: {e}"}
+            if resultado.get("sucesso"):
+                self.painel.contar("enviados")
+            else:
+                self.painel.contar("falhas")
+                self._anotar_falha(numero, destinatario, resultado.get("mensagem", ""))
+            if progresso:
+                progresso.concluir(numero)
+            vagas.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="envio-massa") as executor:
+            try:
+                for numero, registro in registros:
+                    if numero <= inicio_marca:
+                        continue
+                    destinatario = registro.get(self.coluna_destinatario)
+                    try:
+                        dados = self.preparar(registro)
+                    except ValueError as e:
+                        self.painel.contar("invalidos")
+                        self._anotar_falha(numero, destinatario, str(e))
+                        if progresso:
+                            progresso.concluir(numero)
+                        continue
+                    if self.supressao is not None and self.supressao.contem(dados["destinatario"]):
+                        self.painel.contar("suprimidos")
+                        if progresso:
+                            progresso.concluir(numero)
+                        continue
+                    if self.simular:
+                        self.painel.contar("validos")
+                        self.painel.exibir()
+                        continue
+
+                    if self.taxa:
+                        espera = proximo_envio - time.monotonic()
+                        if espera > 0:
+                            time.sleep(espera)
+                        proximo_envio = max(proximo_envio, time.monotonic() - 1.0) + 1.0 / self.taxa
+                    while not vagas.acquire(timeout=self.painel.intervalo):
+                        self.painel.exibir()
+                        if progresso:
+                            progresso.gravar()
+                    futuro = executor.submit(self._enviar, dados)
+                    futuro.add_done_callback(lambda f, n=numero, d=dados["destinatario"]: concluir(n, d, f))
+                    self.painel.exibir()
+                    if progresso:
+                        progresso.gravar()
+            finally:
+                # Mensagens já submetidas terminam antes de o progresso final ser gravado
+                executor.shutdown(wait=True)
+                self.pool.fechar()
+                # Com EMAIL_TRANSPORTE=arquivo, grava as mensagens ainda na fila
+                fechar_transportes()
+                if progresso and not self.simular:
+                    progresso.gravar()
+                self.painel.exibir(final=True)
+        return dict(self.painel.contagens)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Envio em massa a partir de um arquivo CSV ou NDJSON")
+    parser.add_argument("entrada", help="Arquivo de destinatários (CSV com cabeçalho, ou .ndjson/.jsonl)")
+    parser.add_argument("--formato", choices=("csv", "ndjson"), help="Formato (padrão: pela extensão)")
+    parser.add_argument("--assunto", required=True, help="Modelo do assunto, ex.: \"Olá, $nome\"")
+    corpo = parser.add_mutually_exclusive_group(required=True)
+    corpo.add_argument("--corpo", help="Modelo do corpo HTML")
+    corpo.add_argument("--corpo-arquivo", help="Arquivo com o modelo do corpo HTML")
+    parser.add_argument("--coluna", default="email", help="Coluna com o endereço (padrão: email)")
+    parser.add_argument("--remetente", help="Remetente (padrão: o da configuração SMTP)")
+    parser.add_argument("--workers", type=int, default=4, help="Envios simultâneos / conexões SMTP")
+    parser.add_argument("--taxa", type=float, help="Máximo de envios por segundo")
+    parser.add_argument("--supressao", default=os.getenv("SUPRESSAO_ARQUIVO", "data/supressao.idx"),
+                        help="Índice da lista de supressão a respeitar")
+    parser.add_argument("--progresso", help="Arquivo de progresso (padrão: <entrada>.progresso)")
+    parser.add_argument("--recomecar", action="store_true", help="Ignora o progresso gravado")
+    parser.add_argument("--falhas", help="Arquivo NDJSON para os registros com falha")
+    parser.add_argument("--simular", action="store_true",
+                        help="Apenas renderiza e valida as mensagens, sem enviar")
+    args = parser.parse_args(argv)
+
+    if args.corpo_arquivo:
+        with open(args.corpo_arquivo, encoding="utf-8") as arquivo:
+            modelo_corpo = arquivo.read()
+    else:
+        modelo_corpo = args.corpo
+
+    caminho_progresso = args.progresso or f"{args.entrada}.progresso"
+    if args.recomecar and os.path.exists(caminho_progresso):
+        os.remove(caminho_progresso)
+    progresso = None if args.simular else Progresso(caminho_progresso)
+    if progresso and progresso.marca:
+        print(f"Retomando após o registro {progresso.marca}", file=sys.stderr)
+
+    falhas = open(args.falhas, "a", encoding="utf-8") if args.falhas else None
+    envio = EnvioMassa(
+        Modelo(args.assunto, modelo_corpo),
+        coluna_destinatario=args.coluna,
+        remetente=args.remetente,
+        workers=args.workers,
+        taxa=args.taxa,
+        supressao=ListaSupressao(args.supressao) if args.supressao else None,
+        simular=args.simular,
+        falhas=falhas,
+    )
+    try:
+        with open(args.entrada, newline="", encoding="utf-8") as entrada:
+            registros = ler_registros(entrada, args.formato or formato_do_arquivo(args.entrada))
+            try:
+                contagens = envio.executar(registros, progresso)
+            except KeyboardInterrupt:
+                # As mensagens em andamento terminam e o progresso é gravado pelo executar
+                print("\nInterrompido; execute de novo para retomar", file=sys.stderr)
+                return 130
+    finally:
+        if falhas is not None:
+            falhas.close()
+    return 0 if contagens["falhas"] == 0 and contagens["invalidos"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+# services/esquema.py
+"""
+Validação declarativa de payloads.
+
+Um Esquema é declarado uma única vez e compilado, na criação, em uma função
+de validação que percorre os campos uma só vez: verifica presença e tipo,
+sanitiza, verifica tamanho e aplica validadores, coletando todos os erros.
+O mesmo esquema gera a definição usada na especificação Swagger.
+"""
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.anexos import referencias_validas
+
+# Nomes usados nas mensagens de erro e na especificação Swagger
+_NOMES_TIPOS = {
+    str: ("texto", "string"),
+    int: ("número inteiro", "integer"),
+    float: ("número", "number"),
+    bool: ("booleano", "boolean"),
+    list: ("lista", "array"),
+    dict: ("objeto", "object"),
+}
+
+
+class Campo:
+    """Declaração de um campo do payload."""
+
+    def __init__(self, tipo: type = str, obrigatorio: bool = True,
+                 max_tamanho: Optional[int] = None, sanitizar: bool = True,
+                 validador: Optional[Callable[[Any], bool]] = None,
+                 mensagem_invalido: Optional[str] = None,
+                 mensagem_tamanho: Optional[str] = None,
+                 conversor: Optional[Callable[[Any], Any]] = None,
+                 formato: Optional[str] = None,
+                 descricao: str = "", exemplo: Any = None):
+        self.tipo = tipo
+        self.obrigatorio = obrigatorio
+        self.max_tamanho = max_tamanho
+        self.sanitizar = sanitizar
+        self.validador = validador
+        self.mensagem_invalido = mensagem_invalido
+        self.mensagem_tamanho = mensagem_tamanho
+        # Converte o valor já validado (ex.: texto ISO 8601 -> timestamp);
+        # um ValueError é reportado como campo inválido
+        self.conversor = conversor
+        self.formato = formato
+        self.descricao = descricao
+        self.exemplo = exemplo
+
+
+class Esquema:
+    """
+    Conjunto de campos compilado em uma função de validação.
+
+    `sanitizador` é aplicado aos campos de texto com sanitizar=True.
+    Campos não declarados são ignorados.
+    """
+
+    def __init__(self, nome: str, campos: Dict[str, Campo],
+                 sanitizador: Optional[Callable[[str], str]] = None):
+        self.nome = nome
+        self.campos = campos
+        self.sanitizador = sanitizador
+        self.validar = self._compilar()
+
+    def _compilar(self) -> Callable[[Dict[str, Any]], Tuple[Dict[str, Any], List[str]]]:
+        # Todo o trabalho de inspeção dos campos acontece aqui, uma única vez;
+        # a função retornada só percorre tuplas pré-calculadas.
+        sanitizador = self.sanitizador
+        regras = []
+        for nome, campo in self.campos.items():
+            # bool é subclasse de int: não aceitar True/False em campos numéricos
+            tipos = (int, float) if campo.tipo is float else (campo.tipo,)
+            regras.append((
+                nome,
+                tipos,
+                campo.tipo in (int, float),
+                campo.obrigatorio,
+                campo.max_tamanho,
+                sanitizador if (campo.sanitizar and campo.tipo is str) else None,
+                campo.validador,
+                campo.conversor,
+                f"Campo obrigatório ausente: {nome}",
+                f"Campo {nome} deve ser do tipo {_NOMES_TIPOS.get(campo.tipo, (campo.tipo.__name__,))[0]}",
+                campo.mensagem_tamanho or f"Campo {nome} excede o tamanho máximo de {campo.max_tamanho}",
+                campo.mensagem_invalido or f"Campo {nome} inválido",
+            ))
+        regras = tuple(regras)
+
+        def validar(dados: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+            """Valida e sanitiza `dados` no próprio dicionário; retorna (dados, erros)."""
+            erros = []
+            for (nome, tipos, numerico, obrigatorio, max_tamanho, sanitizar,
+                 validador, conversor, msg_ausente, msg_tipo, msg_tamanho, msg_invalido) in regras:
+                valor = dados.get(nome)
+                if valor is None:
+                    if obrigatorio:
+                        erros.append(msg_ausente)
+                    continue
+                if not isinstance(valor, tipos) or (numerico and isinstance(valor, bool)):
+                    erros.append(msg_tipo)
+                    continue
+                if sanitizar is not None:
+                    valor = sanitizar(valor)
+                    dados[nome] = valor
+                if max_tamanho is not None and len(valor) > max_tamanho:
+                    erros.append(msg_tamanho)
+                    continue
+                if validador is not None and not validador(valor):
+                    erros.append(msg_invalido)
+                    continue
+                if conversor is not None:
+                    try:
+                        dados[nome] = conversor(valor)
+                    except ValueError:
+                        erros.append(msg_invalido)
+            return dados, erros
+
+        return validar
+
+    def para_swagger(self) -> Dict[str, Any]:
+        """Gera a definição do esquema no formato Swagger 2.0."""
+        propriedades = {}
+        for nome, campo in self.campos.items():
+            propriedade = {"type": _NOMES_TIPOS.get(campo.tipo, ("", "string"))[1]}
+            if campo.tipo is list:
+                # Swagger 2.0 exige o tipo dos itens; o formato deles vem do exemplo
+                propriedade["items"] = {"type": "object"}
+            if campo.max_tamanho is not None:
+                chave = "maxLength" if campo.tipo is str else "maxItems"
+                propriedade[chave] = campo.max_tamanho
+            if campo.formato:
+                propriedade["format"] = campo.formato
+            if campo.exemplo is not None:
+                propriedade["example"] = campo.exemplo
+            if campo.descricao:
+                propriedade["description"] = campo.descricao
+            propriedades[nome] = propriedade
+        return {
+            "type": "object",
+            "required": [nome for nome, campo in self.campos.items() if campo.obrigatorio],
+            "properties": propriedades,
+        }
+
+    def para_documentacao(self) -> List[Dict[str, Any]]:
+        """Gera a lista de parâmetros no formato da rota /api/endpoints."""
+        return [
+            {
+                "nome": nome,
+                "tipo": _NOMES_TIPOS.get(campo.tipo, ("", "string"))[1],
+                "obrigatório": campo.obrigatorio,
+                "descrição": campo.descricao,
+            }
+            for nome, campo in self.campos.items()
+        ]
+
+
+# Agendamentos podem ser feitos com até um ano de antecedência
+HORIZONTE_MAXIMO_AGENDAMENTO = 365 * 24 * 3600
+
+
+def converter_data_envio(valor: str) -> float:
+    """
+    Converte uma data ISO 8601 em timestamp. Datas sem fuso horário usam o fuso
+    do servidor (variável TZ). Levanta ValueError se a data for inválida ou
+    estiver além do horizonte de agendamento.
+    """
+    # datetime.fromisoformat só aceita o sufixo "Z" a partir do Python 3.11
+    if valor.endswith(("Z", "z")):
+        valor = valor[:-1] + "+00:00"
+    timestamp = datetime.fromisoformat(valor).timestamp()
+    if timestamp > time.time() + HORIZONTE_MAXIMO_AGENDAMENTO:
+        raise ValueError("Data de envio além do horizonte de agendamento")
+    return timestamp
+
+
+def criar_esquema_envio(validar_email: Callable[[str], bool],
+                        sanitizador: Optional[Callable[[str], str]] = None,
+                        prioridades: Tuple[str, ...] = ("alta", "normal", "baixa")) -> Esquema:
+    """
+    Esquema do envio de um email, compartilhado pela API, pela linha de comando
+    e pela especificação Swagger.
+    """
+    return Esquema("EnviarEmail", {
+        "destinatario": Campo(
+            max_tamanho=254,
+            validador=validar_email,
+            mensagem_invalido="Email do destinatário inválido",
+            descricao="Email do destinatário",
+            exemplo="destinatario@example.com",
+        ),
+        "assunto": Campo(
+            max_tamanho=200,
+            mensagem_tamanho="Assunto muito longo",
+            descricao="Assunto do email (máximo 200 caracteres)",
+            exemplo="Assunto do email",
+        ),
+        "corpo": Campo(
+            max_tamanho=50000,
+            sanitizar=False,  # O corpo é HTML e é enviado como está
+            mensagem_tamanho="Corpo do email muito longo",
+            descricao="Corpo do email em HTML (máximo 50000 caracteres)",
+            exemplo="<p>Conteúdo do email em HTML</p>",
+        ),
+        "enviar_em": Campo(
+            obrigatorio=False,
+            max_tamanho=40,
+            conversor=converter_data_envio,
+            formato="date-time",
+            mensagem_invalido="Data de envio (enviar_em) inválida",
+            descricao="Data e hora do envio em ISO 8601 (opcional; sem fuso usa o do servidor)",
+            exemplo="2025-01-31T09:00:00-03:00",
+        ),
+        "prioridade": Campo(
+            obrigatorio=False,
+            validador=frozenset(prioridades).__contains__,
+            mensagem_invalido=f"Prioridade inválida, use: {', '.join(prioridades)}",
+            descricao=f"Faixa de prioridade do envio ({', '.join(prioridades)}; padrão: normal)",
+            exemplo="alta",
+        ),
+        "anexos": Campo(
+            tipo=list,
+            obrigatorio=False,
+            max_tamanho=10,
+            validador=referencias_validas,
+            mensagem_tamanho="Máximo de 10 anexos por email",
+            mensagem_invalido="Anexos inválidos, use [{\"hash\", \"nome\", \"tipo\"}] com hashes de /api/anexos",
+            descricao="Anexos enviados antes em /api/anexos: lista de {hash, nome, tipo (opcional)}",
+            exemplo=[{"hash": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
+                      "nome": "fatura.pdf", "tipo": "application/pdf"}],
+        ),
+    }, sanitizador=sanitizador)
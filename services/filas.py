@@ -0,0 +1,371 @@
+# services/filas.py
+"""
+Filas de envio com faixas de prioridade.
+
+Cada faixa (ex.: "alta" para emails transacionais, "baixa" para campanhas)
+tem sua própria fila, um teto de envios simultâneos (sua parcela do pool de
+workers/conexões SMTP) e um orçamento de taxa (balde de fichas). Os workers
+são compartilhados: sempre que um fica livre, atende a faixa de maior
+prioridade que tenha mensagens, esteja abaixo do seu teto e tenha fichas.
+Assim uma redefinição de senha passa à frente de uma campanha inteira, sem
+que a campanha consiga ocupar todas as conexões.
+
+Espera na fila e latência total de cada faixa são registradas nas métricas.
+
+No encerramento do worker, `drenar` para de aceitar mensagens, espera a fila
+esvaziar dentro de um prazo e devolve as tarefas que ficaram para trás, para
+que sejam persistidas em vez de perdidas.
+
+Com `limite_memoria`, as mensagens que chegam quando as já enfileiradas
+somam mais que esse limite (estimado) vão para um depósito em disco; na fila
+fica só a tarefa, que mantém a posição, e a mensagem é lida de volta quando
+um worker a retira.
+
+Com um `limitador` (LimiteAdaptativo), o total de envios simultâneos deixa de
+ser fixo: o pool tem `limitador.maximo` workers, mas só `limitador.limite`
+enviam ao mesmo tempo, e as parcelas das faixas são calculadas sobre esse
+limite. Cada envio concluído informa ao limitador quanto demorou e se terminou
+em falha temporária (resultado com `temporario`).
+
+O envio roda no contexto (contextvars) de quem enfileirou a mensagem: o ID da
+requisição e o trace seguem até o worker, e a espera na fila vira o span
+"fila.espera".
+"""
+import contextvars
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, List, Optional, Sequence
+
+from services.concorrencia import LimiteAdaptativo
+from services.memoria import DepositoDisco
+from services.metricas import METRICAS, Metricas
+from services.rastreamento import registrar as registrar_span
+
+logger = logging.getLogger("filas")
+
+
+class FilaEncerrada(RuntimeError):
+    """A fila está sendo drenada e não aceita novas mensagens."""
+
+
+class Faixa:
+    """
+    Configuração e estado de uma faixa de prioridade.
+
+    Args:
+        nome: Nome usado no campo `prioridade` e nas métricas
+        parcela: Fração do pool de workers que a faixa pode ocupar (0 a 1)
+        taxa: Envios por segundo permitidos à faixa (None para ilimitado)
+    """
+
+    def __init__(self, nome: str, parcela: float, taxa: Optional[float] = None):
+        self.nome = nome
+        self.parcela = parcela
+        self.taxa = taxa
+        self.fila: Deque["Tarefa"] = deque()
+        self.em_andamento = 0
+        self.limite_simultaneo = 1
+        self._fichas = 1.0
+        self._ultima_ficha = time.monotonic()
+
+    def _repor_fichas(self, agora: float) -> None:
+        if self.taxa is not None:
+            self._fichas = min(max(1.0, self.taxa), self._fichas + (agora - self._ultima_ficha) * self.taxa)
+        self._ultima_ficha = agora
+
+    def espera_por_ficha(self, agora: float) -> float:
+        """Segundos até haver ficha disponível (0 se já houver)."""
+        if self.taxa is None:
+            return 0.0
+        self._repor_fichas(agora)
+        if self._fichas >= 1.0:
+            return 0.0
+        return (1.0 - self._fichas) / self.taxa
+
+    def consumir_ficha(self) -> None:
+        if self.taxa is not None:
+            self._fichas -= 1.0
+
+
+class Tarefa:
+    """
+    Mensagem enfileirada com o futuro que receberá o resultado do envio.
+    Se a mensagem foi para o depósito em disco, `dados` é None e
+    `id_deposito` indica onde buscá-la.
+    """
+
+    __slots__ = ("dados", "faixa", "futuro", "enfileirado_em", "tamanho", "id_deposito", "contexto")
+
+    def __init__(self, dados: Any, faixa: Faixa):
+        self.dados = dados
+        self.faixa = faixa
+        self.futuro: Future = Future()
+        self.enfileirado_em = time.monotonic()
+        self.contexto = contextvars.copy_context()
+        self.tamanho = 0
+        self.id_deposito: Optional[int] = None
+
+
+def tamanho_estimado(dados: Any) -> int:
+    """Bytes aproximados de uma mensagem (usa `dados.tamanho()` se existir)."""
+    medir = getattr(dados, "tamanho", None)
+    if callable(medir):
+        return medir()
+    if isinstance(dados, dict):
+        return 200 + sum(len(valor) for valor in dados.values() if isinstance(valor, (str, bytes)))
+    return 200
+
+
+def faixas_padrao(taxa_baixa: Optional[float] = 5.0) -> List[Faixa]:
+    """
+    Faixas na ordem de prioridade: transacional, normal e campanhas.
+
+    Args:
+        taxa_baixa: Envios por segundo da faixa "baixa" (None: sem limite)
+    """
+    return [
+        Faixa("alta", parcela=1.0),
+        Faixa("normal", parcela=0.75),
+        Faixa("baixa", parcela=0.5, taxa=taxa_baixa),
+    ]
+
+
+class FilaPrioridade:
+    """
+    Fila de envios com faixas de prioridade atendidas por um pool de workers.
+
+    Args:
+        enviar: Função que envia uma mensagem e retorna o resultado
+        faixas: Faixas em ordem decrescente de prioridade
+        workers: Tamanho do pool de workers (envios simultâneos no total)
+        limite_memoria: Bytes de mensagens mantidos em memória (0 para sem limite)
+        deposito: Depósito das mensagens além do limite (padrão: arquivo temporário)
+        limitador: Limite adaptativo de envios simultâneos (substitui `workers`)
+        metricas: Registro de métricas
+    """
+
+    def __init__(self, enviar: Callable[[Any], Any],
+                 faixas: Optional[Sequence[Faixa]] = None, workers: int = 4,
+                 limite_memoria: int = 0, deposito: Optional[DepositoDisco] = None,
+                 limitador: Optional[LimiteAdaptativo] = None,
+                 metricas: Metricas = METRICAS):
+        self.enviar = enviar
+        self.faixas = list(faixas or faixas_padrao())
+        self.por_nome = {faixa.nome: faixa for faixa in self.faixas}
+        self.limitador = limitador
+        self.workers = limitador.maximo if limitador else workers
+        self.limite_memoria = limite_memoria
+        if limite_memoria and deposito is None:
+            deposito = DepositoDisco(os.path.join(tempfile.gettempdir(), f"fila-{os.getpid()}-{id(self)}.db"))
+        self.deposito = deposito
+        self.metricas = metricas
+        self._bytes_em_memoria = 0
+        self._em_andamento = 0
+        self._ajustar_limites(limitador.limite if limitador else workers)
+        self._condicao = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._parar = False
+        self._encerrando = False
+
+    @property
+    def padrao(self) -> str:
+        """Faixa usada quando a prioridade não é informada."""
+        return "normal" if "normal" in self.por_nome else self.faixas[len(self.faixas) // 2].nome
+
+    def iniciar(self) -> None:
+        """Inicia os workers (idempotente)."""
+        with self._condicao:
+            if self._threads:
+                return
+            self._parar = False
+            self._encerrando = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._executar_laco, name=f"fila-envio-{i}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def parar(self, timeout: Optional[float] = None) -> None:
+        with self._condicao:
+            self._parar = True
+            self._condicao.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def fechar_entrada(self) -> None:
+        """Para de aceitar mensagens; as já aceitas continuam sendo enviadas."""
+        with self._condicao:
+            self._encerrando = True
+
+    def drenar(self, prazo: float) -> List[Tarefa]:
+        """
+        Para de aceitar mensagens e espera, por até `prazo` segundos, a fila
+        esvaziar e os envios em andamento terminarem. Encerra os workers e
+        retorna as tarefas que não chegaram a ser enviadas (com os futuros
+        ainda pendentes).
+        """
+        limite = time.monotonic() + prazo
+        with self._condicao:
+            self._encerrando = True
+            while any(faixa.fila or faixa.em_andamento for faixa in self.faixas):
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                # Os workers notificam um único waiter; a espera curta garante que o prazo seja visto
+                self._condicao.wait(timeout=min(restante, 0.1))
+            restantes = [tarefa for faixa in self.faixas for tarefa in faixa.fila]
+            for faixa in self.faixas:
+                faixa.fila.clear()
+                self.metricas.definir("fila_tamanho", 0, {"faixa": faixa.nome})
+            self._bytes_em_memoria = 0
+            self._parar = True
+            self._condicao.notify_all()
+        # As que estavam no disco voltam à memória para serem persistidas pelo chamador
+        for tarefa in restantes:
+            if tarefa.id_deposito is not None:
+                self._carregar(tarefa)
+        if self.deposito is not None:
+            self.deposito.fechar()
+        # Envios ainda em andamento não podem ser interrompidos: esperam o que sobrar do prazo
+        for thread in self._threads:
+            thread.join(max(limite - time.monotonic(), 0.0))
+        self._threads = []
+        if restantes:
+            logger.warning(f"{len(restantes)} mensagens não foram enviadas dentro do prazo de encerramento")
+        return restantes
+
+    def submeter(self, dados: Any, prioridade: Optional[str] = None) -> Future:
+        """Enfileira uma mensagem e retorna o futuro com o resultado do envio."""
+        faixa = self.por_nome.get(prioridade or self.padrao)
+        if faixa is None:
+            raise ValueError(f"Prioridade desconhecida: {prioridade}")
+        if self._encerrando:
+            raise FilaEncerrada("Fila de envio em encerramento")
+        tarefa = Tarefa(dados, faixa)
+        if self.limite_memoria:
+            tarefa.tamanho = tamanho_estimado(dados)
+            # Leitura sem a trava: o limite é aproximado, e a gravação em disco
+            # não segura os workers
+            if self._bytes_em_memoria + tarefa.tamanho > self.limite_memoria:
+                tarefa.id_deposito = self.deposito.guardar(dados)
+                tarefa.dados = None
+                self.metricas.incrementar("fila_mensagens_em_disco")
+        self.iniciar()
+        with self._condicao:
+            if self._encerrando:
+                if tarefa.id_deposito is not None:
+                    self.deposito.retirar(tarefa.id_deposito)
+                raise FilaEncerrada("Fila de envio em encerramento")
+            faixa.fila.append(tarefa)
+            if tarefa.id_deposito is None:
+                self._bytes_em_memoria += tarefa.tamanho
+            self._atualizar_metricas_memoria()
+            self.metricas.definir("fila_tamanho", len(faixa.fila), {"faixa": faixa.nome})
+            self._condicao.notify()
+        return tarefa.futuro
+
+    def _atualizar_metricas_memoria(self) -> None:
+        if self.limite_memoria:
+            self.metricas.definir("fila_memoria_bytes", self._bytes_em_memoria)
+            self.metricas.definir("fila_em_disco", len(self.deposito))
+
+    def _carregar(self, tarefa: Tarefa) -> None:
+        tarefa.dados = self.deposito.retirar(tarefa.id_deposito)
+        tarefa.id_deposito = None
+
+    def _ajustar_limites(self, total: int) -> None:
+        for faixa in self.faixas:
+            faixa.limite_simultaneo = max(1, int(round(faixa.parcela * total)))
+
+    def tamanho(self) -> int:
+        with self._condicao:
+            return sum(len(faixa.fila) for faixa in self.faixas)
+
+    def em_andamento(self) -> int:
+        """Envios que os workers estão executando agora."""
+        with self._condicao:
+            return self._em_andamento
+
+    def _proxima_tarefa(self) -> Optional[Tarefa]:
+        # Chamado com a condição adquirida. Escolhe a faixa de maior prioridade
+        # elegível; se nenhuma estiver, espera o menor tempo até uma ficha.
+        while not self._parar:
+            if self.limitador and self._em_andamento >= self.limitador.limite:
+                self._condicao.wait()
+                continue
+            agora = time.monotonic()
+            espera = None
+            for faixa in self.faixas:
+                if not faixa.fila or faixa.em_andamento >= faixa.limite_simultaneo:
+                    continue
+                falta = faixa.espera_por_ficha(agora)
+                if falta > 0:
+                    espera = falta if espera is None else min(espera, falta)
+                    continue
+                faixa.consumir_ficha()
+                faixa.em_andamento += 1
+                self._em_andamento += 1
+                tarefa = faixa.fila.popleft()
+                if tarefa.id_deposito is None:
+                    self._bytes_em_memoria -= tarefa.tamanho
+                    self._atualizar_metricas_memoria()
+                self.metricas.definir("fila_tamanho", len(faixa.fila), {"faixa": faixa.nome})
+                self.metricas.definir("fila_em_andamento", faixa.em_andamento, {"faixa": faixa.nome})
+                return tarefa
+            self._condicao.wait(timeout=espera)
+        return None
+
+    def _executar_laco(self) -> None:
+        while True:
+            with self._condicao:
+                tarefa = self._proxima_tarefa()
+            if tarefa is None:
+                return
+            tarefa.contexto.run(self._executar_tarefa, tarefa)
+
+    def _executar_tarefa(self, tarefa: Tarefa) -> None:
+        faixa = tarefa.faixa
+        rotulos = {"faixa": faixa.nome}
+        inicio = time.monotonic()
+        espera = inicio - tarefa.enfileirado_em
+        self.metricas.observar("fila_espera_segundos", espera, rotulos)
+        agora_ns = time.time_ns()
+        registrar_span("fila.espera", agora_ns - int(espera * 1e9), agora_ns, {"fila.faixa": faixa.nome})
+        sobrecarga = None
+        try:
+            if tarefa.id_deposito is not None:
+                self._carregar(tarefa)
+                with self._condicao:
+                    self._atualizar_metricas_memoria()
+            resultado = self.enviar(tarefa.dados)
+        except Exception as e:
+            logger.exception(f"Erro inesperado no envio da faixa {faixa.nome}")
+            self.metricas.incrementar("envios_falhos", rotulos=rotulos)
+            tarefa.futuro.set_exception(e)
+        else:
+            sucesso = not isinstance(resultado, dict) or resultado.get("sucesso", False)
+            sobrecarga = isinstance(resultado, dict) and bool(resultado.get("temporario"))
+            self.metricas.incrementar("envios_sucesso" if sucesso else "envios_falhos", rotulos=rotulos)
+            tarefa.futuro.set_result(resultado)
+        finally:
+            fim = time.monotonic()
+            self.metricas.observar("envio_segundos", fim - inicio, rotulos)
+            self.metricas.observar("latencia_total_segundos", fim - tarefa.enfileirado_em, rotulos)
+            with self._condicao:
+                faixa.em_andamento -= 1
+                self._em_andamento -= 1
+                self.metricas.definir("fila_em_andamento", faixa.em_andamento, rotulos)
+                # Exceções são erros do código, não sinal de carga no servidor
+                if self.limitador and sobrecarga is not None:
+                    limite = self.limitador.registrar(fim - inicio, sobrecarga, self._em_andamento)
+                    self._ajustar_limites(limite)
+                if self.limitador:
+                    # Workers além do limite esperam sem prazo: todos precisam rever a vaga
+                    self._condicao.notify_all()
+                else:
+                    self._condicao.notify()
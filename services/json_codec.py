@@ -0,0 +1,38 @@
+# services/json_codec.py
+"""
+Codec JSON usado na decodificação das requisições e na serialização das respostas.
+
+Usa o orjson quando está instalado e cai para o módulo json da biblioteca padrão
+caso contrário. A variável de ambiente JSON_CODEC ("orjson" ou "json") força a
+escolha. Ambas as implementações trabalham com bytes em UTF-8.
+"""
+import json
+import os
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+
+_preferido = os.getenv("JSON_CODEC", "orjson").lower()
+
+if orjson is not None and _preferido == "orjson":
+    NOME = "orjson"
+    # orjson.JSONDecodeError é subclasse de json.JSONDecodeError
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def loads(dados: Union[bytes, str]) -> Any:
+        return orjson.loads(dados)
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+else:
+    NOME = "json"
+    JSONDecodeError = json.JSONDecodeError
+
+    def loads(dados: Union[bytes, str]) -> Any:
+        return json.loads(dados)
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,224 @@
+# services/memoria.py
+"""
+Orçamento de memória do worker (o contêiner tem 256 MB).
+
+- Métricas de RSS atual e de pico (ru_maxrss), atualizadas a cada leitura
+  de /api/metricas.
+- Modo de depuração (MEMORIA_DEBUG): tracemalloc mede o que cada etapa do
+  envio (decodificar, validar, enfileirar, enviar) aloca e, a cada
+  `amostragem` execuções de uma etapa, guarda as linhas que mais alocaram
+  nela (diferença entre dois snapshots). Como o tracemalloc é do processo,
+  etapas simultâneas em outras threads entram na mesma medição.
+- Corpos compartilhados: mensagens com o mesmo corpo (uma campanha enviada
+  pela API, destinatário por destinatário) apontam para um único objeto,
+  liberado quando a última delas sai da fila.
+- DepositoDisco: onde a fila de envio guarda as mensagens que excedem o seu
+  limite de memória (FILA_MEMORIA_MB), até um worker retirá-las.
+"""
+import itertools
+import logging
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, Optional
+
+from services.metricas import METRICAS, Metricas
+
+logger = logging.getLogger("memoria")
+
+
+def rss_atual_bytes() -> Optional[int]:
+    """Memória residente atual do processo (só em sistemas com /proc)."""
+    try:
+        with open("/proc/self/statm", "rb") as arquivo:
+            return int(arquivo.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def rss_pico_bytes() -> Optional[int]:
+    """Maior memória residente que o processo já teve."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Em quilobytes no Linux, em bytes no macOS
+    return pico if sys.platform == "darwin" else pico * 1024
+
+
+def atualizar_metricas(metricas: Metricas = METRICAS) -> None:
+    """Atualiza os medidores de memória do processo."""
+    for nome, valor in (("memoria_rss_bytes", rss_atual_bytes()),
+                        ("memoria_rss_pico_bytes", rss_pico_bytes())):
+        if valor is not None:
+            metricas.definir(nome, valor)
+    metricas.definir("memoria_corpos_compartilhados", len(_corpos))
+
+
+class Corpo:
+    """Corpo HTML compartilhado entre mensagens iguais (ver compartilhar_corpo)."""
+
+    __slots__ = ("texto", "__weakref__")
+
+    def __init__(self, texto: str):
+        self.texto = texto
+
+    def __reduce__(self):
+        # Ao sair do disco, volta a ser compartilhado
+        return compartilhar_corpo, (self.texto,)
+
+
+# O texto é a própria chave: a entrada some quando a última mensagem solta o Corpo
+_corpos: "weakref.WeakValueDictionary[str, Corpo]" = weakref.WeakValueDictionary()
+_lock_corpos = threading.Lock()
+
+def compartilhar_corpo(texto: str) -> Corpo:
+    """Retorna o Corpo já em uso com o mesmo texto, ou um novo."""
+    with _lock_corpos:
+        corpo = _corpos.get(texto)
+        if corpo is None:
+            corpo = _corpos[texto] = Corpo(texto)
+        return corpo
+
+
+class DepositoDisco:
+    """
+    Depósito temporário em SQLite para itens que não cabem na memória.
+    Cada item é guardado serializado com pickle e apagado ao ser retirado;
+    o arquivo é removido em `fechar`.
+    """
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self._conexao: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._quantidade = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conexao is None:
+            diretorio = os.path.dirname(self.caminho)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            conexao = sqlite3.connect(self.caminho, timeout=30, check_same_thread=False,
+                                      isolation_level=None)
+            # Conteúdo descartável: não há por que esperar pelo fsync
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=OFF")
+            conexao.execute("CREATE TABLE IF NOT EXISTS itens (id INTEGER PRIMARY KEY, dados BLOB NOT NULL)")
+            conexao.execute("DELETE FROM itens")
+            self._conexao = conexao
+        return self._conexao
+
+    def guardar(self, item: Any) -> int:
+        """Guarda o item e retorna o identificador para retirá-lo."""
+        dados = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            id = self._db().execute("INSERT INTO itens (dados) VALUES (?)", (dados,)).lastrowid
+            self._quantidade += 1
+        return id
+
+    def retirar(self, id: int) -> Any:
+        with self._lock:
+            conexao = self._db()
+            linha = conexao.execute("SELECT dados FROM itens WHERE id = ?", (id,)).fetchone()
+            conexao.execute("DELETE FROM itens WHERE id = ?", (id,))
+            self._quantidade -= 1
+        return pickle.loads(linha[0])
+
+    def __len__(self) -> int:
+        return self._quantidade
+
+    def fechar(self) -> None:
+        with self._lock:
+            if self._conexao is not None:
+                self._conexao.close()
+                self._conexao = None
+            self._quantidade = 0
+            for sufixo in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.caminho + sufixo)
+                except FileNotFoundError:
+                    pass
+
+
+class RastreadorMemoria:
+    """
+    Medição de memória por etapa com tracemalloc, ativa só no modo de
+    depuração (sem ele, `etapa` não custa nada além de uma chamada).
+
+    Args:
+        ativo: Liga o tracemalloc e a medição
+        amostragem: Guarda as maiores alocações de uma etapa a cada N execuções
+        limite: Linhas guardadas por etapa
+        quadros: Quadros da pilha guardados por alocação
+        metricas: Registro de métricas
+    """
+
+    def __init__(self, ativo: bool = False, amostragem: int = 100, limite: int = 10,
+                 quadros: int = 1, metricas: Metricas = METRICAS):
+        self.ativo = ativo
+        self.amostragem = max(1, amostragem)
+        self.limite = limite
+        self.metricas = metricas
+        self._contagens: Dict[str, Iterator[int]] = {}
+        self._etapas: Dict[str, Dict[str, Any]] = {}
+        self._filtros = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+        if ativo and not tracemalloc.is_tracing():
+            tracemalloc.start(quadros)
+
+    def etapa(self, nome: str):
+        """Contexto que mede a memória alocada dentro de uma etapa."""
+        if not self.ativo:
+            return nullcontext()
+        return self._medir(nome)
+
+    @contextmanager
+    def _medir(self, nome: str):
+        contagem = self._contagens.get(nome)
+        if contagem is None:
+            contagem = self._contagens.setdefault(nome, itertools.count())
+        antes = tracemalloc.take_snapshot().filter_traces(self._filtros) \
+            if next(contagem) % self.amostragem == 0 else None
+        inicial, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            final, pico = tracemalloc.get_traced_memory()
+            rotulos = {"etapa": nome}
+            self.metricas.observar("memoria_etapa_bytes", final - inicial, rotulos)
+            self.metricas.observar("memoria_etapa_pico_bytes", max(pico - inicial, 0), rotulos)
+            if antes is not None:
+                depois = tracemalloc.take_snapshot().filter_traces(self._filtros)
+                self._etapas[nome] = {
+                    "medido_em": time.time(),
+                    "pico_bytes": max(pico - inicial, 0),
+                    "alocacoes": [
+                        {"local": str(diferenca.traceback), "bytes": diferenca.size_diff,
+                         "blocos": diferenca.count_diff}
+                        for diferenca in depois.compare_to(antes, "lineno")[:self.limite]
+                    ],
+                }
+
+    def relatorio(self) -> Dict[str, Any]:
+        """Memória do processo e, no modo de depuração, as últimas amostras por etapa."""
+        relatorio: Dict[str, Any] = {
+            "rss_bytes": rss_atual_bytes(),
+            "rss_pico_bytes": rss_pico_bytes(),
+            "corpos_compartilhados": len(_corpos),
+            "rastreamento": self.ativo,
+        }
+        if self.ativo:
+            relatorio["rastreado_bytes"] = tracemalloc.get_traced_memory()[0]
+            relatorio["etapas"] = dict(self._etapas)
+        return relatorio
@@ -0,0 +1,346 @@
+# services/mensagens.py
+"""
+Histórico de mensagens: status de cada envio, consultável pela API.
+
+As mudanças de status (enfileirado, agendado, enviado, falhou, devolvido,
+cancelado) são acumuladas em memória e gravadas em lote por uma thread, em
+uma única transação SQLite a cada `intervalo` segundos ou `tamanho_lote`
+registros. O envio nunca espera pelo disco; em troca, uma mudança leva até
+`intervalo` segundos para aparecer nas consultas.
+
+A tabela é indexada por destinatário, chave de API, status e data, e a busca
+usa paginação por cursor (keyset) em (criado_em, id): cada página custa o
+mesmo, não importa quão fundo se vá. Registros mais antigos que `retencao`
+segundos são apagados periodicamente, em pequenos lotes.
+"""
+import base64
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.memoria import Corpo, compartilhar_corpo
+from services.metricas import METRICAS, Metricas
+
+logger = logging.getLogger("mensagens")
+
+ENFILEIRADO = "enfileirado"
+AGENDADO = "agendado"
+ENVIADO = "enviado"
+FALHOU = "falhou"
+DEVOLVIDO = "devolvido"
+CANCELADO = "cancelado"
+STATUS = (ENFILEIRADO, AGENDADO, ENVIADO, FALHOU, DEVOLVIDO, CANCELADO)
+
+
+class Mensagem:
+    """
+    Mensagem aceita pela API a caminho do envio.
+
+    Registro compacto (__slots__, sem um dicionário por instância) com o
+    corpo compartilhado entre mensagens iguais: uma fila com milhares de
+    envios da mesma campanha guarda o corpo uma única vez. Agendamentos e
+    mensagens persistidas no encerramento usam a forma de dicionário.
+    `rastro` guarda o ID da requisição e o trace de origem (ver
+    services.rastreamento.propagar) para o envio que acontecer mais tarde.
+    """
+
+    __slots__ = ("id", "chave", "destinatario", "assunto", "_corpo", "remetente", "prioridade", "anexos",
+                 "rastro")
+    CAMPOS = ("id", "chave", "destinatario", "assunto", "corpo", "remetente", "prioridade", "anexos",
+              "rastro")
+
+    def __init__(self, id: str, destinatario: str, assunto: str, corpo: str,
+                 chave: Optional[str] = None, remetente: Optional[str] = None,
+                 prioridade: Optional[str] = None, anexos: Optional[List[Dict[str, Any]]] = None,
+                 rastro: Optional[str] = None):
+        self.id = id
+        self.chave = chave
+        self.destinatario = destinatario
+        self.assunto = assunto
+        self._corpo: Corpo = compartilhar_corpo(corpo)
+        self.remetente = remetente
+        self.prioridade = prioridade
+        self.anexos = anexos
+        self.rastro = rastro
+
+    @property
+    def corpo(self) -> str:
+        return self._corpo.texto
+
+    def tamanho(self) -> int:
+        """Estimativa dos bytes em memória (o corpo conta inteiro, mesmo compartilhado)."""
+        return 200 + len(self.corpo) + len(self.assunto or "") + len(self.destinatario or "")
+
+    def para_dict(self) -> Dict[str, Any]:
+        return {campo: getattr(self, campo) for campo in self.CAMPOS}
+
+    @classmethod
+    def de_dict(cls, dados: Dict[str, Any]) -> "Mensagem":
+        return cls(**{campo: dados.get(campo) for campo in cls.CAMPOS})
+
+ESQUEMA_SQL = """
+CREATE TABLE IF NOT EXISTS mensagens (
+    id TEXT PRIMARY KEY,
+    chave TEXT,
+    destinatario TEXT COLLATE NOCASE,
+    assunto TEXT,
+    status TEXT NOT NULL,
+    detalhe TEXT,
+    criado_em REAL NOT NULL,
+    atualizado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_mensagens_destinatario
+    ON mensagens (destinatario, criado_em);
+CREATE INDEX IF NOT EXISTS idx_mensagens_chave
+    ON mensagens (chave, criado_em);
+CREATE INDEX IF NOT EXISTS idx_mensagens_chave_status
+    ON mensagens (chave, status, criado_em);
+CREATE INDEX IF NOT EXISTS idx_mensagens_criado_em
+    ON mensagens (criado_em);
+"""
+
+# Inserção ou atualização: o status mais recente prevalece, mesmo que os
+# registros de uma mensagem cheguem fora de ordem (gravados por workers diferentes)
+GRAVAR_SQL = """
+INSERT INTO mensagens (id, chave, destinatario, assunto, status, detalhe, criado_em, atualizado_em)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    status = CASE WHEN excluded.atualizado_em >= mensagens.atualizado_em
+                  THEN excluded.status ELSE mensagens.status END,
+    detalhe = CASE WHEN excluded.atualizado_em >= mensagens.atualizado_em
+                   THEN excluded.detalhe ELSE mensagens.detalhe END,
+    atualizado_em = MAX(excluded.atualizado_em, mensagens.atualizado_em),
+    criado_em = MIN(excluded.criado_em, mensagens.criado_em),
+    chave = COALESCE(mensagens.chave, excluded.chave),
+    destinatario = COALESCE(mensagens.destinatario, excluded.destinatario),
+    assunto = COALESCE(mensagens.assunto, excluded.assunto)
+"""
+
+COLUNAS = ("id", "destinatario", "assunto", "status", "detalhe", "criado_em", "atualizado_em")
+
+Registro = Tuple[str, Optional[str], Optional[str], Optional[str], str, Optional[str], float, float]
+
+
+def codificar_cursor(criado_em: float, id: str) -> str:
+    return base64.urlsafe_b64encode(f"{criado_em!r}:{id}".encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> Tuple[float, str]:
+    """Levanta ValueError se o cursor for inválido."""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        criado_em, id = texto.split(":", 1)
+        return float(criado_em), id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Cursor inválido") from e
+
+
+class RegistroMensagens:
+    """
+    Histórico persistente de mensagens, com gravação em lote.
+
+    Args:
+        caminho_db: Arquivo SQLite do histórico
+        intervalo: Segundos máximos entre gravações
+        tamanho_lote: Registros acumulados que antecipam a gravação
+        capacidade: Registros aguardando gravação; além disso, novos são descartados
+        retencao: Segundos que um registro é mantido (0 mantém para sempre)
+        intervalo_limpeza: Segundos entre as remoções de registros antigos
+        metricas: Registro de métricas
+    """
+
+    def __init__(self, caminho_db: str, intervalo: float = 1.0, tamanho_lote: int = 500,
+                 capacidade: int = 100000, retencao: float = 30 * 86400,
+                 intervalo_limpeza: float = 3600.0, metricas: Metricas = METRICAS):
+        self.caminho_db = caminho_db
+        self.intervalo = intervalo
+        self.tamanho_lote = tamanho_lote
+        self.capacidade = capacidade
+        self.retencao = retencao
+        self.intervalo_limpeza = intervalo_limpeza
+        self.metricas = metricas
+        self._pendentes: List[Registro] = []
+        self._lock = threading.Lock()
+        self._lock_db = threading.Lock()
+        self._lock_gravacao = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._conexao: Optional[sqlite3.Connection] = None
+        self._conexao_gravacao: Optional[sqlite3.Connection] = None
+
+    # Banco de dados
+
+    def _conectar(self) -> sqlite3.Connection:
+        diretorio = os.path.dirname(self.caminho_db)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        conexao = sqlite3.connect(self.caminho_db, timeout=30, check_same_thread=False,
+                                  isolation_level=None)
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.execute("PRAGMA synchronous=NORMAL")
+        conexao.executescript(ESQUEMA_SQL)
+        return conexao
+
+    def _db(self) -> sqlite3.Connection:
+        # Conexão de leitura, aberta sob demanda; em WAL, leituras não esperam a gravação
+        if self._conexao is None:
+            self._conexao = self._conectar()
+        return self._conexao
+
+    def _consultar(self, sql: str, parametros: tuple = ()) -> List[tuple]:
+        with self._lock_db:
+            return self._db().execute(sql, parametros).fetchall()
+
+    # Registro (chamado no caminho do envio)
+
+    def registrar(self, id: str, status: str, chave: Optional[str] = None,
+                  destinatario: Optional[str] = None, assunto: Optional[str] = None,
+                  detalhe: Optional[str] = None) -> bool:
+        """Acumula uma mudança de status para a próxima gravação. Nunca toca o disco."""
+        agora = time.time()
+        with self._lock:
+            if len(self._pendentes) >= self.capacidade:
+                self.metricas.incrementar("mensagens_registros_descartados")
+                return False
+            self._pendentes.append((id, chave, destinatario, assunto, status, detalhe, agora, agora))
+            cheio = len(self._pendentes) >= self.tamanho_lote
+        if cheio:
+            self._acordar.set()
+        if self._thread is None or not self._thread.is_alive():
+            self.iniciar()
+        return True
+
+    def gravar(self) -> int:
+        """Grava os registros acumulados em uma transação. Retorna quantos foram gravados."""
+        with self._lock_gravacao:
+            with self._lock:
+                lote, self._pendentes = self._pendentes, []
+            if not lote:
+                return 0
+            inicio = time.monotonic()
+            try:
+                if self._conexao_gravacao is None:
+                    self._conexao_gravacao = self._conectar()
+                conexao = self._conexao_gravacao
+                conexao.execute("BEGIN IMMEDIATE")
+                try:
+                    conexao.executemany(GRAVAR_SQL, lote)
+                    conexao.execute("COMMIT")
+                except BaseException:
+                    conexao.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error:
+                logger.exception(f"Falha ao gravar {len(lote)} registros de mensagens")
+                self.metricas.incrementar("mensagens_registros_descartados", len(lote))
+                return 0
+            self.metricas.observar("mensagens_gravacao_segundos", time.monotonic() - inicio)
+            return len(lote)
+
+    def limpar_antigas(self, agora: Optional[float] = None, lote: int = 1000) -> int:
+        """Apaga os registros além da retenção, em lotes curtos. Retorna quantos foram apagados."""
+        if not self.retencao:
+            return 0
+        limite = (agora if agora is not None else time.time()) - self.retencao
+        removidos = 0
+        with self._lock_gravacao:
+            if self._conexao_gravacao is None:
+                self._conexao_gravacao = self._conectar()
+            while True:
+                # Lotes pequenos mantêm cada transação curta e não atrasam as gravações
+                apagados = self._conexao_gravacao.execute(
+                    "DELETE FROM mensagens WHERE id IN "
+                    "(SELECT id FROM mensagens WHERE criado_em < ? LIMIT ?)",
+                    (limite, lote),
+                ).rowcount
+                removidos += apagados
+                if apagados < lote:
+                    break
+        if removidos:
+            logger.info(f"{removidos} registros de mensagens além da retenção removidos")
+        return removidos
+
+    # Consultas
+
+    def consultar(self, id: str, chave: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Registro da mensagem. Com `chave`, só os enviados por aquela chave."""
+        sql = f"SELECT {', '.join(COLUNAS)} FROM mensagens WHERE id = ?"
+        parametros: tuple = (id,)
+        if chave is not None:
+            sql += " AND chave = ?"
+            parametros += (chave,)
+        linhas = self._consultar(sql, parametros)
+        return dict(zip(COLUNAS, linhas[0])) if linhas else None
+
+    def buscar(self, chave: Optional[str] = None, destinatario: Optional[str] = None,
+               status: Optional[str] = None, desde: Optional[float] = None,
+               ate: Optional[float] = None, limite: int = 50,
+               cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Busca mensagens, das mais recentes para as mais antigas. Retorna a
+        página e o cursor da próxima (None na última).
+        """
+        condicoes, parametros = [], []
+        for coluna, valor in (("chave", chave), ("destinatario", destinatario), ("status", status)):
+            if valor is not None:
+                condicoes.append(f"{coluna} = ?")
+                parametros.append(valor)
+        if desde is not None:
+            condicoes.append("criado_em >= ?")
+            parametros.append(desde)
+        if ate is not None:
+            condicoes.append("criado_em < ?")
+            parametros.append(ate)
+        if cursor:
+            criado_em, id = decodificar_cursor(cursor)
+            condicoes.append("(criado_em < ? OR (criado_em = ? AND id < ?))")
+            parametros.extend((criado_em, criado_em, id))
+
+        sql = f"SELECT {', '.join(COLUNAS)} FROM mensagens"
+        if condicoes:
+            sql += " WHERE " + " AND ".join(condicoes)
+        sql += " ORDER BY criado_em DESC, id DESC LIMIT ?"
+        # Uma linha a mais indica se há próxima página
+        linhas = self._consultar(sql, tuple(parametros) + (limite + 1,))
+        itens = [dict(zip(COLUNAS, linha)) for linha in linhas[:limite]]
+        proximo = None
+        if len(linhas) > limite:
+            ultimo = itens[-1]
+            proximo = codificar_cursor(ultimo["criado_em"], ultimo["id"])
+        return itens, proximo
+
+    # Ciclo de vida
+
+    def iniciar(self) -> None:
+        """Inicia a thread de gravação (idempotente)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._executar_laco, name="mensagens", daemon=True)
+            self._thread.start()
+
+    def parar(self, timeout: Optional[float] = None) -> None:
+        """Encerra a thread e grava o que estiver pendente."""
+        self._parar.set()
+        self._acordar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+        self.gravar()
+
+    def _executar_laco(self) -> None:
+        proxima_limpeza = time.monotonic()
+        while not self._parar.is_set():
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            self.gravar()
+            if time.monotonic() >= proxima_limpeza:
+                proxima_limpeza = time.monotonic() + self.intervalo_limpeza
+                try:
+                    self.limpar_antigas()
+                except sqlite3.Error:
+                    logger.exception("Falha ao remover registros antigos de mensagens")
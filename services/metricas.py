@@ -0,0 +1,95 @@
+# services/metricas.py
+"""
+Métricas em memória do processo: contadores, medidores e histogramas de latência.
+
+Os histogramas guardam uma janela das amostras mais recentes (deque limitado),
+suficiente para calcular p50/p95/p99 recentes sem crescer com o tráfego.
+"""
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+Rotulos = Tuple[Tuple[str, str], ...]
+
+
+def _chave(nome: str, rotulos: Optional[Dict[str, str]]) -> Tuple[str, Rotulos]:
+    return nome, tuple(sorted((rotulos or {}).items()))
+
+
+class Histograma:
+    """Janela deslizante de amostras com contagem e soma acumuladas."""
+
+    def __init__(self, tamanho_janela: int = 2048):
+        self._amostras = deque(maxlen=tamanho_janela)
+        self.contagem = 0
+        self.soma = 0.0
+
+    def observar(self, valor: float) -> None:
+        self._amostras.append(valor)
+        self.contagem += 1
+        self.soma += valor
+
+    def percentis(self, *percentis: float) -> Dict[str, Optional[float]]:
+        amostras = sorted(self._amostras)
+        resultado = {}
+        for p in percentis:
+            nome = f"p{p:g}"
+            if not amostras:
+                resultado[nome] = None
+                continue
+            indice = min(len(amostras) - 1, int(round(p / 100 * (len(amostras) - 1))))
+            resultado[nome] = amostras[indice]
+        return resultado
+
+
+class Metricas:
+    """Registro de métricas thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores: Dict[Tuple[str, Rotulos], float] = {}
+        self._medidores: Dict[Tuple[str, Rotulos], float] = {}
+        self._histogramas: Dict[Tuple[str, Rotulos], Histograma] = {}
+
+    def incrementar(self, nome: str, valor: float = 1, rotulos: Optional[Dict[str, str]] = None) -> None:
+        chave = _chave(nome, rotulos)
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def definir(self, nome: str, valor: float, rotulos: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            self._medidores[_chave(nome, rotulos)] = valor
+
+    def observar(self, nome: str, valor: float, rotulos: Optional[Dict[str, str]] = None) -> None:
+        chave = _chave(nome, rotulos)
+        with self._lock:
+            histograma = self._histogramas.get(chave)
+            if histograma is None:
+                histograma = self._histogramas[chave] = Histograma()
+            histograma.observar(valor)
+
+    def instantaneo(self) -> Dict[str, Any]:
+        """Retorna uma cópia serializável de todas as métricas."""
+        def rotular(chave):
+            nome, rotulos = chave
+            return {"nome": nome, "rotulos": dict(rotulos)}
+
+        with self._lock:
+            return {
+                "contadores": [dict(rotular(c), valor=v) for c, v in self._contadores.items()],
+                "medidores": [dict(rotular(c), valor=v) for c, v in self._medidores.items()],
+                "histogramas": [
+                    dict(rotular(c), contagem=h.contagem, soma=h.soma, **h.percentis(50, 95, 99))
+                    for c, h in self._histogramas.items()
+                ],
+            }
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._contadores.clear()
+            self._medidores.clear()
+            self._histogramas.clear()
+
+
+# Registro global do processo
+METRICAS = Metricas()
@@ -0,0 +1,357 @@
+# services/rastreamento.py
+"""
+Rastreamento leve do caminho de envio (spans no formato OTLP).
+
+Cada requisição vira um trace: um span raiz para a chamada HTTP e spans
+filhos para as etapas (decodificar, validar, enfileirar), a espera na fila,
+o envio e cada tentativa SMTP. O span atual e o ID da requisição ficam em
+variáveis de contexto (contextvars); a fila de envio copia o contexto de quem
+enfileirou para o worker, então o envio assíncrono continua no mesmo trace.
+Mensagens que saem do processo (agendadas ou persistidas no encerramento)
+levam o contexto em `Mensagem.rastro` e o retomam com `Rastreador.retomar`.
+
+A amostragem é decidida no span raiz (ou herdada do cabeçalho `traceparent`
+recebido) e vale para o trace inteiro. Os spans amostrados são acumulados em
+memória e gravados em lote por uma thread, uma linha JSON por lote no formato
+de exportação OTLP (o mesmo do exportador de arquivo do OpenTelemetry
+Collector). Sem arquivo configurado o rastreador fica desligado e `span` não
+custa mais que uma chamada.
+
+Os módulos do envio não conhecem o rastreador: `rastrear` e `registrar`
+criam spans filhos do span atual (e não fazem nada fora de um trace).
+"""
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from services import json_codec
+from services.metricas import METRICAS, Metricas
+
+logger = logging.getLogger("rastreamento")
+
+# Tipos de span do OTLP
+INTERNO = 1
+SERVIDOR = 2
+CLIENTE = 3
+
+ID_REQUISICAO: ContextVar[Optional[str]] = ContextVar("id_requisicao", default=None)
+_span_atual: ContextVar[Optional["Span"]] = ContextVar("span_atual", default=None)
+
+
+class Span:
+    """
+    Operação medida dentro de um trace. Spans não amostrados só carregam os
+    IDs (para propagação) e ignoram atributos.
+    """
+
+    __slots__ = ("rastreador", "nome", "id_trace", "id_span", "id_pai", "amostrado", "tipo",
+                 "inicio_ns", "fim_ns", "atributos", "erro", "_token")
+
+    def __init__(self, rastreador: Optional["Rastreador"], nome: str, id_trace: str, id_span: str,
+                 id_pai: Optional[str] = None, amostrado: bool = False, tipo: int = INTERNO,
+                 inicio_ns: Optional[int] = None):
+        self.rastreador = rastreador
+        self.nome = nome
+        self.id_trace = id_trace
+        self.id_span = id_span
+        self.id_pai = id_pai
+        self.amostrado = amostrado
+        self.tipo = tipo
+        self.inicio_ns = inicio_ns if inicio_ns is not None else time.time_ns()
+        self.fim_ns: Optional[int] = None
+        self.atributos: Dict[str, Any] = {}
+        self.erro: Optional[str] = None
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        """Contexto no formato W3C Trace Context."""
+        return f"00-{self.id_trace}-{self.id_span}-{'01' if self.amostrado else '00'}"
+
+    def definir(self, chave: str, valor: Any) -> None:
+        if self.amostrado and valor is not None:
+            self.atributos[chave] = valor
+
+    def marcar_erro(self, mensagem: Optional[str]) -> None:
+        if self.amostrado:
+            self.erro = mensagem or "erro"
+
+    def finalizar(self, fim_ns: Optional[int] = None) -> None:
+        """Encerra o span, devolve o contexto ao pai e o envia para exportação."""
+        if self.fim_ns is not None:
+            return
+        self.fim_ns = fim_ns if fim_ns is not None else time.time_ns()
+        if self._token is not None:
+            try:
+                _span_atual.reset(self._token)
+            except ValueError:
+                # Encerrado em outro contexto (ex.: outra thread): não há o que restaurar
+                pass
+            self._token = None
+        if self.amostrado and self.rastreador is not None:
+            self.rastreador._exportar(self)
+
+    def para_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.id_trace,
+            "spanId": self.id_span,
+            "name": self.nome,
+            "kind": self.tipo,
+            "startTimeUnixNano": str(self.inicio_ns),
+            "endTimeUnixNano": str(self.fim_ns),
+            "attributes": [atributo_otlp(chave, valor) for chave, valor in self.atributos.items()],
+            "status": {"code": 2, "message": self.erro} if self.erro is not None else {},
+        }
+        if self.id_pai:
+            span["parentSpanId"] = self.id_pai
+        return span
+
+
+# Devolvido fora de um trace: aceita as mesmas chamadas e não registra nada
+SPAN_NULO = Span(None, "", "0" * 32, "0" * 16)
+
+
+def atributo_otlp(chave: str, valor: Any) -> Dict[str, Any]:
+    if isinstance(valor, bool):
+        return {"key": chave, "value": {"boolValue": valor}}
+    if isinstance(valor, int):
+        # Inteiros de 64 bits vão como texto no JSON do OTLP
+        return {"key": chave, "value": {"intValue": str(valor)}}
+    if isinstance(valor, float):
+        return {"key": chave, "value": {"doubleValue": valor}}
+    return {"key": chave, "value": {"stringValue": str(valor)}}
+
+
+def ler_traceparent(valor: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(id do trace, id do span pai, amostrado) de um cabeçalho traceparent, ou None se inválido."""
+    if not valor:
+        return None
+    partes = valor.strip().split("-")
+    if len(partes) != 4 or len(partes[1]) != 32 or len(partes[2]) != 16 or len(partes[3]) != 2:
+        return None
+    try:
+        int(partes[1], 16), int(partes[2], 16)
+        opcoes = int(partes[3], 16)
+    except ValueError:
+        return None
+    if partes[1] == "0" * 32 or partes[2] == "0" * 16:
+        return None
+    return partes[1].lower(), partes[2].lower(), bool(opcoes & 1)
+
+
+def span_atual() -> Span:
+    return _span_atual.get() or SPAN_NULO
+
+
+def rastrear(nome: str, atributos: Optional[Dict[str, Any]] = None, tipo: int = INTERNO):
+    """Contexto com um span filho do atual (SPAN_NULO fora de um trace amostrado)."""
+    pai = _span_atual.get()
+    if pai is None or not pai.amostrado or pai.rastreador is None:
+        return nullcontext(SPAN_NULO)
+    return pai.rastreador.span(nome, atributos, tipo=tipo)
+
+
+def registrar(nome: str, inicio_ns: int, fim_ns: int, atributos: Optional[Dict[str, Any]] = None) -> None:
+    """Registra um span já concluído (ex.: espera na fila), filho do atual."""
+    pai = _span_atual.get()
+    if pai is None or not pai.amostrado or pai.rastreador is None:
+        return
+    span = Span(pai.rastreador, nome, pai.id_trace, pai.rastreador._novo_id_span(), pai.id_span,
+                True, INTERNO, inicio_ns)
+    for chave, valor in (atributos or {}).items():
+        span.definir(chave, valor)
+    span.finalizar(fim_ns)
+
+
+def propagar() -> Optional[str]:
+    """
+    Contexto atual em forma de texto, para mensagens que saem do processo:
+    o ID da requisição e, dentro de um trace, o traceparent ("id;traceparent").
+    """
+    id_requisicao = ID_REQUISICAO.get()
+    span = _span_atual.get()
+    if span is None:
+        return id_requisicao
+    return f"{id_requisicao or ''};{span.traceparent}"
+
+
+class Rastreador:
+    """
+    Cria spans e os exporta em lote para um arquivo OTLP-JSON.
+
+    Args:
+        arquivo: Arquivo de saída (JSON Lines); vazio ou None desliga o rastreamento
+        amostragem: Fração dos traces iniciados aqui que são registrados (0 a 1)
+        intervalo: Segundos máximos entre gravações
+        tamanho_lote: Spans acumulados que antecipam a gravação
+        capacidade: Spans aguardando gravação; além disso, novos são descartados
+        servico: Valor de service.name no recurso exportado
+        semente: Semente da amostragem e dos IDs (para testes)
+        metricas: Registro de métricas
+    """
+
+    def __init__(self, arquivo: Optional[str] = None, amostragem: float = 1.0,
+                 intervalo: float = 5.0, tamanho_lote: int = 512, capacidade: int = 10000,
+                 servico: str = "email-service", semente: Optional[int] = None,
+                 metricas: Metricas = METRICAS):
+        if not 0 <= amostragem <= 1:
+            raise ValueError("A amostragem deve estar entre 0 e 1")
+        self.arquivo = arquivo or None
+        self.ativo = self.arquivo is not None
+        self.amostragem = amostragem
+        self.intervalo = intervalo
+        self.tamanho_lote = tamanho_lote
+        self.capacidade = capacidade
+        self.servico = servico
+        self.metricas = metricas
+        self._aleatorio = random.Random(semente)
+        self._pendentes: List[Span] = []
+        self._lock = threading.Lock()
+        self._lock_gravacao = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _novo_id_span(self) -> str:
+        return f"{self._aleatorio.getrandbits(64) or 1:016x}"
+
+    # Criação de spans
+
+    def iniciar_span(self, nome: str, atributos: Optional[Dict[str, Any]] = None,
+                     pai: Optional[str] = None, tipo: int = INTERNO) -> Span:
+        """
+        Abre um span e o torna o atual; quem abre chama `finalizar`. Sem span
+        atual, começa um trace (continuando o `pai` traceparent, se válido).
+        """
+        if not self.ativo:
+            return SPAN_NULO
+        atual = _span_atual.get()
+        remoto = ler_traceparent(pai) if atual is None else None
+        if atual is not None:
+            id_trace, id_pai, amostrado = atual.id_trace, atual.id_span, atual.amostrado
+        elif remoto is not None:
+            id_trace, id_pai, amostrado = remoto
+        else:
+            id_trace = f"{self._aleatorio.getrandbits(128) or 1:032x}"
+            id_pai = None
+            amostrado = self._aleatorio.random() < self.amostragem
+        span = Span(self, nome, id_trace, self._novo_id_span(), id_pai, amostrado, tipo)
+        if amostrado and atributos:
+            for chave, valor in atributos.items():
+                span.definir(chave, valor)
+        span._token = _span_atual.set(span)
+        return span
+
+    def span(self, nome: str, atributos: Optional[Dict[str, Any]] = None,
+             pai: Optional[str] = None, tipo: int = INTERNO):
+        """Contexto com um span; exceções que o atravessam o marcam como erro."""
+        if not self.ativo:
+            return nullcontext(SPAN_NULO)
+        return self._span(nome, atributos, pai, tipo)
+
+    @contextmanager
+    def _span(self, nome, atributos, pai, tipo):
+        span = self.iniciar_span(nome, atributos, pai, tipo)
+        try:
+            yield span
+        except BaseException as e:
+            span.definir("exception.type", type(e).__name__)
+            span.marcar_erro(str(e))
+            raise
+        finally:
+            span.finalizar()
+
+    @contextmanager
+    def retomar(self, rastro: Optional[str]):
+        """Restaura o contexto guardado por `propagar` (ID da requisição e trace)."""
+        id_requisicao, _, traceparent = (rastro or "").partition(";")
+        token_id = ID_REQUISICAO.set(id_requisicao or None)
+        remoto = ler_traceparent(traceparent) if self.ativo else None
+        # O pai remoto não é exportado: só empresta os IDs aos filhos
+        token_span = _span_atual.set(Span(self, "", remoto[0], remoto[1], None, remoto[2])) \
+            if remoto else None
+        try:
+            yield
+        finally:
+            if token_span is not None:
+                _span_atual.reset(token_span)
+            ID_REQUISICAO.reset(token_id)
+
+    # Exportação
+
+    def _exportar(self, span: Span) -> None:
+        with self._lock:
+            if len(self._pendentes) >= self.capacidade:
+                self.metricas.incrementar("rastreamento_spans_descartados")
+                return
+            self._pendentes.append(span)
+            cheio = len(self._pendentes) >= self.tamanho_lote
+        if cheio:
+            self._acordar.set()
+        if self._thread is None or not self._thread.is_alive():
+            self.iniciar()
+
+    def gravar(self) -> int:
+        """Grava os spans acumulados como uma linha OTLP-JSON. Retorna quantos foram gravados."""
+        with self._lock_gravacao:
+            with self._lock:
+                lote, self._pendentes = self._pendentes, []
+            if not lote:
+                return 0
+            linha = json_codec.dumps({"resourceSpans": [{
+                "resource": {"attributes": [atributo_otlp("service.name", self.servico),
+                                            atributo_otlp("process.pid", os.getpid())]},
+                "scopeSpans": [{
+                    "scope": {"name": "services.rastreamento"},
+                    "spans": [span.para_otlp() for span in lote],
+                }],
+            }]})
+            try:
+                diretorio = os.path.dirname(self.arquivo)
+                if diretorio:
+                    os.makedirs(diretorio, exist_ok=True)
+                with open(self.arquivo, "ab") as saida:
+                    saida.write(linha + b"\n")
+            except OSError:
+                logger.exception(f"Falha ao gravar {len(lote)} spans")
+                self.metricas.incrementar("rastreamento_spans_descartados", len(lote))
+                return 0
+            self.metricas.incrementar("rastreamento_spans_exportados", len(lote))
+            return len(lote)
+
+    # Ciclo de vida
+
+    def iniciar(self) -> None:
+        """Inicia a thread de gravação (idempotente; nada a fazer se desligado)."""
+        if not self.ativo:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._executar_laco, name="rastreamento", daemon=True)
+            self._thread.start()
+
+    def parar(self, timeout: Optional[float] = None) -> None:
+        """Encerra a thread e grava o que estiver pendente."""
+        self._parar.set()
+        self._acordar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+        if self.ativo:
+            self.gravar()
+
+    def _executar_laco(self) -> None:
+        while not self._parar.is_set():
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            try:
+                self.gravar()
+            except Exception:
+                logger.exception("Erro inesperado na gravação dos spans")
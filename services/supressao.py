@@ -0,0 +1,341 @@
+# services/supressao.py
+"""
+Lista de supressão: endereços que não devem mais receber emails (bounces,
+descadastros, reclamações).
+
+Os endereços são guardados apenas como hash de 64 bits em um único arquivo
+mapeado em memória (mmap), compartilhado entre os workers do Gunicorn:
+
+    cabeçalho | filtro de Bloom | tabela hash (endereçamento aberto, uint64)
+
+A consulta passa primeiro pelo filtro de Bloom, que descarta a grande maioria
+dos endereços não suprimidos sem tocar na tabela; só os positivos sondam a
+tabela hash. As duas etapas têm custo constante, independente de quantos
+milhões de endereços estejam suprimidos, e nenhuma faz chamada de sistema.
+
+Escritas são feitas no próprio arquivo, sob trava exclusiva (flock). Quando a
+tabela enche, um arquivo novo com o dobro da capacidade substitui o antigo
+(os.replace) e o antigo é marcado como substituído, o que faz os demais
+processos reabrirem o arquivo na próxima consulta. O mapa antigo não é fechado
+na troca: consultas que já o usavam terminam nele e ele é liberado com a
+última referência.
+"""
+import argparse
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional, Tuple
+
+MAGICO = b"FSUP0001"
+# magico, capacidade, ocupados, removidos, bits do filtro, funções do filtro, substituído
+CABECALHO = struct.Struct("<8sQQQQII")
+TAMANHO_CABECALHO = 64
+
+VAZIO = 0
+REMOVIDO = 1
+FUNCOES_BLOOM = 4
+BITS_BLOOM_POR_POSICAO = 8  # ~16 bits por endereço com a tabela a meia carga
+CARGA_MAXIMA = 0.5
+CAPACIDADE_MINIMA = 1024
+INTERVALO_AUSENCIA = 1.0  # segundos entre verificações de um arquivo ainda inexistente
+
+_ENTRADA = struct.Struct("<Q")
+
+
+def normalizar(endereco: str) -> str:
+    """Forma canônica do endereço usada no hash."""
+    return endereco.strip().lower()
+
+
+def hash_endereco(endereco: str) -> int:
+    """Hash de 64 bits do endereço normalizado (0 e 1 são reservados na tabela)."""
+    valor = int.from_bytes(
+        hashlib.blake2b(normalizar(endereco).encode("utf-8"), digest_size=8).digest(), "little"
+    )
+    return valor if valor > REMOVIDO else valor + 2
+
+
+def _potencia_de_dois(n: int) -> int:
+    return 1 << max(0, n - 1).bit_length()
+
+
+def _capacidade_para(quantidade: int) -> int:
+    return max(CAPACIDADE_MINIMA, _potencia_de_dois(int(quantidade / CARGA_MAXIMA) + 1))
+
+
+def _posicoes_bloom(valor: int, bits: int) -> Iterator[int]:
+    # Hash duplo (Kirsch-Mitzenmacher) a partir das duas metades do hash
+    mascara = bits - 1
+    h1 = valor & 0xFFFFFFFF
+    h2 = (valor >> 32) | 1
+    for i in range(FUNCOES_BLOOM):
+        yield (h1 + i * h2) & mascara
+
+
+def _criar_arquivo(caminho: str, valores: Iterable[int], capacidade: int) -> int:
+    """Grava um índice novo com `valores` em `caminho`. Retorna quantos foram gravados."""
+    bits = capacidade * BITS_BLOOM_POR_POSICAO
+    bloom = bytearray(bits // 8)
+    tabela = array("Q", bytes(capacidade * 8))
+    mascara = capacidade - 1
+    ocupados = 0
+    for valor in valores:
+        posicao = valor & mascara
+        while tabela[posicao] != VAZIO:
+            if tabela[posicao] == valor:
+                break
+            posicao = (posicao + 1) & mascara
+        else:
+            tabela[posicao] = valor
+            ocupados += 1
+            for bit in _posicoes_bloom(valor, bits):
+                bloom[bit >> 3] |= 1 << (bit & 7)
+    if sys.byteorder != "little":
+        tabela.byteswap()
+    with open(caminho, "wb") as arquivo:
+        cabecalho = CABECALHO.pack(MAGICO, capacidade, ocupados, 0, bits, FUNCOES_BLOOM, 0)
+        arquivo.write(cabecalho.ljust(TAMANHO_CABECALHO, b"\0"))
+        arquivo.write(bloom)
+        arquivo.write(tabela.tobytes())
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+    return ocupados
+
+
+class _Indice:
+    """Visão de um arquivo de índice mapeado em memória."""
+
+    def __init__(self, caminho: str, gravavel: bool = False):
+        # O mmap duplica o descritor; o arquivo pode ser fechado logo em seguida
+        with open(caminho, "r+b" if gravavel else "rb") as arquivo:
+            self.mapa = mmap.mmap(arquivo.fileno(), 0,
+                                  access=mmap.ACCESS_WRITE if gravavel else mmap.ACCESS_READ)
+        magico, self.capacidade, _, _, self.bits, self.funcoes, _ = CABECALHO.unpack_from(self.mapa, 0)
+        if magico != MAGICO:
+            raise ValueError(f"Arquivo de supressão inválido: {caminho}")
+        self.mascara = self.capacidade - 1
+        self.inicio_tabela = TAMANHO_CABECALHO + self.bits // 8
+
+    # Campos mutáveis do cabeçalho, lidos sempre do mapa
+    @property
+    def ocupados(self) -> int:
+        return struct.unpack_from("<Q", self.mapa, 16)[0]
+
+    @property
+    def removidos(self) -> int:
+        return struct.unpack_from("<Q", self.mapa, 24)[0]
+
+    @property
+    def substituido(self) -> bool:
+        return struct.unpack_from("<I", self.mapa, 44)[0] != 0
+
+    def _definir_contadores(self, ocupados: int, removidos: int) -> None:
+        struct.pack_into("<QQ", self.mapa, 16, ocupados, removidos)
+
+    def marcar_substituido(self) -> None:
+        struct.pack_into("<I", self.mapa, 44, 1)
+        self.mapa.flush()
+
+    def _no_bloom(self, valor: int) -> bool:
+        mapa = self.mapa
+        for bit in _posicoes_bloom(valor, self.bits):
+            if not mapa[TAMANHO_CABECALHO + (bit >> 3)] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def _sondar(self, valor: int) -> Tuple[Optional[int], Optional[int]]:
+        """Retorna (posição do valor, primeira posição livre para inserção)."""
+        posicao = valor & self.mascara
+        livre = None
+        for _ in range(self.capacidade):
+            atual = _ENTRADA.unpack_from(self.mapa, self.inicio_tabela + posicao * 8)[0]
+            if atual == VAZIO:
+                return None, posicao if livre is None else livre
+            if atual == valor:
+                return posicao, None
+            if atual == REMOVIDO and livre is None:
+                livre = posicao
+            posicao = (posicao + 1) & self.mascara
+        return None, livre
+
+    def contem(self, valor: int) -> bool:
+        return self._no_bloom(valor) and self._sondar(valor)[0] is not None
+
+    def inserir(self, valor: int) -> bool:
+        posicao, livre = self._sondar(valor)
+        if posicao is not None:
+            return False
+        reaproveitada = _ENTRADA.unpack_from(self.mapa, self.inicio_tabela + livre * 8)[0] == REMOVIDO
+        # A entrada é gravada antes dos bits do filtro: quem vê o filtro marcado acha a entrada
+        _ENTRADA.pack_into(self.mapa, self.inicio_tabela + livre * 8, valor)
+        for bit in _posicoes_bloom(valor, self.bits):
+            self.mapa[TAMANHO_CABECALHO + (bit >> 3)] |= 1 << (bit & 7)
+        self._definir_contadores(self.ocupados + 1, self.removidos - reaproveitada)
+        return True
+
+    def remover(self, valor: int) -> bool:
+        # Os bits do filtro ficam: um falso positivo a mais só custa uma sondagem
+        posicao, _ = self._sondar(valor)
+        if posicao is None:
+            return False
+        _ENTRADA.pack_into(self.mapa, self.inicio_tabela + posicao * 8, REMOVIDO)
+        self._definir_contadores(self.ocupados - 1, self.removidos + 1)
+        return True
+
+    def valores(self) -> Iterator[int]:
+        tabela = array("Q")
+        tabela.frombytes(self.mapa[self.inicio_tabela:self.inicio_tabela + self.capacidade * 8])
+        if sys.byteorder != "little":
+            tabela.byteswap()
+        return (valor for valor in tabela if valor > REMOVIDO)
+
+    def fechar(self) -> None:
+        self.mapa.close()
+
+
+class ListaSupressao:
+    """
+    Lista de supressão compartilhada entre processos.
+
+    Args:
+        caminho: Arquivo do índice (criado na primeira escrita)
+        intervalo_ausencia: Segundos até verificar de novo um arquivo inexistente
+    """
+
+    def __init__(self, caminho: str, intervalo_ausencia: float = INTERVALO_AUSENCIA):
+        self.caminho = caminho
+        self.intervalo_ausencia = intervalo_ausencia
+        self._leitura: Optional[_Indice] = None
+        self._ausente_ate = 0.0
+        self._lock = threading.Lock()
+
+    def _indice_leitura(self) -> Optional[_Indice]:
+        # Abertura preguiçosa; reabre quando outro processo substituiu o arquivo
+        indice = self._leitura
+        if indice is not None and not indice.substituido:
+            return indice
+        if indice is None and time.monotonic() < self._ausente_ate:
+            return None
+        with self._lock:
+            indice = self._leitura
+            if indice is not None and not indice.substituido:
+                return indice  # Outra thread já reabriu
+            # O índice antigo não é fechado: quem ainda o consulta termina nele
+            if not os.path.exists(self.caminho):
+                self._leitura = None
+                self._ausente_ate = time.monotonic() + self.intervalo_ausencia
+                return None
+            self._leitura = _Indice(self.caminho)
+            return self._leitura
+
+    @contextmanager
+    def _escrita(self) -> Iterator[_Indice]:
+        diretorio = os.path.dirname(self.caminho)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        with open(self.caminho + ".lock", "a") as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            try:
+                if not os.path.exists(self.caminho):
+                    _criar_arquivo(self.caminho, (), CAPACIDADE_MINIMA)
+                indice = _Indice(self.caminho, gravavel=True)
+                try:
+                    yield indice
+                    indice.mapa.flush()
+                finally:
+                    indice.fechar()
+                    self._ausente_ate = 0.0
+            finally:
+                fcntl.flock(trava, fcntl.LOCK_UN)
+
+    def _reconstruir(self, indice: _Indice, novos: Iterable[int], quantidade: int) -> int:
+        # Chamado com a trava de escrita: grava um arquivo maior e troca o atual
+        temporario = self.caminho + ".novo"
+        capacidade = _capacidade_para(indice.ocupados + quantidade)
+
+        def todos():
+            yield from indice.valores()
+            yield from novos
+
+        anteriores = indice.ocupados
+        ocupados = _criar_arquivo(temporario, todos(), capacidade)
+        os.replace(temporario, self.caminho)
+        indice.marcar_substituido()
+        return ocupados - anteriores
+
+    def contem(self, endereco: str) -> bool:
+        indice = self._indice_leitura()
+        return indice is not None and indice.contem(hash_endereco(endereco))
+
+    def adicionar(self, endereco: str) -> bool:
+        """Suprime um endereço. Retorna False se ele já estava suprimido."""
+        return self.importar([endereco]) == 1
+
+    def remover(self, endereco: str) -> bool:
+        """Remove um endereço da lista. Retorna False se ele não estava suprimido."""
+        with self._escrita() as indice:
+            return indice.remover(hash_endereco(endereco))
+
+    def importar(self, enderecos: Iterable[str]) -> int:
+        """Suprime vários endereços de uma vez. Retorna quantos eram novos."""
+        valores = {hash_endereco(endereco) for endereco in enderecos if endereco.strip()}
+        if not valores:
+            return 0
+        with self._escrita() as indice:
+            limite = int(indice.capacidade * CARGA_MAXIMA)
+            if indice.ocupados + indice.removidos + len(valores) > limite:
+                return self._reconstruir(indice, valores, len(valores))
+            return sum(indice.inserir(valor) for valor in valores)
+
+    def __len__(self) -> int:
+        indice = self._indice_leitura()
+        return 0 if indice is None else indice.ocupados
+
+
+def _ler_enderecos(arquivo) -> Iterator[str]:
+    # Um endereço por linha; aceita CSV com o endereço na primeira coluna
+    for linha in arquivo:
+        endereco = linha.split(",", 1)[0].strip()
+        if endereco and "@" in endereco:
+            yield endereco
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Gerenciamento da lista de supressão")
+    parser.add_argument("--arquivo", default=os.getenv("SUPRESSAO_ARQUIVO", "data/supressao.idx"),
+                        help="Arquivo do índice de supressão")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    importar = subcomandos.add_parser("importar", help="Importa endereços (um por linha) de um arquivo")
+    importar.add_argument("entrada", help="Arquivo texto ou CSV; use - para a entrada padrão")
+    remover = subcomandos.add_parser("remover", help="Remove um endereço da lista")
+    remover.add_argument("endereco")
+    consultar = subcomandos.add_parser("consultar", help="Informa se um endereço está suprimido")
+    consultar.add_argument("endereco")
+    args = parser.parse_args(argv)
+
+    lista = ListaSupressao(args.arquivo)
+    if args.comando == "importar":
+        if args.entrada == "-":
+            novos = lista.importar(_ler_enderecos(sys.stdin))
+        else:
+            with open(args.entrada, encoding="utf-8") as entrada:
+                novos = lista.importar(_ler_enderecos(entrada))
+        print(f"{novos} endereços adicionados ({len(lista)} suprimidos no total)")
+    elif args.comando == "remover":
+        print("Removido" if lista.remover(args.endereco) else "Endereço não estava suprimido")
+    else:
+        suprimido = lista.contem(args.endereco)
+        print("Suprimido" if suprimido else "Não suprimido")
+        return 0 if suprimido else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
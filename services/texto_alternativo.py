@@ -0,0 +1,161 @@
+# services/texto_alternativo.py
+"""
+Versão em texto puro do corpo HTML, enviada como parte text/plain de um
+multipart/alternative.
+
+A conversão percorre o HTML uma única vez (html.parser, sem montar árvore),
+emitindo o texto à medida que as tags aparecem. O resultado fica em um cache
+LRU indexado pelo hash do corpo: um envio em massa ou um template repetido
+paga a conversão uma única vez, e o cache não guarda os corpos HTML.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import List, Optional
+
+from services.metricas import METRICAS, Metricas
+
+# Tags cujo conteúdo não é texto legível
+_IGNORADAS = frozenset({"script", "style", "head", "title", "template", "noscript"})
+# Tags de bloco: separam o texto por linhas
+_BLOCOS = frozenset({
+    "p", "div", "section", "article", "header", "footer", "main", "aside", "nav",
+    "table", "tr", "ul", "ol", "dl", "blockquote", "pre", "form", "fieldset",
+    "h1", "h2", "h3", "h4", "h5", "h6", "address", "figure", "figcaption",
+})
+_ESPACOS = re.compile(r"[ \t\r\n\f\v]+")
+_LINHAS_EM_BRANCO = re.compile(r"\n{3,}")
+_PRE = "\0"
+
+
+class _ConversorTexto(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.partes: List[str] = []
+        self._ignorando = 0
+        self._pre = 0
+        self._links: List[Optional[str]] = []
+
+    def _quebra(self, quantidade: int = 1) -> None:
+        self.partes.append("\n" * quantidade)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _IGNORADAS:
+            self._ignorando += 1
+        elif self._ignorando:
+            return
+        elif tag == "br":
+            self._quebra()
+        elif tag == "hr":
+            self.partes.append("\n\n" + "-" * 40 + "\n\n")
+        elif tag == "li":
+            self.partes.append("\n- ")
+        elif tag in ("td", "th"):
+            self.partes.append("\t")
+        elif tag == "img":
+            alt = dict(attrs).get("alt")
+            if alt:
+                self.partes.append(f"[{alt}]")
+        elif tag == "a":
+            self._links.append(dict(attrs).get("href"))
+        elif tag in _BLOCOS:
+            if tag == "pre":
+                self._pre += 1
+            self._quebra(2)
+
+    def handle_startendtag(self, tag, attrs):
+        # Sem conteúdo: <a/> não abre link e <script/> não abre trecho ignorado
+        if tag == "a" or tag in _IGNORADAS:
+            return
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in _IGNORADAS:
+            self._ignorando = max(0, self._ignorando - 1)
+        elif self._ignorando:
+            return
+        elif tag == "a" and self._links:
+            href = self._links.pop()
+            # Links mostram o endereço, exceto âncoras e quando o texto já é o endereço
+            if href and not href.startswith(("#", "javascript:")) and \
+                    not (self.partes and self.partes[-1].strip() == href):
+                self.partes.append(f" ({href})")
+        elif tag in _BLOCOS:
+            if tag == "pre":
+                self._pre = max(0, self._pre - 1)
+            self._quebra(2)
+
+    def handle_data(self, data):
+        if self._ignorando:
+            return
+        data = data.replace(_PRE, "")
+        if self._pre:
+            # Texto pré-formatado mantém espaços e quebras (delimitado por _PRE)
+            self.partes.append(_PRE + data + _PRE)
+        else:
+            self.partes.append(_ESPACOS.sub(" ", data))
+
+
+def html_para_texto(html: str) -> str:
+    """Converte HTML em texto puro legível, em uma única passagem."""
+    conversor = _ConversorTexto()
+    conversor.feed(html)
+    conversor.close()
+    # Trechos de índice ímpar vieram de <pre> e ficam como estão; nos demais,
+    # remove os espaços que sobraram nas bordas das linhas
+    trechos = "".join(conversor.partes).split(_PRE)
+    texto = "".join(
+        trecho if i % 2 else "\n".join(linha.strip(" ") for linha in trecho.split("\n"))
+        for i, trecho in enumerate(trechos)
+    )
+    return _LINHAS_EM_BRANCO.sub("\n\n", texto).strip() + "\n"
+
+
+class CacheTexto:
+    """
+    Cache LRU de conversões, indexado pelo hash do HTML.
+
+    Args:
+        maximo: Número máximo de textos guardados
+        metricas: Registro onde acertos e falhas do cache são contados
+    """
+
+    def __init__(self, maximo: int = 1024, metricas: Metricas = METRICAS):
+        self.maximo = maximo
+        self.metricas = metricas
+        self._textos: "OrderedDict[bytes, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def texto_para(self, html: str) -> str:
+        chave = hashlib.blake2b(html.encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            texto = self._textos.get(chave)
+            if texto is not None:
+                self._textos.move_to_end(chave)
+        if texto is not None:
+            self.metricas.incrementar("texto_alternativo_cache", rotulos={"resultado": "acerto"})
+            return texto
+
+        # Conversão fora da trava: duas threads com o mesmo corpo só repetem trabalho
+        texto = html_para_texto(html)
+        self.metricas.incrementar("texto_alternativo_cache", rotulos={"resultado": "falha"})
+        with self._lock:
+            self._textos[chave] = texto
+            self._textos.move_to_end(chave)
+            while len(self._textos) > self.maximo:
+                self._textos.popitem(last=False)
+        return texto
+
+    def __len__(self) -> int:
+        return len(self._textos)
+
+
+# Cache compartilhado do processo
+CACHE_TEXTO = CacheTexto()
+
+
+def texto_alternativo(html: str) -> str:
+    """Texto puro do corpo HTML, convertido uma única vez por corpo distinto."""
+    return CACHE_TEXTO.texto_para(html)
@@ -0,0 +1,566 @@
+# services/transportes.py
+"""
+Transportes de entrega usados por enviar_email.
+
+A montagem da mensagem (MIME, texto alternativo, DKIM, anexos) é a mesma em
+todos os casos; o transporte decide apenas para onde vão os bytes. A
+variável EMAIL_TRANSPORTE escolhe um deles:
+
+- smtp: smtplib, com as conexões autenticadas reutilizadas pelo PoolSMTP (padrão)
+- smtp_async: aiosmtplib em um único laço de eventos, em uma thread própria,
+  que mantém as conexões de todos os workers
+- arquivo: grava cada mensagem em um diretório maildir (tmp/ e depois new/),
+  em lotes, por uma thread gravadora
+- nulo: descarta a mensagem depois de serializá-la, com latência e taxa de
+  erro simuladas
+
+Os dois últimos não usam a rede nem a senha SMTP: com eles, a API inteira
+(validação, filas, agendador, histórico, webhooks) pode passar por um teste de
+carga com a configuração de produção sem enviar nenhum email.
+
+Falhas são sinalizadas com as exceções do smtplib, para que enviar_email as
+trate da mesma forma qualquer que seja o transporte.
+"""
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import os
+import queue
+import random
+import smtplib
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from email.message import Message
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.anexos import POLITICA_SMTP, Anexo, Segmento, transmitir_mensagem
+from services.metricas import METRICAS, Metricas
+from services.rastreamento import rastrear
+
+logger = logging.getLogger("transportes")
+
+TRANSPORTES = ("smtp", "smtp_async", "arquivo", "nulo")
+# Transportes que não conectam a um servidor e dispensam a senha SMTP
+TRANSPORTES_SEM_REDE = ("arquivo", "nulo")
+
+
+def conectar_smtp(config: Dict[str, Any]) -> smtplib.SMTP:
+    """Abre uma conexão SMTP autenticada (EHLO, STARTTLS opcional e login)."""
+    # Conectando ao servidor com timeout
+    servidor = smtplib.SMTP(config["smtp_server"], config["porta"], timeout=10)
+
+    # Verificar status da conexão
+    status_code, _ = servidor.ehlo()
+    if status_code != 250:
+        raise smtplib.SMTPConnectError(status_code, "Falha na conexão com o servidor SMTP")
+
+    # Ativar TLS se configurado
+    if config["use_tls"]:
+        servidor.starttls()
+        status_code, _ = servidor.ehlo()
+        if status_code != 250:
+            raise smtplib.SMTPException("Falha ao iniciar TLS")
+
+    # Login
+    servidor.login(config["remetente"], config["senha"])
+    return servidor
+
+class PoolSMTP:
+    """
+    Conexões SMTP autenticadas reutilizáveis entre envios.
+
+    Evita repetir conexão, STARTTLS e login a cada mensagem. Conexões ociosas
+    por mais de `ociosidade_maxima` segundos são encerradas em vez de reusadas.
+    """
+
+    def __init__(self, tamanho: int = 4, ociosidade_maxima: float = 60.0):
+        self.tamanho = tamanho
+        self.ociosidade_maxima = ociosidade_maxima
+        self._ociosas: List[Tuple[tuple, smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+        self._fechado = False
+
+    @staticmethod
+    def _chave(config: Dict[str, Any]) -> tuple:
+        return (config["smtp_server"], config["porta"], config["remetente"], config["use_tls"])
+
+    def obter(self, config: Dict[str, Any]) -> Tuple[smtplib.SMTP, bool]:
+        """Retorna (conexão, reutilizada)."""
+        chave = self._chave(config)
+        limite = time.monotonic() - self.ociosidade_maxima
+        expiradas = []
+        servidor = None
+        with self._lock:
+            for i in range(len(self._ociosas) - 1, -1, -1):
+                chave_ociosa, conexao, devolvida_em = self._ociosas[i]
+                if devolvida_em < limite:
+                    expiradas.append(self._ociosas.pop(i)[1])
+                elif servidor is None and chave_ociosa == chave:
+                    servidor = self._ociosas.pop(i)[1]
+        for conexao in expiradas:
+            self.descartar(conexao)
+        if servidor is not None:
+            return servidor, True
+        return conectar_smtp(config), False
+
+    def devolver(self, servidor: smtplib.SMTP, config: Dict[str, Any]) -> None:
+        with self._lock:
+            if not self._fechado and len(self._ociosas) < self.tamanho:
+                self._ociosas.append((self._chave(config), servidor, time.monotonic()))
+                return
+        self.descartar(servidor)
+
+    def descartar(self, servidor: smtplib.SMTP) -> None:
+        try:
+            servidor.quit()
+        except Exception:
+            try:
+                servidor.close()
+            except Exception:
+                pass
+
+    def fechar(self) -> None:
+        """
+        Encerra todas as conexões ociosas. Envios ainda em andamento terminam na
+        própria conexão, que é encerrada ao ser devolvida em vez de voltar ao pool.
+        """
+        with self._lock:
+            self._fechado = True
+            ociosas, self._ociosas = self._ociosas, []
+        for _, servidor, _ in ociosas:
+            self.descartar(servidor)
+
+    def __len__(self) -> int:
+        return len(self._ociosas)
+
+
+def escrever_mensagem(escrever: Callable[[Any], Any], mensagem: Message,
+                      segmentos: Optional[List[Segmento]] = None) -> None:
+    """Escreve a mensagem final (sem o ponto duplicado do SMTP) em blocos."""
+    if segmentos is None:
+        escrever(mensagem.as_bytes(policy=POLITICA_SMTP))
+        return
+    for segmento in segmentos:
+        if isinstance(segmento, Anexo):
+            segmento.transmitir(escrever)
+        else:
+            escrever(segmento)
+
+
+def serializar(mensagem: Message, segmentos: Optional[List[Segmento]] = None) -> bytes:
+    buffer = bytearray()
+    escrever_mensagem(buffer.extend, mensagem, segmentos)
+    return bytes(buffer)
+
+
+class Transporte(ABC):
+    """Entrega de uma mensagem já montada por enviar_email."""
+
+    nome = ""
+
+    @abstractmethod
+    def entregar(self, config: Dict[str, Any], destinatario: str, mensagem: Message,
+                 segmentos: Optional[List[Segmento]] = None,
+                 pool: Optional[PoolSMTP] = None) -> Dict[str, Any]:
+        """
+        Entrega a mensagem a um destinatário.
+
+        Args:
+            config: Configuração retornada por validar_configuracoes
+            destinatario: Endereço do envelope
+            mensagem: Mensagem MIME montada
+            segmentos: Mensagem final já serializada (com anexos ou DKIM), ou None
+            pool: Pool de conexões SMTP da aplicação (usado só pelo transporte smtp)
+
+        Returns:
+            Destinatários recusados, como no retorno do sendmail ({} se todos aceitos)
+        """
+
+    def fechar(self) -> None:
+        """Libera conexões e threads do transporte."""
+
+
+class TransporteSMTP(Transporte):
+    """Envio por smtplib, reutilizando as conexões do pool quando houver."""
+
+    nome = "smtp"
+
+    def entregar(self, config, destinatario, mensagem, segmentos=None, pool=None):
+        # Obter uma conexão autenticada
+        if pool is not None:
+            servidor, reutilizada = pool.obter(config)
+        else:
+            servidor, reutilizada = conectar_smtp(config), False
+
+        if segmentos is not None and any(isinstance(segmento, Anexo) for segmento in segmentos):
+            def transmitir(conexao):
+                return transmitir_mensagem(conexao, config["remetente"], destinatario, segmentos)
+        else:
+            texto = segmentos[0] if segmentos else mensagem.as_string()
+            def transmitir(conexao):
+                return conexao.sendmail(config["remetente"], destinatario, texto)
+        try:
+            try:
+                with rastrear("smtp.sendmail", {"smtp.tentativa": 1, "smtp.conexao_reutilizada": reutilizada}):
+                    status = transmitir(servidor)
+            except smtplib.SMTPServerDisconnected:
+                if not reutilizada:
+                    raise
+                # Conexão do pool encerrada pelo servidor enquanto ociosa: reconectar uma vez
+                pool.descartar(servidor)
+                servidor = None
+                with rastrear("smtp.sendmail", {"smtp.tentativa": 2, "smtp.conexao_reutilizada": False}):
+                    servidor = conectar_smtp(config)
+                    status = transmitir(servidor)
+
+            # Fechar conexão, ou devolvê-la ao pool
+            if pool is not None:
+                pool.devolver(servidor, config)
+            else:
+                servidor.quit()
+            servidor = None
+        finally:
+            # Uma conexão do pool que falhou no meio do envio não é reutilizada
+            if pool is not None and servidor is not None:
+                pool.descartar(servidor)
+        return status
+
+
+class TransporteSMTPAssincrono(Transporte):
+    """
+    Envio por aiosmtplib. Um único laço de eventos, em uma thread própria,
+    conduz as conversas SMTP de todos os workers; cada worker apenas espera o
+    resultado do seu envio. As conexões ficam abertas entre envios, como no
+    PoolSMTP, e só são manipuladas pela thread do laço.
+
+    Args:
+        tamanho: Conexões ociosas mantidas abertas
+        ociosidade_maxima: Segundos após os quais uma conexão ociosa é encerrada
+        timeout: Espera máxima por um envio completo
+    """
+
+    nome = "smtp_async"
+
+    def __init__(self, tamanho: int = 4, ociosidade_maxima: float = 60.0, timeout: float = 60.0):
+        # Importado só quando este transporte é escolhido
+        import aiosmtplib
+        self._aiosmtplib = aiosmtplib
+        self.tamanho = tamanho
+        self.ociosidade_maxima = ociosidade_maxima
+        self.timeout = timeout
+        self._ociosas: List[Tuple[tuple, Any, float]] = []
+        self._laco: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _laco_de_eventos(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._laco is None:
+                laco = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=laco.run_forever, name="smtp-async", daemon=True)
+                self._thread.start()
+                self._laco = laco
+            return self._laco
+
+    def entregar(self, config, destinatario, mensagem, segmentos=None, pool=None):
+        dados = serializar(mensagem, segmentos)
+        futuro = asyncio.run_coroutine_threadsafe(
+            self._enviar(config, destinatario, dados), self._laco_de_eventos()
+        )
+        try:
+            return futuro.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            futuro.cancel()
+            raise smtplib.SMTPServerDisconnected(f"Envio não concluído em {self.timeout:.0f}s")
+        except self._aiosmtplib.SMTPException as e:
+            raise self._converter_erro(e) from e
+
+    def _converter_erro(self, erro: Exception) -> smtplib.SMTPException:
+        # Exceções equivalentes do smtplib, tratadas por enviar_email
+        a = self._aiosmtplib
+        if isinstance(erro, a.SMTPRecipientsRefused):
+            return smtplib.SMTPRecipientsRefused(
+                {recusa.recipient: (recusa.code, recusa.message) for recusa in erro.recipients}
+            )
+        if isinstance(erro, a.SMTPRecipientRefused):
+            return smtplib.SMTPRecipientsRefused({erro.recipient: (erro.code, erro.message)})
+        if isinstance(erro, a.SMTPAuthenticationError):
+            return smtplib.SMTPAuthenticationError(erro.code, erro.message)
+        if isinstance(erro, a.SMTPConnectError):
+            return smtplib.SMTPConnectError(-1, str(erro))
+        if isinstance(erro, (a.SMTPServerDisconnected, a.SMTPTimeoutError)):
+            return smtplib.SMTPServerDisconnected(str(erro))
+        if isinstance(erro, a.SMTPResponseException):
+            return smtplib.SMTPResponseException(erro.code, erro.message)
+        return smtplib.SMTPException(str(erro))
+
+    async def _conectar(self, config: Dict[str, Any]):
+        cliente = self._aiosmtplib.SMTP(
+            hostname=config["smtp_server"], port=config["porta"], timeout=10,
+            start_tls=config["use_tls"]
+        )
+        await cliente.connect()
+        try:
+            await cliente.login(config["remetente"], config["senha"])
+        except BaseException:
+            cliente.close()
+            raise
+        return cliente
+
+    def _obter_ociosa(self, chave: tuple):
+        limite = time.monotonic() - self.ociosidade_maxima
+        encontrada = None
+        for i in range(len(self._ociosas) - 1, -1, -1):
+            chave_ociosa, cliente, devolvida_em = self._ociosas[i]
+            if devolvida_em < limite or not cliente.is_connected:
+                self._ociosas.pop(i)
+                cliente.close()
+            elif encontrada is None and chave_ociosa == chave:
+                encontrada = self._ociosas.pop(i)[1]
+        return encontrada
+
+    async def _enviar(self, config: Dict[str, Any], destinatario: str, dados: bytes) -> Dict[str, Any]:
+        chave = PoolSMTP._chave(config)
+        cliente = self._obter_ociosa(chave)
+        reutilizada = cliente is not None
+        if cliente is None:
+            cliente = await self._conectar(config)
+        try:
+            try:
+                recusados, _ = await cliente.sendmail(config["remetente"], [destinatario], dados)
+            except self._aiosmtplib.SMTPServerDisconnected:
+                if not reutilizada:
+                    raise
+                # Conexão encerrada pelo servidor enquanto ociosa: reconectar uma vez
+                cliente.close()
+                cliente = await self._conectar(config)
+                recusados, _ = await cliente.sendmail(config["remetente"], [destinatario], dados)
+        except BaseException:
+            cliente.close()
+            raise
+        if len(self._ociosas) < self.tamanho:
+            self._ociosas.append((chave, cliente, time.monotonic()))
+        else:
+            await self._descartar(cliente)
+        return {endereco: (resposta.code, resposta.message) for endereco, resposta in recusados.items()}
+
+    async def _descartar(self, cliente) -> None:
+        try:
+            await cliente.quit()
+        except Exception:
+            cliente.close()
+
+    async def _fechar_ociosas(self) -> None:
+        ociosas, self._ociosas = self._ociosas, []
+        for _, cliente, _ in ociosas:
+            await self._descartar(cliente)
+
+    def fechar(self) -> None:
+        """Encerra as conexões ociosas com QUIT e o laço de eventos."""
+        with self._lock:
+            laco, thread = self._laco, self._thread
+            self._laco = self._thread = None
+        if laco is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._fechar_ociosas(), laco).result(10)
+        except Exception:
+            logger.exception("Falha ao encerrar as conexões SMTP assíncronas")
+        laco.call_soon_threadsafe(laco.stop)
+        thread.join(10)
+        laco.close()
+
+
+class TransporteArquivo(Transporte):
+    """
+    Grava as mensagens em um diretório maildir, para inspeção ou testes de
+    carga sem rede. O envio termina quando a mensagem entra na fila; a thread
+    gravadora escreve os arquivos em lotes, primeiro em tmp/ e depois movidos
+    para new/, de modo que um leitor nunca vê uma mensagem pela metade.
+
+    Args:
+        diretorio: Diretório maildir (tmp/, new/ e cur/ são criados)
+        tamanho_lote: Mensagens gravadas por lote
+        capacidade: Mensagens aguardando gravação; além disso, o envio espera
+        timeout: Espera máxima por espaço na fila
+        metricas: Registro de métricas
+    """
+
+    nome = "arquivo"
+
+    def __init__(self, diretorio: str, tamanho_lote: int = 100, capacidade: int = 1000,
+                 timeout: float = 30.0, metricas: Metricas = METRICAS):
+        self.diretorio = diretorio
+        self.tamanho_lote = tamanho_lote
+        self.timeout = timeout
+        self.metricas = metricas
+        for subdiretorio in ("tmp", "new", "cur"):
+            os.makedirs(os.path.join(diretorio, subdiretorio), exist_ok=True)
+        self._fila: "queue.Queue[Tuple[str, Any]]" = queue.Queue(maxsize=capacidade)
+        self._sequencia = itertools.count(1)
+        self._host = socket.gethostname().replace("/", "_").replace(":", "_")
+        self._thread: Optional[threading.Thread] = None
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self._pendentes = 0
+        self._ocioso = threading.Condition(self._lock)
+
+    def iniciar(self) -> None:
+        """Inicia a thread gravadora (idempotente)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._executar_laco, name="transporte-arquivo", daemon=True)
+            self._thread.start()
+
+    def entregar(self, config, destinatario, mensagem, segmentos=None, pool=None):
+        # Sem segmentos, a mensagem é serializada aqui para não ficar retida na fila
+        conteudo = serializar(mensagem) if segmentos is None else segmentos
+        nome = f"{time.time_ns()}.P{os.getpid()}Q{next(self._sequencia)}.{self._host}"
+        if self._thread is None or not self._thread.is_alive():
+            self.iniciar()
+        with self._lock:
+            self._pendentes += 1
+        try:
+            self._fila.put((nome, conteudo), timeout=self.timeout)
+        except queue.Full:
+            self._concluir(1)
+            raise smtplib.SMTPServerDisconnected("Fila de gravação do transporte de arquivo cheia")
+        return {}
+
+    def aguardar(self, timeout: Optional[float] = None) -> bool:
+        """Espera até todas as mensagens entregues serem gravadas."""
+        with self._ocioso:
+            return self._ocioso.wait_for(lambda: self._pendentes == 0, timeout)
+
+    def fechar(self) -> None:
+        """Grava o que estiver na fila e encerra a thread."""
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _concluir(self, quantidade: int) -> None:
+        with self._ocioso:
+            self._pendentes -= quantidade
+            if self._pendentes == 0:
+                self._ocioso.notify_all()
+
+    def _executar_laco(self) -> None:
+        while True:
+            try:
+                lote = [self._fila.get(timeout=0.2)]
+            except queue.Empty:
+                if self._parar.is_set():
+                    return
+                continue
+            while len(lote) < self.tamanho_lote:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            self._gravar(lote)
+
+    def _gravar(self, lote: List[Tuple[str, Any]]) -> None:
+        inicio = time.monotonic()
+        gravadas = []
+        for nome, conteudo in lote:
+            temporario = os.path.join(self.diretorio, "tmp", nome)
+            try:
+                with open(temporario, "wb") as arquivo:
+                    if isinstance(conteudo, bytes):
+                        arquivo.write(conteudo)
+                    else:
+                        escrever_mensagem(arquivo.write, None, conteudo)
+                gravadas.append(nome)
+            except OSError:
+                logger.exception(f"Falha ao gravar a mensagem {nome}")
+                self.metricas.incrementar("transporte_mensagens_descartadas", rotulos={"transporte": self.nome})
+        for nome in gravadas:
+            os.replace(os.path.join(self.diretorio, "tmp", nome), os.path.join(self.diretorio, "new", nome))
+        self.metricas.incrementar("transporte_mensagens", len(gravadas), {"transporte": self.nome})
+        self.metricas.observar("transporte_arquivo_lote_segundos", time.monotonic() - inicio)
+        self._concluir(len(lote))
+
+
+class TransporteNulo(Transporte):
+    """
+    Serializa e descarta a mensagem. Simula um servidor com a latência média
+    `latencia` (segundos, variando entre metade e uma vez e meia) e uma fração
+    `taxa_erro` de falhas temporárias (451).
+    """
+
+    nome = "nulo"
+
+    def __init__(self, latencia: float = 0.0, taxa_erro: float = 0.0, semente: Optional[int] = None,
+                 metricas: Metricas = METRICAS):
+        if not 0 <= taxa_erro <= 1:
+            raise ValueError("A taxa de erro do transporte nulo deve estar entre 0 e 1")
+        self.latencia = latencia
+        self.taxa_erro = taxa_erro
+        self.metricas = metricas
+        self._aleatorio = random.Random(semente)
+
+    def entregar(self, config, destinatario, mensagem, segmentos=None, pool=None):
+        # A serialização é o custo de CPU real do envio; os bytes são apenas contados
+        tamanho = 0
+        def contar(bloco):
+            nonlocal tamanho
+            tamanho += len(bloco)
+        escrever_mensagem(contar, mensagem, segmentos)
+        if self.latencia > 0:
+            time.sleep(self.latencia * self._aleatorio.uniform(0.5, 1.5))
+        if self.taxa_erro and self._aleatorio.random() < self.taxa_erro:
+            raise smtplib.SMTPDataError(451, "Falha simulada pelo transporte nulo")
+        self.metricas.incrementar("transporte_mensagens", rotulos={"transporte": self.nome})
+        self.metricas.incrementar("transporte_bytes", tamanho, {"transporte": self.nome})
+        return {}
+
+
+def criar_transporte(nome: str, conexoes: Optional[int] = None) -> Transporte:
+    """
+    Cria o transporte `nome` com as opções das variáveis de ambiente.
+
+    `conexoes` dimensiona as conexões do smtp_async; o padrão é FILA_WORKERS.
+    """
+    if nome == "smtp":
+        return TransporteSMTP()
+    if nome == "smtp_async":
+        return TransporteSMTPAssincrono(tamanho=conexoes or int(os.getenv("FILA_WORKERS", "4")))
+    if nome == "arquivo":
+        return TransporteArquivo(os.getenv("EMAIL_TRANSPORTE_DIR", "data/maildir"))
+    if nome == "nulo":
+        return TransporteNulo(
+            latencia=float(os.getenv("EMAIL_TRANSPORTE_LATENCIA_MS", "0")) / 1000,
+            taxa_erro=float(os.getenv("EMAIL_TRANSPORTE_TAXA_ERRO", "0")),
+        )
+    raise ValueError(f"EMAIL_TRANSPORTE inválido: {nome} (use {', '.join(TRANSPORTES)})")
+
+
+_transportes: Dict[str, Transporte] = {}
+_lock_transportes = threading.Lock()
+
+def obter_transporte(nome: str, conexoes: Optional[int] = None) -> Transporte:
+    """Transporte compartilhado pelo processo, criado no primeiro uso (com `conexoes`)."""
+    transporte = _transportes.get(nome)
+    if transporte is None:
+        with _lock_transportes:
+            transporte = _transportes.get(nome)
+            if transporte is None:
+                transporte = _transportes[nome] = criar_transporte(nome, conexoes)
+    return transporte
+
+def fechar_transportes() -> None:
+    """Encerra os transportes criados (grava os lotes pendentes e fecha conexões)."""
+    with _lock_transportes:
+        transportes = list(_transportes.values())
+        _transportes.clear()
+    for transporte in transportes:
+        try:
+            transporte.fechar()
+        except Exception:
+            logger.exception(f"Falha ao encerrar o transporte {transporte.nome}")
@@ -0,0 +1,261 @@
+# services/webhooks.py
+"""
+Notificação do resultado dos envios (enviado, falhou, devolvido) por webhooks.
+
+`publicar` apenas coloca o evento em uma fila em memória (O(1), sem E/S), de
+modo que o laço de envio SMTP nunca espera por HTTP. Uma thread coletora
+agrupa os eventos por destino em lotes (até `tamanho_lote` eventos ou
+`intervalo` segundos) e entrega cada lote por um pequeno pool de threads,
+usando uma única requests.Session com conexões keep-alive reaproveitadas.
+Falhas temporárias (erro de conexão, 429 e 5xx) são repetidas com backoff
+exponencial e jitter; as demais descartam o lote.
+
+Quando a chave tem um segredo, o corpo é assinado com HMAC-SHA256 no
+cabeçalho X-Webhook-Assinatura ("sha256=<hex>").
+"""
+import hashlib
+import hmac
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services import json_codec
+from services.metricas import METRICAS, Metricas
+
+logger = logging.getLogger("webhooks")
+
+ENVIADO = "enviado"
+FALHOU = "falhou"
+DEVOLVIDO = "devolvido"
+
+# (url, segredo) do webhook de uma chave de API, ou None se ela não tiver
+Destino = Optional[Tuple[str, Optional[str]]]
+
+
+def tipo_do_resultado(resultado: Dict[str, Any]) -> str:
+    """Tipo de evento correspondente ao resultado de enviar_email."""
+    if resultado.get("sucesso"):
+        return ENVIADO
+    return DEVOLVIDO if resultado.get("devolvido") else FALHOU
+
+
+def assinar(corpo: bytes, segredo: str) -> str:
+    return "sha256=" + hmac.new(segredo.encode("utf-8"), corpo, hashlib.sha256).hexdigest()
+
+
+class NotificadorWebhooks:
+    """
+    Entrega de eventos em lotes para os webhooks das chaves de API.
+
+    Args:
+        resolver: Função que retorna o destino (url, segredo) de uma chave
+        tamanho_lote: Máximo de eventos por requisição
+        intervalo: Segundos máximos que um evento espera para formar um lote
+        tentativas: Tentativas de entrega de cada lote
+        espera_base: Espera antes da segunda tentativa (dobra a cada falha)
+        espera_maxima: Limite da espera entre tentativas
+        timeout: Timeout de cada requisição HTTP
+        capacidade: Eventos aguardando na fila; além disso, novos são descartados
+        workers: Lotes entregues em paralelo
+        metricas: Registro de métricas
+    """
+
+    def __init__(self, resolver: Callable[[str], Destino], tamanho_lote: int = 100,
+                 intervalo: float = 1.0, tentativas: int = 5, espera_base: float = 0.5,
+                 espera_maxima: float = 30.0, timeout: float = 5.0, capacidade: int = 10000,
+                 workers: int = 2, metricas: Metricas = METRICAS):
+        self.resolver = resolver
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.tentativas = tentativas
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.timeout = timeout
+        self.workers = workers
+        self.metricas = metricas
+        self._fila: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue(maxsize=capacidade)
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._sessao = None
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self._pendentes = 0
+        self._ocioso = threading.Condition(self._lock)
+
+    def iniciar(self) -> None:
+        """Inicia a thread coletora (idempotente)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._parar.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="webhook")
+            self._thread = threading.Thread(target=self._executar_laco, name="webhooks", daemon=True)
+            self._thread.start()
+
+    def parar(self, timeout: Optional[float] = None) -> None:
+        """
+        Entrega o que estiver na fila e encerra as threads.
+
+        Com `timeout`, espera no máximo esse tempo: lotes que ainda não começaram
+        a ser entregues são cancelados e contados como descartados.
+        """
+        self._parar.set()
+        limite = None if timeout is None else time.monotonic() + timeout
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._executor is not None:
+            restante = None if limite is None else max(0.0, limite - time.monotonic())
+            if self.aguardar(restante):
+                self._executor.shutdown(wait=True)
+            else:
+                logger.warning(f"Prazo de encerramento esgotado com {self._pendentes} eventos de webhook pendentes")
+                self._executor.shutdown(wait=False, cancel_futures=True)
+        self._thread = None
+        self._executor = None
+
+    def publicar(self, chave: Optional[str], evento: Dict[str, Any]) -> bool:
+        """Enfileira um evento sem bloquear. Retorna False se a fila estiver cheia."""
+        if not chave:
+            return False
+        evento.setdefault("timestamp", time.time())
+        with self._lock:
+            try:
+                self._fila.put_nowait((chave, evento))
+            except queue.Full:
+                self.metricas.incrementar("webhook_eventos_descartados", rotulos={"motivo": "fila_cheia"})
+                return False
+            self._pendentes += 1
+        if self._thread is None or not self._thread.is_alive():
+            self.iniciar()
+        return True
+
+    def aguardar(self, timeout: Optional[float] = None) -> bool:
+        """Espera até todos os eventos publicados serem entregues ou descartados."""
+        with self._ocioso:
+            return self._ocioso.wait_for(lambda: self._pendentes == 0, timeout)
+
+    def _concluir(self, quantidade: int) -> None:
+        with self._ocioso:
+            self._pendentes -= quantidade
+            if self._pendentes == 0:
+                self._ocioso.notify_all()
+
+    def _descartar_no_encerramento(self, quantidade: int) -> None:
+        self.metricas.incrementar("webhook_eventos_descartados", quantidade, {"motivo": "encerramento"})
+        self._concluir(quantidade)
+
+    # Coleta e agrupamento
+
+    def _executar_laco(self) -> None:
+        while True:
+            lotes = self._coletar()
+            for chave, eventos in lotes.items():
+                self._despachar(chave, eventos)
+            if self._parar.is_set() and self._fila.empty():
+                return
+
+    def _coletar(self) -> Dict[str, List[Dict[str, Any]]]:
+        # Espera o primeiro evento e reúne os que chegarem até o fim da janela
+        lotes: Dict[str, List[Dict[str, Any]]] = {}
+        try:
+            chave, evento = self._fila.get(timeout=0.2)
+        except queue.Empty:
+            return lotes
+        lotes.setdefault(chave, []).append(evento)
+        limite = time.monotonic() + self.intervalo
+        total = 1
+        while total < self.tamanho_lote:
+            # Ao encerrar, fecha o lote com o que já estiver na fila, sem esperar a janela
+            restante = 0 if self._parar.is_set() else limite - time.monotonic()
+            try:
+                if restante > 0:
+                    chave, evento = self._fila.get(timeout=min(restante, 0.2))
+                else:
+                    chave, evento = self._fila.get_nowait()
+            except queue.Empty:
+                if restante > 0:
+                    continue
+                break
+            lotes.setdefault(chave, []).append(evento)
+            total += 1
+        return lotes
+
+    def _despachar(self, chave: str, eventos: List[Dict[str, Any]]) -> None:
+        try:
+            destino = self.resolver(chave)
+        except Exception:
+            logger.exception(f"Falha ao resolver o webhook da chave {chave}")
+            destino = None
+        if not destino or not destino[0]:
+            # Chave sem webhook: nada a entregar
+            self._concluir(len(eventos))
+            return
+        executor = self._executor
+        for inicio in range(0, len(eventos), self.tamanho_lote):
+            lote = eventos[inicio:inicio + self.tamanho_lote]
+            try:
+                if executor is None:
+                    raise RuntimeError("executor encerrado")
+                futuro = executor.submit(self._entregar, destino, lote)
+            except RuntimeError:
+                # Executor já encerrado por parar() com o prazo esgotado
+                self._descartar_no_encerramento(len(lote))
+                continue
+            futuro.add_done_callback(
+                lambda f, n=len(lote): f.cancelled() and self._descartar_no_encerramento(n))
+
+    # Entrega
+
+    def _sessao_http(self):
+        # requests é importado e a sessão criada só no primeiro lote
+        if self._sessao is None:
+            with self._lock:
+                if self._sessao is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    sessao = requests.Session()
+                    adaptador = HTTPAdapter(pool_connections=8, pool_maxsize=self.workers)
+                    sessao.mount("http://", adaptador)
+                    sessao.mount("https://", adaptador)
+                    self._sessao = sessao
+        return self._sessao
+
+    def _espera(self, tentativa: int) -> float:
+        espera = min(self.espera_maxima, self.espera_base * (2 ** tentativa))
+        return espera * random.uniform(0.5, 1.0)
+
+    def _entregar(self, destino: Tuple[str, Optional[str]], lote: List[Dict[str, Any]]) -> None:
+        url, segredo = destino
+        corpo = json_codec.dumps({"eventos": lote})
+        cabecalhos = {"Content-Type": "application/json"}
+        if segredo:
+            cabecalhos["X-Webhook-Assinatura"] = assinar(corpo, segredo)
+        try:
+            for tentativa in range(self.tentativas):
+                inicio = time.monotonic()
+                try:
+                    resposta = self._sessao_http().post(url, data=corpo, headers=cabecalhos,
+                                                        timeout=self.timeout)
+                    status = resposta.status_code
+                    resposta.close()
+                except Exception as e:
+                    status = None
+                    logger.warning(f"Falha ao entregar webhook para {url}: {e}")
+                self.metricas.observar("webhook_entrega_segundos", time.monotonic() - inicio)
+                if status is not None and status < 300:
+                    self.metricas.incrementar("webhook_eventos_entregues", len(lote))
+                    return
+                if status is not None and status < 500 and status != 429:
+                    logger.error(f"Webhook {url} recusou o lote com status {status}; descartando")
+                    break
+                if tentativa + 1 < self.tentativas:
+                    # Ao encerrar, a espera é interrompida e as tentativas seguem sem pausa
+                    self._parar.wait(self._espera(tentativa))
+            self.metricas.incrementar("webhook_eventos_descartados", len(lote), {"motivo": "entrega"})
+            logger.error(f"{len(lote)} eventos de webhook para {url} descartados")
+        finally:
+            self._concluir(len(lote))
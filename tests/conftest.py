@@ -116,4 +116,76 @@ def email_validator_mock():
             return False  # Retorne False em vez de lançar uma exceção
         
         mock.side_effect = side_effect
-        yield mock
\ No newline at end of file
+        yield mock
+
+@pytest.fixture
+def agendador_temporario(tmp_path, monkeypatch):
+    """Fixture que substitui o agendador da aplicação por um com banco temporário."""
+    import app as app_module
+    from services.agendador import Agendador
+
+    agendador = Agendador(str(tmp_path / "agendamentos.db"), enviar=app_module._enviar_agendado)
+    monkeypatch.setattr(app_module, "AGENDADOR", agendador)
+    yield agendador
+    agendador.parar(timeout=1)
+
+
+@pytest.fixture
+def supressao_temporaria(tmp_path, monkeypatch):
+    """Fixture que substitui a lista de supressão da aplicação por uma temporária."""
+    import app as app_module
+    from services.supressao import ListaSupressao
+
+    lista = ListaSupressao(str(tmp_path / "supressao.idx"))
+    monkeypatch.setattr(app_module, "LISTA_SUPRESSAO", lista)
+    yield lista
+
+
+@pytest.fixture(autouse=True)
+def pool_smtp_limpo(monkeypatch):
+    """Dá a cada teste um pool SMTP próprio, fechado ao fim do teste.
+
+    Sem isso, uma conexão simulada de um teste seria reutilizada no seguinte.
+    """
+    import app as app_module
+    from services.email_service import PoolSMTP
+    pool = PoolSMTP(tamanho=app_module.POOL_SMTP.tamanho)
+    monkeypatch.setattr(app_module, "POOL_SMTP", pool)
+    yield pool
+    pool.fechar()
+
+
+@pytest.fixture(autouse=True)
+def historico_temporario(tmp_path, monkeypatch):
+    """Fixture que substitui o histórico de mensagens por um com banco temporário."""
+    import app as app_module
+    from services.mensagens import RegistroMensagens
+
+    historico = RegistroMensagens(str(tmp_path / "mensagens.db"), intervalo=0.05)
+    monkeypatch.setattr(app_module, "HISTORICO_MENSAGENS", historico)
+    yield historico
+    historico.parar(timeout=1)
+
+
+@pytest.fixture
+def metricas():
+    """Registro de métricas próprio do teste, separado do global da aplicação."""
+    from services.metricas import Metricas
+    return Metricas()
+
+
+@pytest.fixture
+def contador(metricas):
+    """Soma do contador `nome` em `metricas`, filtrada pelos rótulos informados."""
+    def valor(nome, **rotulos):
+        return sum(c["valor"] for c in metricas.instantaneo()["contadores"]
+                   if c["nome"] == nome and rotulos.items() <= c["rotulos"].items())
+    return valor
+
+
+@pytest.fixture
+def medidor(metricas):
+    """Valor atual do medidor `nome` em `metricas`."""
+    def valor(nome):
+        return next(m["valor"] for m in metricas.instantaneo()["medidores"] if m["nome"] == nome)
+    return valor
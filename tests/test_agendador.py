@@ -0,0 +1,130 @@
+import threading
+import time
+import pytest
+from services.agendador import Agendador, PENDENTE, CANCELADO
+
+@pytest.fixture
+def enviados():
+    return []
+
+@pytest.fixture
+def agendador(tmp_path, enviados):
+    """Fixture que cria um agendador com banco temporário e envio fictício."""
+    agendador = Agendador(str(tmp_path / "agendamentos.db"), enviar=enviados.append, taxa_maxima=1000)
+    yield agendador
+    agendador.parar(timeout=1)
+
+def test_envia_apenas_vencidos(agendador, enviados):
+    """Testa que só os agendamentos vencidos são despachados, em ordem."""
+    agora = time.time()
+    agendador.agendar(agora + 20, {"destinatario": "b@example.com"})
+    agendador.agendar(agora + 10, {"destinatario": "a@example.com"})
+    agendador.agendar(agora + 3600, {"destinatario": "c@example.com"})
+
+    assert agendador.executar_vencidos(agora) == 0
+    assert agendador.executar_vencidos(agora + 30) == 2
+    assert [d["destinatario"] for d in enviados] == ["a@example.com", "b@example.com"]
+    assert agendador.pendentes() == 1
+
+def test_cancelar(agendador, enviados):
+    """Testa o cancelamento por ID, restrito à chave que agendou."""
+    agora = time.time()
+    id = agendador.agendar(agora + 10, {"destinatario": "a@example.com"}, chave="fsk_1")
+
+    assert agendador.cancelar(id, chave="fsk_2") is False
+    assert agendador.cancelar(id, chave="fsk_1") is True
+    assert agendador.cancelar(id, chave="fsk_1") is False
+    assert agendador.consultar(id)["status"] == CANCELADO
+    assert agendador.executar_vencidos(agora + 30) == 0
+    assert enviados == []
+
+def test_cancelar_fora_do_heap_nao_acumula(tmp_path, enviados):
+    """Testa que cancelar agendamentos que este worker não carregou não deixa rastro em memória."""
+    caminho = str(tmp_path / "agendamentos.db")
+    agora = time.time()
+    outro = Agendador(caminho, enviar=enviados.append)
+    distante = outro.agendar(agora + 3600, {"destinatario": "a@example.com"})
+    proximo = outro.agendar(agora + 10, {"destinatario": "b@example.com"})
+
+    worker = Agendador(caminho, enviar=enviados.append)
+    assert worker.cancelar(distante) is True
+    assert worker.cancelar(proximo) is True
+    assert worker._cancelados == set()
+    # O worker que tinha o agendamento no heap não o envia
+    assert outro.executar_vencidos(agora + 30) == 0
+    assert enviados == []
+
+def test_sobrevive_a_reinicio(tmp_path, enviados):
+    """Testa que agendamentos persistidos são enviados após reiniciar."""
+    caminho = str(tmp_path / "agendamentos.db")
+    agora = time.time()
+    id = Agendador(caminho, enviar=enviados.append).agendar(agora + 10, {"destinatario": "a@example.com"})
+
+    reiniciado = Agendador(caminho, enviar=enviados.append)
+
+    assert reiniciado.consultar(id)["status"] == PENDENTE
+    assert reiniciado.executar_vencidos(agora + 30) == 1
+    assert enviados[0]["id"] == id
+
+def test_sem_envio_duplicado_entre_workers(tmp_path):
+    """Testa que dois workers com o mesmo banco não enviam o mesmo agendamento."""
+    caminho = str(tmp_path / "agendamentos.db")
+    enviados = []
+    worker_a = Agendador(caminho, enviar=enviados.append)
+    worker_b = Agendador(caminho, enviar=enviados.append)
+    agora = time.time()
+    for i in range(20):
+        worker_a.agendar(agora + 1, {"destinatario": f"{i}@example.com"})
+
+    threads = [
+        threading.Thread(target=w.executar_vencidos, args=(agora + 5,))
+        for w in (worker_a, worker_b)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(d["id"] for d in enviados) == sorted(set(d["id"] for d in enviados))
+    assert len(enviados) == 20
+
+def test_thread_de_despacho(agendador, enviados):
+    """Testa que a thread de despacho envia no horário marcado."""
+    agendador.iniciar()
+    agendador.agendar(time.time() + 0.2, {"destinatario": "a@example.com"})
+
+    limite = time.time() + 5
+    while not enviados and time.time() < limite:
+        time.sleep(0.05)
+
+    assert len(enviados) == 1
+
+def test_falha_ao_liberar_durante_o_encerramento_mantem_pendente(tmp_path):
+    """Testa que um agendamento recusado pela fila em encerramento volta a ficar pendente."""
+    def enviar_recusado(dados):
+        raise RuntimeError("fila em encerramento")
+
+    agendador = Agendador(str(tmp_path / "agendamentos.db"), enviar=enviar_recusado)
+    agora = time.time()
+    id = agendador.agendar(agora + 1, {"destinatario": "a@example.com"})
+    agendador.parar(timeout=0)
+
+    assert agendador.executar_vencidos(agora + 5) == 0
+    assert agendador.consultar(id)["status"] == PENDENTE
+
+def test_devolver_substitui_reserva(agendador, enviados):
+    """Testa que mensagens devolvidas no encerramento voltam pendentes para envio imediato."""
+    agora = time.time()
+    id_agendado = agendador.agendar(agora + 10, {"destinatario": "a@example.com"})
+    # Simula a reserva feita ao liberar o agendamento para a fila
+    agendador._alterar("UPDATE agendamentos SET status = 'enviando' WHERE id = ?", (id_agendado,))
+
+    assert agendador.devolver([
+        {"id": id_agendado, "destinatario": "a@example.com"},
+        {"id": "da-fila", "destinatario": "b@example.com", "chave": "k1"},
+    ]) == 2
+    assert agendador.consultar(id_agendado)["status"] == PENDENTE
+    assert agendador.consultar("da-fila")["chave"] == "k1"
+    assert agendador.executar_vencidos(time.time() + 20) == 2
+    assert sorted(d["destinatario"] for d in enviados) == ["a@example.com", "b@example.com"]
+
@@ -0,0 +1,170 @@
+import email
+import io
+import smtplib
+import socketserver
+import threading
+import pytest
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from services.anexos import (
+    Anexo, ArmazemAnexos, chave_do_corpo, fronteira_para, montar_segmentos,
+    referencias_validas, transmitir_mensagem
+)
+
+class ServidorSMTPFalso(socketserver.ThreadingTCPServer):
+    """Servidor SMTP mínimo que guarda os bytes recebidos no DATA."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), TratadorSMTP)
+        self.mensagens = []
+
+class TratadorSMTP(socketserver.StreamRequestHandler):
+    def responder(self, linha):
+        self.wfile.write(linha.encode() + b"\r\n")
+
+    def handle(self):
+        self.responder("220 falso")
+        while True:
+            comando = self.rfile.readline()
+            if not comando:
+                return
+            verbo = comando[:4].upper()
+            if verbo == b"EHLO":
+                self.responder("250-falso")
+                self.responder("250 AUTH PLAIN")
+            elif verbo == b"AUTH":
+                self.responder("235 ok")
+            elif verbo == b"DATA":
+                self.responder("354 pode enviar")
+                linhas = []
+                while True:
+                    linha = self.rfile.readline()
+                    if linha == b".\r\n":
+                        break
+                    linhas.append(linha[1:] if linha.startswith(b"..") else linha)
+                self.server.mensagens.append(b"".join(linhas))
+                self.responder("250 aceito")
+            elif verbo == b"QUIT":
+                self.responder("221 tchau")
+                return
+            else:
+                self.responder("250 ok")
+
+@pytest.fixture
+def servidor_smtp():
+    servidor = ServidorSMTPFalso()
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+@pytest.fixture
+def armazem(tmp_path):
+    return ArmazemAnexos(str(tmp_path / "anexos"))
+
+def conteudo_binario(tamanho):
+    return bytes(i % 251 for i in range(tamanho))
+
+def test_salvar_deduplica(armazem, tmp_path):
+    """Testa que o mesmo conteúdo é armazenado e codificado uma única vez."""
+    conteudo = conteudo_binario(200_000)
+    hash1 = armazem.salvar(io.BytesIO(conteudo))
+    hash2 = armazem.salvar(io.BytesIO(conteudo))
+
+    assert hash1 == hash2
+    assert armazem.existe(hash1)
+    assert armazem.tamanho(hash1) == len(conteudo)
+    assert len(list((tmp_path / "anexos").rglob("*"))) == 2  # subdiretório + arquivo
+
+    caminho = armazem.codificado(hash1)
+    assert armazem.codificado(hash1) == caminho
+    linhas = open(caminho, "rb").read().split(b"\r\n")
+    assert all(len(linha) <= 76 for linha in linhas)
+
+def test_resolver_anexo_inexistente(armazem):
+    """Testa que uma referência a um anexo não armazenado é rejeitada."""
+    with pytest.raises(ValueError):
+        armazem.resolver([{"hash": "0" * 64, "nome": "x.pdf"}])
+
+def test_referencias_validas():
+    """Testa a validação estrutural das referências de anexos."""
+    hash_ = "a" * 64
+    assert referencias_validas([{"hash": hash_, "nome": "fatura.pdf", "tipo": "application/pdf"}])
+    assert not referencias_validas([{"hash": "abc", "nome": "fatura.pdf"}])
+    assert not referencias_validas([{"hash": hash_, "nome": "a\r\nBcc: x@y.com"}])
+    assert not referencias_validas([{"hash": hash_, "nome": "a.pdf", "tipo": "text/html\r\nX: y"}])
+    assert not referencias_validas([{"hash": hash_, "nome": "a.pdf", "tipo": "text/html\n"}])
+    # Não ASCII: a chave do corpo e o cabeçalho não conseguiriam codificá-lo
+    assert not referencias_validas([{"hash": hash_, "nome": "a.pdf", "tipo": "applicatión/pdf"}])
+    assert referencias_validas([{"hash": hash_, "nome": "a.docx",
+                                 "tipo": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"}])
+    assert not referencias_validas(["texto"])
+
+def test_segmentos_deterministicos(armazem):
+    """Testa que a mesma mensagem gera sempre a mesma fronteira e os mesmos bytes."""
+    hash_ = armazem.salvar(io.BytesIO(b"conteudo"))
+
+    def montar():
+        mensagem = MIMEMultipart()
+        mensagem["Subject"] = "Fatura"
+        mensagem.attach(MIMEText("<p>Olá</p>", "html", "utf-8"))
+        anexos = [Anexo(armazem, hash_, "fatura.pdf")]
+        return montar_segmentos(mensagem, anexos, fronteira_para(chave_do_corpo("<p>Olá</p>", anexos)))
+
+    primeiro, segundo = montar(), montar()
+    assert primeiro[0] == segundo[0]
+    assert b"boundary=\"=_fsw_" in primeiro[0]
+
+def test_transmitir_mensagem_em_fluxo(armazem, servidor_smtp):
+    """Testa o envio com anexo grande transmitido em blocos pelo socket SMTP."""
+    conteudo = conteudo_binario(3 * 1024 * 1024 + 17)
+    hash_ = armazem.salvar(io.BytesIO(conteudo))
+    anexos = armazem.resolver([{"hash": hash_, "nome": "relatório.bin"}])
+
+    mensagem = MIMEMultipart()
+    mensagem["From"] = "remetente@example.com"
+    mensagem["To"] = "destinatario@example.com"
+    mensagem["Subject"] = "Relatório"
+    mensagem.attach(MIMEText(".linha com ponto\n<p>corpo</p>", "html", "utf-8"))
+
+    conexao = smtplib.SMTP(*servidor_smtp.server_address)
+    try:
+        assert transmitir_mensagem(conexao, "remetente@example.com", "destinatario@example.com",
+                                   montar_segmentos(mensagem, anexos, "=_fsw_teste")) == {}
+    finally:
+        conexao.quit()
+
+    recebida = email.message_from_bytes(servidor_smtp.mensagens[0])
+    html, anexo = recebida.get_payload()
+    assert html.get_payload(decode=True).decode("utf-8").startswith(".linha com ponto")
+    assert anexo.get_filename() == "relatório.bin"
+    assert anexo.get_content_type() == "application/octet-stream"
+    assert anexo.get_payload(decode=True) == conteudo
+
+def test_enviar_email_com_anexo(armazem, servidor_smtp, monkeypatch):
+    """Testa enviar_email com anexos, pelo pool de conexões, sem TLS."""
+    from services.email_service import PoolSMTP, enviar_email
+    host, porta = servidor_smtp.server_address
+    monkeypatch.setenv("SMTP_SERVER", host)
+    monkeypatch.setenv("SMTP_PORT", str(porta))
+    monkeypatch.setenv("EMAIL_USE_TLS", "False")
+    monkeypatch.setenv("EMAIL_HOST_USER", "remetente@example.com")
+    monkeypatch.setenv("EMAIL_HOST_PASSWORD", "senha")
+
+    hash_ = armazem.salvar(io.BytesIO(b"%PDF-1.4 fatura"))
+    pool = PoolSMTP()
+    try:
+        for destinatario in ("a@example.com", "b@example.com"):
+            resultado = enviar_email(destinatario, "Fatura", "<p>Segue a fatura</p>", pool=pool,
+                                     anexos=armazem.resolver([{"hash": hash_, "nome": "fatura.pdf"}]))
+            assert resultado["sucesso"] is True, resultado
+    finally:
+        pool.fechar()
+
+    assert len(servidor_smtp.mensagens) == 2
+    anexo = email.message_from_bytes(servidor_smtp.mensagens[1]).get_payload()[1]
+    assert anexo.get_content_type() == "application/pdf"
+    assert anexo.get_payload(decode=True) == b"%PDF-1.4 fatura"
@@ -1,5 +1,9 @@
 import pytest
 import json
+import os
+import time
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import datetime, timezone
 from unittest.mock import patch, MagicMock
 
 def test_health_check(client):
@@ -231,4 +235,649 @@ def test_api_docs(client):
     response = client.get('/api/docs/', follow_redirects=True)
     
     assert response.status_code == 200
-    assert b"swagger" in response.data.lower()  # Verifica se a página Swagger é carregada
\ No newline at end of file
+    assert b"swagger" in response.data.lower()  # Verifica se a página Swagger é carregada
+
+def test_api_endpoints_conditional_get(client):
+    """Testa que /api/endpoints responde 304 quando o ETag ainda é válido."""
+    response = client.get('/api/endpoints')
+    etag = response.headers.get("ETag")
+
+    assert response.status_code == 200
+    assert etag
+    assert response.headers.get("Last-Modified")
+
+    response = client.get('/api/endpoints', headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.data == b""
+
+def test_api_endpoints_gzip(client):
+    """Testa que a variante gzip pré-comprimida é servida quando aceita."""
+    import gzip
+
+    response = client.get('/api/endpoints', headers={"Accept-Encoding": "gzip"})
+    data = json.loads(gzip.decompress(response.data))
+
+    assert response.status_code == 200
+    assert response.headers.get("Content-Encoding") == "gzip"
+    assert "Accept-Encoding" in response.headers.get("Vary", "")
+    assert data["serviço"] == "API de Envio de Email"
+
+def test_swagger_json_if_modified_since(client):
+    """Testa a validação por Last-Modified da especificação Swagger."""
+    response = client.get('/static/swagger.json')
+    data = json.loads(response.data)
+
+    assert response.status_code == 200
+    assert data["swagger"] == "2.0"
+
+    response = client.get(
+        '/static/swagger.json',
+        headers={"If-Modified-Since": response.headers["Last-Modified"]}
+    )
+
+    assert response.status_code == 304
+
+def test_last_modified_vem_dos_arquivos_de_origem(client):
+    """Testa que o Last-Modified é o mtime dos arquivos, igual em todos os workers."""
+    from email.utils import parsedate_to_datetime
+    import app as modulo_app
+
+    response = client.get('/api/endpoints')
+    modificado_em = parsedate_to_datetime(response.headers["Last-Modified"]).timestamp()
+
+    assert modificado_em == int(os.path.getmtime(modulo_app.__file__))
+
+def test_enviar_email_json_nao_objeto(client):
+    """Testa o endpoint de envio de email com JSON válido que não é um objeto."""
+    response = client.post(
+        '/api/enviar-email',
+        data=json.dumps(["a", "b"]),
+        content_type='application/json'
+    )
+    data = json.loads(response.data)
+
+    assert response.status_code == 400
+    assert data["sucesso"] is False
+    assert "JSON" in data["mensagem"]
+
+def test_enviar_email_payload_excede_limite(client, valid_email_payload):
+    """Testa que o tamanho do corpo é verificado antes da decodificação."""
+    payload = valid_email_payload.copy()
+    payload["corpo"] = "A" * (100 * 1024)
+
+    response = client.post(
+        '/api/enviar-email',
+        data=json.dumps(payload),
+        content_type='application/json'
+    )
+    data = json.loads(response.data)
+
+    assert response.status_code == 413
+    assert data["sucesso"] is False
+
+def test_enviar_email_assunto_nao_texto(client, valid_email_payload):
+    """Testa que um assunto que não é texto gera 400 em vez de erro no servidor."""
+    with patch('app.validate_email_address', return_value=True):
+        payload = valid_email_payload.copy()
+        payload["assunto"] = 123
+
+        response = client.post(
+            '/api/enviar-email',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+        data = json.loads(response.data)
+
+        assert response.status_code == 400
+        assert data["sucesso"] is False
+        assert data["erros"] == ["Campo assunto deve ser do tipo texto"]
+
+def test_swagger_json_definicoes_geradas(client):
+    """Testa que a especificação servida contém a definição gerada pelo esquema."""
+    response = client.get('/static/swagger.json')
+    data = json.loads(response.data)
+
+    import app as app_module
+    assert data["definitions"]["EnviarEmail"] == app_module.ESQUEMA_ENVIO.para_swagger()
+    assert data["definitions"]["EnviarEmail"]["properties"]["assunto"]["maxLength"] == 200
+    # O arquivo estático só reserva o nome; os campos vêm apenas do esquema
+    with open(os.path.join(app_module.app.static_folder, "swagger.json"), encoding="utf-8") as arquivo:
+        assert json.load(arquivo)["definitions"]["EnviarEmail"] == {}
+
+def test_enviar_email_chave_registrada_dominio_nao_permitido(client, valid_email_payload, tmp_path, monkeypatch):
+    """Testa que a política de domínios da chave é aplicada no envio."""
+    from services.chaves_api import RegistroChaves, gerar_chave
+    chave, registro = gerar_chave("Portal", dominios_permitidos=["ifc.edu.br"])
+    caminho = tmp_path / "api_keys.json"
+    caminho.write_text(json.dumps({"chaves": [registro.para_dict()]}))
+    monkeypatch.setattr('app.REGISTRO_CHAVES', RegistroChaves(str(caminho)))
+    client.environ_base['HTTP_X_API_KEY'] = chave
+
+    with patch('app.validate_email_address', return_value=True):
+        response = client.post(
+            '/api/enviar-email',
+            data=json.dumps(valid_email_payload),
+            content_type='application/json'
+        )
+    data = json.loads(response.data)
+
+    assert response.status_code == 403
+    assert data["sucesso"] is False
+
+def test_enviar_email_chave_registrada_remetente(client, valid_email_payload, mock_smtp, tmp_path, monkeypatch):
+    """Testa que o remetente da chave é usado no cabeçalho From."""
+    from services.chaves_api import RegistroChaves, gerar_chave
+    chave, registro = gerar_chave("Portal", remetente="Portal <portal@example.com>")
+    caminho = tmp_path / "api_keys.json"
+    caminho.write_text(json.dumps({"chaves": [registro.para_dict()]}))
+    monkeypatch.setattr('app.REGISTRO_CHAVES', RegistroChaves(str(caminho)))
+    client.environ_base['HTTP_X_API_KEY'] = chave
+
+    with patch('app.validate_email_address', return_value=True):
+        response = client.post(
+            '/api/enviar-email',
+            data=json.dumps(valid_email_payload),
+            content_type='application/json'
+        )
+
+    assert response.status_code == 200
+    texto = mock_smtp.return_value.sendmail.call_args[0][2]
+    assert "From: Portal <portal@example.com>" in texto
+
+def test_rotas_globais_exigem_chave_admin(client, supressao_temporaria, tmp_path, monkeypatch):
+    """Testa que a chave de um cliente não altera a supressão de todos nem vê métricas e memória."""
+    from services.chaves_api import RegistroChaves, gerar_chave
+    cliente, registro_cliente = gerar_chave("Portal")
+    admin, registro_admin = gerar_chave("Operação", admin=True)
+    caminho = tmp_path / "api_keys.json"
+    caminho.write_text(json.dumps({"chaves": [registro_cliente.para_dict(), registro_admin.para_dict()]}))
+    monkeypatch.setattr('app.REGISTRO_CHAVES', RegistroChaves(str(caminho)))
+    supressao_temporaria.adicionar("bounce@example.com")
+    requisicoes = [
+        ("post", "/api/supressoes", {"endereco": "a@example.com"}),
+        ("post", "/api/supressoes/importar", {"enderecos": ["b@example.com"]}),
+        ("get", "/api/supressoes/bounce@example.com", None),
+        ("delete", "/api/supressoes/bounce@example.com", None),
+        ("get", "/api/metricas", None),
+        ("get", "/api/memoria", None),
+    ]
+
+    client.environ_base['HTTP_X_API_KEY'] = cliente
+    for metodo, rota, corpo in requisicoes:
+        response = getattr(client, metodo)(rota, json=corpo)
+        assert response.status_code == 403, rota
+    assert supressao_temporaria.contem("bounce@example.com")
+
+    client.environ_base['HTTP_X_API_KEY'] = admin
+    assert client.delete('/api/supressoes/bounce@example.com').status_code == 200
+    assert client.get('/api/metricas').status_code == 200
+    assert not supressao_temporaria.contem("bounce@example.com")
+
+def test_cota_da_chave_cobrada_apenas_no_envio(client, valid_email_payload, mock_smtp, tmp_path, monkeypatch):
+    """Testa que consultas não consomem a cota de envios da chave."""
+    import app as app_module
+    from services.chaves_api import RegistroChaves, gerar_chave
+    chave, registro = gerar_chave("Portal", limite="1 per minute")
+    caminho = tmp_path / "api_keys.json"
+    caminho.write_text(json.dumps({"chaves": [registro.para_dict()]}))
+    monkeypatch.setattr('app.REGISTRO_CHAVES', RegistroChaves(str(caminho)))
+    monkeypatch.setattr(app_module.limiter, "enabled", True)
+    app_module.limiter.reset()
+    client.environ_base['HTTP_X_API_KEY'] = chave
+
+    for _ in range(3):
+        assert client.get('/api/mensagens').status_code == 200
+    with patch('app.validate_email_address', return_value=True):
+        respostas = [
+            client.post('/api/enviar-email', data=json.dumps(valid_email_payload),
+                        content_type='application/json').status_code
+            for _ in range(2)
+        ]
+    app_module.limiter.reset()
+
+    assert respostas == [200, 429]
+
+def test_enviar_email_agendado(client, valid_email_payload, agendador_temporario):
+    """Testa o agendamento, a consulta e o cancelamento de um envio."""
+    with patch('app.validate_email_address', return_value=True):
+        payload = valid_email_payload.copy()
+        payload["enviar_em"] = "2999-01-01T09:00:00Z"
+        response = client.post(
+            '/api/enviar-email',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+    # Além do horizonte de agendamento
+    assert response.status_code == 400
+
+    with patch('app.validate_email_address', return_value=True):
+        payload["enviar_em"] = datetime.fromtimestamp(time.time() + 3600, tz=timezone.utc).isoformat()
+        response = client.post(
+            '/api/enviar-email',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+    data = json.loads(response.data)
+
+    assert response.status_code == 202
+    assert data["sucesso"] is True
+    id_agendamento = data["id"]
+
+    response = client.get(f'/api/agendamentos/{id_agendamento}')
+    assert json.loads(response.data)["status"] == "pendente"
+
+    response = client.delete(f'/api/agendamentos/{id_agendamento}')
+    assert response.status_code == 200
+
+    response = client.delete(f'/api/agendamentos/{id_agendamento}')
+    assert response.status_code == 404
+
+def test_enviar_email_agendado_data_invalida(client, valid_email_payload):
+    """Testa que uma data de envio inválida é rejeitada na validação."""
+    with patch('app.validate_email_address', return_value=True):
+        payload = valid_email_payload.copy()
+        payload["enviar_em"] = "amanhã"
+        response = client.post(
+            '/api/enviar-email',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+    data = json.loads(response.data)
+
+    assert response.status_code == 400
+    assert "enviar_em" in data["mensagem"]
+
+def test_enviar_email_prioridade(client, valid_email_payload, mock_smtp, email_validator_mock):
+    """Testa o envio pela faixa de prioridade alta e o registro nas métricas."""
+    payload = valid_email_payload.copy()
+    payload["prioridade"] = "alta"
+    response = client.post(
+        '/api/enviar-email',
+        data=json.dumps(payload),
+        content_type='application/json'
+    )
+    data = json.loads(response.data)
+
+    assert response.status_code == 200
+    assert data["sucesso"] is True
+    assert data["id"]
+
+    response = client.get('/api/metricas')
+    metricas = json.loads(response.data)
+    assert response.status_code == 200
+    assert any(c["nome"] == "envios_sucesso" and c["rotulos"] == {"faixa": "alta"}
+               for c in metricas["contadores"])
+    assert any(m["nome"] == "memoria_rss_pico_bytes" and m["valor"] > 0 for m in metricas["medidores"])
+
+def test_alta_passa_a_frente_da_campanha_pela_api(valid_email_payload, mock_smtp, email_validator_mock,
+                                                  monkeypatch):
+    """Testa que, com requisições simultâneas, a prioridade alta não espera as campanhas já na fila."""
+    import os
+    import threading
+    import app as app_module
+    from services.filas import Faixa, FilaPrioridade
+
+    fila = FilaPrioridade(enviar=app_module._enviar_da_fila, workers=1,
+                          faixas=[Faixa("alta", 1.0), Faixa("normal", 0.75), Faixa("baixa", 0.5)])
+    monkeypatch.setattr(app_module, "FILA_ENVIO", fila)
+    liberar = threading.Event()
+    ordem = []
+
+    def sendmail(remetente, destinatario, mensagem):
+        ordem.append(destinatario)
+        liberar.wait(timeout=5)
+        return {}
+    mock_smtp.return_value.sendmail.side_effect = sendmail
+
+    def postar(destinatario, prioridade):
+        payload = dict(valid_email_payload, destinatario=destinatario, prioridade=prioridade)
+        with app_module.app.test_client() as cliente:
+            cliente.environ_base['HTTP_X_API_KEY'] = os.getenv("API_KEY", "test-api-key")
+            cliente.post('/api/enviar-email', data=json.dumps(payload), content_type='application/json')
+
+    def aguardar(condicao):
+        limite = time.monotonic() + 5
+        while not condicao():
+            assert time.monotonic() < limite
+            time.sleep(0.01)
+
+    # Como nos workers gthread: cada requisição em sua thread, esperando o próprio envio
+    threads = [threading.Thread(target=postar, args=(f"campanha{i}@example.com", "baixa")) for i in range(3)]
+    threads[0].start()
+    aguardar(lambda: len(ordem) == 1)
+    for thread in threads[1:]:
+        thread.start()
+    aguardar(lambda: fila.tamanho() == 2)
+    threads.append(threading.Thread(target=postar, args=("senha@example.com", "alta")))
+    threads[-1].start()
+    aguardar(lambda: fila.tamanho() == 3)
+    liberar.set()
+    for thread in threads:
+        thread.join(timeout=10)
+    fila.parar(timeout=1)
+
+    assert ordem[:2] == ["campanha0@example.com", "senha@example.com"]
+    assert len(ordem) == 4
+
+def test_enviar_email_prioridade_invalida(client, valid_email_payload):
+    """Testa que uma prioridade desconhecida é rejeitada na validação."""
+    with patch('app.validate_email_address', return_value=True):
+        payload = valid_email_payload.copy()
+        payload["prioridade"] = "urgentissima"
+        response = client.post(
+            '/api/enviar-email',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+    data = json.loads(response.data)
+
+    assert response.status_code == 400
+    assert "Prioridade inválida" in data["mensagem"]
+
+def test_enviar_email_timeout_enfileira(client, valid_email_payload, email_validator_mock):
+    """Testa que um envio que excede o tempo de espera responde 202 com o ID."""
+    futuro = MagicMock()
+    futuro.result.side_effect = FuturesTimeoutError()
+    with patch('app.FILA_ENVIO.submeter', return_value=futuro):
+        response = client.post(
+            '/api/enviar-email',
+            data=json.dumps(valid_email_payload),
+            content_type='application/json'
+        )
+    data = json.loads(response.data)
+
+    assert response.status_code == 202
+    assert data["id"]
+
+def test_enviar_email_destinatario_suprimido(client, valid_email_payload, mock_smtp,
+                                             email_validator_mock, supressao_temporaria):
+    """Testa que um destinatário suprimido é rejeitado antes de qualquer envio."""
+    response = client.post(
+        '/api/supressoes',
+        data=json.dumps({"endereco": valid_email_payload["destinatario"]}),
+        content_type='application/json'
+    )
+    assert response.status_code == 201
+
+    response = client.post(
+        '/api/enviar-email',
+        data=json.dumps(valid_email_payload),
+        content_type='application/json'
+    )
+    data = json.loads(response.data)
+
+    assert response.status_code == 422
+    assert "supressão" in data["mensagem"]
+    mock_smtp.assert_not_called()
+
+def test_supressoes_importar_e_remover(client, supressao_temporaria):
+    """Testa a importação em lote (JSON e texto) e a remoção de endereços."""
+    response = client.post(
+        '/api/supressoes/importar',
+        data=json.dumps({"enderecos": ["a@example.com", "b@example.com", "invalido"]}),
+        content_type='application/json'
+    )
+    assert json.loads(response.data)["adicionados"] == 2
+
+    response = client.post(
+        '/api/supressoes/importar',
+        data="b@example.com\nc@example.com\n",
+        content_type='text/plain'
+    )
+    data = json.loads(response.data)
+    assert data["adicionados"] == 1
+    assert data["total"] == 3
+
+    assert json.loads(client.get('/api/supressoes/c@example.com').data)["suprimido"] is True
+    assert client.delete('/api/supressoes/c@example.com').status_code == 200
+    assert client.delete('/api/supressoes/c@example.com').status_code == 404
+    assert json.loads(client.get('/api/supressoes/c@example.com').data)["suprimido"] is False
+
+def test_enviar_email_com_anexo(client, valid_email_payload, mock_smtp, email_validator_mock,
+                                tmp_path, monkeypatch):
+    """Testa o upload de um anexo e o envio referenciando-o pelo hash."""
+    import io
+    from services.anexos import ArmazemAnexos
+    monkeypatch.setattr('app.ARMAZEM_ANEXOS', ArmazemAnexos(str(tmp_path / "anexos")))
+    smtp_instance = mock_smtp.return_value
+    smtp_instance.mail.return_value = (250, b'OK')
+    smtp_instance.rcpt.return_value = (250, b'OK')
+    smtp_instance.getreply.side_effect = [(354, b'Go'), (250, b'OK')]
+    enviados = []
+    smtp_instance.sock.sendall.side_effect = lambda dados: enviados.append(bytes(dados))
+
+    response = client.post(
+        '/api/anexos',
+        data={"arquivo": (io.BytesIO(b"%PDF-1.4 fatura"), "fatura.pdf", "application/pdf")},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 201
+    anexo = json.loads(response.data)["anexos"][0]
+    assert anexo["tamanho"] == 15
+
+    payload = valid_email_payload.copy()
+    payload["anexos"] = [{"hash": anexo["hash"], "nome": anexo["nome"], "tipo": anexo["tipo"]}]
+    response = client.post(
+        '/api/enviar-email',
+        data=json.dumps(payload),
+        content_type='application/json'
+    )
+
+    assert response.status_code == 200
+    assert b'filename="fatura.pdf"' in b"".join(enviados)
+    smtp_instance.sendmail.assert_not_called()
+
+def test_enviar_email_anexo_inexistente(client, valid_email_payload, email_validator_mock):
+    """Testa que referenciar um anexo não armazenado é rejeitado na validação."""
+    payload = valid_email_payload.copy()
+    payload["anexos"] = [{"hash": "0" * 64, "nome": "fatura.pdf"}]
+    response = client.post(
+        '/api/enviar-email',
+        data=json.dumps(payload),
+        content_type='application/json'
+    )
+
+    assert response.status_code == 400
+    assert "Anexo não encontrado" in json.loads(response.data)["mensagem"]
+
+def test_enviar_email_anexo_tipo_nao_ascii(client, valid_email_payload, email_validator_mock, mock_smtp):
+    """Testa que um tipo MIME fora do ASCII é rejeitado com 400, sem chegar à fila."""
+    payload = valid_email_payload.copy()
+    payload["anexos"] = [{"hash": "0" * 64, "nome": "fatura.pdf", "tipo": "applicatión/pdf"}]
+    response = client.post(
+        '/api/enviar-email',
+        data=json.dumps(payload),
+        content_type='application/json'
+    )
+
+    assert response.status_code == 400
+    mock_smtp.return_value.sendmail.assert_not_called()
+
+def test_enviar_email_publica_evento_no_webhook(client, valid_email_payload, mock_smtp,
+                                                email_validator_mock, monkeypatch):
+    """Testa que o resultado do envio é publicado no webhook da chave."""
+    import app as app_module
+    eventos = []
+    monkeypatch.setattr(app_module.NOTIFICADOR_WEBHOOKS, "publicar",
+                        lambda chave, evento: eventos.append((chave, evento)) or True)
+    response = client.post(
+        '/api/enviar-email',
+        data=json.dumps(valid_email_payload),
+        content_type='application/json'
+    )
+    data = json.loads(response.data)
+
+    assert response.status_code == 200
+    assert eventos == [("padrao", {
+        "evento": "enviado",
+        "id": data["id"],
+        "destinatario": valid_email_payload["destinatario"],
+        "mensagem": "Email enviado com sucesso!",
+    })]
+
+def test_destino_webhook_por_chave(monkeypatch):
+    """Testa a resolução do webhook pela chave de API e pela configuração global."""
+    import app as app_module
+    from services.chaves_api import ChaveApi
+    chave = ChaveApi(prefixo="fsk_1", hash="x", webhook_url="http://cliente/eventos", webhook_segredo="s")
+    monkeypatch.setattr(app_module.REGISTRO_CHAVES, "_chaves", {"fsk_1": chave})
+    monkeypatch.setattr(app_module, "WEBHOOK_URL", "")
+
+    assert app_module._destino_webhook("fsk_1") == ("http://cliente/eventos", "s")
+    assert app_module._destino_webhook("fsk_2") is None
+    assert app_module._destino_webhook("padrao") is None
+    monkeypatch.setattr(app_module, "WEBHOOK_URL", "http://global/eventos")
+    assert app_module._destino_webhook("padrao") == ("http://global/eventos", None)
+
+def test_historico_de_mensagens(client, valid_email_payload, mock_smtp, email_validator_mock,
+                                historico_temporario):
+    """Testa o registro do envio no histórico e as consultas por id e por busca."""
+    response = client.post(
+        '/api/enviar-email',
+        data=json.dumps(valid_email_payload),
+        content_type='application/json'
+    )
+    id_mensagem = json.loads(response.data)["id"]
+    historico_temporario.gravar()
+
+    response = client.get(f'/api/mensagens/{id_mensagem}')
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert data["status"] == "enviado"
+    assert data["destinatario"] == valid_email_payload["destinatario"]
+    assert data["criado_em"].endswith("+00:00")
+
+    response = client.get('/api/mensagens', query_string={
+        "destinatario": valid_email_payload["destinatario"], "status": "enviado", "limite": 1
+    })
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert [item["id"] for item in data["mensagens"]] == [id_mensagem]
+    assert data["cursor"] is None
+
+    response = client.get('/api/mensagens/inexistente')
+    assert response.status_code == 404
+
+def test_historico_parametros_invalidos(client):
+    """Testa a validação dos parâmetros da busca de mensagens."""
+    assert client.get('/api/mensagens?status=perdido').status_code == 400
+    assert client.get('/api/mensagens?limite=0').status_code == 400
+    assert client.get('/api/mensagens?desde=ontem').status_code == 400
+    assert client.get('/api/mensagens?cursor=!!!').status_code == 400
+
+def test_encerrar_servicos_persiste_fila(client, agendador_temporario, email_validator_mock,
+                                        monkeypatch):
+    """Testa que o encerramento drena a fila e persiste as mensagens que sobraram."""
+    import threading
+    import app as app_module
+    from services.filas import FilaEncerrada, FilaPrioridade
+    from services.mensagens import Mensagem
+    liberar = threading.Event()
+
+    def enviar_lento(dados):
+        liberar.wait(timeout=5)
+        return {"sucesso": True}
+
+    fila = FilaPrioridade(enviar=enviar_lento, workers=1)
+    monkeypatch.setattr(app_module, "FILA_ENVIO", fila)
+    pool = MagicMock()
+    monkeypatch.setattr(app_module, "POOL_SMTP", pool)
+    futuros = [fila.submeter(Mensagem(f"m{i}", "a@example.com", "Teste", "<p>Teste</p>")) for i in range(3)]
+    while not fila.tamanho() < 3:
+        time.sleep(0.01)
+    assert fila.em_andamento() == 1
+
+    liberar_depois = threading.Timer(0.3, liberar.set)
+    liberar_depois.start()
+    app_module.encerrar_servicos(prazo=0.2)
+
+    assert futuros[0].result(timeout=1) == {"sucesso": True}
+    for futuro in futuros[1:]:
+        with pytest.raises(FilaEncerrada):
+            futuro.result(timeout=0)
+    assert agendador_temporario.pendentes() == 2
+    pool.fechar.assert_called_once()
+
+    response = client.post('/api/enviar-email', data=json.dumps({
+        "destinatario": "a@example.com", "assunto": "Teste", "corpo": "<p>Teste</p>"
+    }), content_type='application/json')
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+def test_sigterm_fecha_a_entrada_antes_das_requisicoes_terminarem(client, agendador_temporario,
+                                                                   email_validator_mock, monkeypatch):
+    """Testa que, ao receber SIGTERM, novas mensagens são recusadas e as aceitas continuam sendo enviadas."""
+    import importlib.util
+    import signal
+    import threading
+    import app as app_module
+    from services.filas import FilaPrioridade
+    from services.mensagens import Mensagem
+    liberar = threading.Event()
+
+    def enviar_lento(dados):
+        liberar.wait(timeout=5)
+        return {"sucesso": True}
+
+    fila = FilaPrioridade(enviar=enviar_lento, workers=1)
+    monkeypatch.setattr(app_module, "FILA_ENVIO", fila)
+    monkeypatch.setattr(app_module, "iniciar_servicos", lambda: None)
+    futuros = [fila.submeter(Mensagem(f"m{i}", "a@example.com", "Teste", "<p>Teste</p>")) for i in range(2)]
+    agendador_temporario.iniciar()
+
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", "gunicorn.conf.py")
+    gunicorn_conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gunicorn_conf)
+    sinais = []
+    tratador_original = signal.signal(signal.SIGTERM, lambda signum, frame: sinais.append(signum))
+    try:
+        worker = MagicMock()
+        worker.cfg.graceful_timeout = 60
+        gunicorn_conf.post_worker_init(worker)
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+    finally:
+        signal.signal(signal.SIGTERM, tratador_original)
+
+    # O tratador do Gunicorn continua sendo chamado
+    assert sinais == [signal.SIGTERM]
+    agendador_temporario._thread.join(timeout=1)
+    assert not agendador_temporario._thread.is_alive()
+    response = client.post('/api/enviar-email', data=json.dumps({
+        "destinatario": "a@example.com", "assunto": "Teste", "corpo": "<p>Teste</p>"
+    }), content_type='application/json')
+    assert response.status_code == 503
+
+    liberar.set()
+    assert [futuro.result(timeout=5) for futuro in futuros] == [{"sucesso": True}] * 2
+    fila.parar(timeout=1)
+
+def test_prazos_de_encerramento_cabem_no_graceful_timeout(monkeypatch):
+    """Testa que a espera pelo envio mais a drenagem precisam caber no --graceful-timeout."""
+    import app as app_module
+    monkeypatch.setattr(app_module, "ENVIO_TIMEOUT", 30)
+    monkeypatch.setattr(app_module, "ENCERRAMENTO_PRAZO", 20)
+
+    app_module.verificar_prazos_encerramento(60)
+    with pytest.raises(ValueError, match="GUNICORN_GRACEFUL_TIMEOUT"):
+        app_module.verificar_prazos_encerramento(30)
+
+def test_memoria(client, valid_email_payload, mock_smtp, email_validator_mock, monkeypatch):
+    """Testa o relatório de memória, com as etapas do envio medidas no modo de depuração."""
+    import tracemalloc
+    import app as app_module
+    from services.memoria import RastreadorMemoria
+    ja_rastreando = tracemalloc.is_tracing()
+    monkeypatch.setattr(app_module, "RASTREADOR_MEMORIA", RastreadorMemoria(ativo=True, amostragem=1))
+    try:
+        response = client.post('/api/enviar-email', data=json.dumps(valid_email_payload),
+                               content_type='application/json')
+        assert response.status_code == 200
+        relatorio = json.loads(client.get('/api/memoria').data)
+    finally:
+        if not ja_rastreando:
+            tracemalloc.stop()
+
+    assert relatorio["rastreamento"] is True
+    assert relatorio["rss_pico_bytes"] > 0
+    assert {"decodificar", "validar", "enfileirar", "enviar"} <= set(relatorio["etapas"])
@@ -0,0 +1,105 @@
+import json
+import os
+import sqlite3
+import pytest
+from services.chaves_api import RegistroChaves, gerar_chave, hash_chave, main
+
+@pytest.fixture
+def arquivo_chaves(tmp_path):
+    """Fixture que cria um arquivo JSON com uma chave gerada."""
+    chave, registro = gerar_chave(
+        "Portal",
+        limite="2 per minute",
+        remetente="Portal <portal@example.com>",
+        dominios_permitidos=["Example.com"],
+    )
+    caminho = tmp_path / "api_keys.json"
+    caminho.write_text(json.dumps({"chaves": [registro.para_dict()]}))
+    return str(caminho), chave
+
+def test_autenticar_chave_valida(arquivo_chaves):
+    """Testa a autenticação de uma chave registrada."""
+    caminho, chave = arquivo_chaves
+    registro = RegistroChaves(caminho).autenticar(chave)
+
+    assert registro is not None
+    assert registro.nome == "Portal"
+    assert registro.remetente == "Portal <portal@example.com>"
+    assert len(registro.limites) == 1
+
+def test_autenticar_chave_invalida(arquivo_chaves):
+    """Testa chaves com segredo errado, prefixo desconhecido ou sem prefixo."""
+    caminho, chave = arquivo_chaves
+    registro = RegistroChaves(caminho)
+    prefixo = chave.partition(".")[0]
+
+    assert registro.autenticar(f"{prefixo}.segredo-errado") is None
+    assert registro.autenticar("fsk_00000000.qualquer") is None
+    assert registro.autenticar("chave-sem-prefixo") is None
+
+def test_chave_inativa(tmp_path):
+    """Testa que chaves desativadas não autenticam."""
+    chave, registro = gerar_chave("Inativa", ativa=False)
+    caminho = tmp_path / "api_keys.json"
+    caminho.write_text(json.dumps({"chaves": [registro.para_dict()]}))
+
+    assert RegistroChaves(str(caminho)).autenticar(chave) is None
+
+def test_recarga_automatica(arquivo_chaves):
+    """Testa que o registro recarrega quando o arquivo muda, sem reiniciar."""
+    caminho, chave = arquivo_chaves
+    registro = RegistroChaves(caminho, intervalo_recarga=0)
+    assert registro.autenticar(chave) is not None
+
+    # Rotacionar: remover a chave antiga e adicionar uma nova
+    nova_chave, novo_registro = gerar_chave("Portal")
+    with open(caminho, "w") as arquivo:
+        json.dump({"chaves": [novo_registro.para_dict()]}, arquivo)
+    os.utime(caminho, (0, 12345))
+
+    assert registro.autenticar(chave) is None
+    assert registro.autenticar(nova_chave) is not None
+
+def test_politica_dominios(arquivo_chaves):
+    """Testa a política de domínios de destinatário permitidos."""
+    caminho, chave = arquivo_chaves
+    registro = RegistroChaves(caminho).autenticar(chave)
+
+    assert registro.permite_destinatario("alguem@example.com")
+    assert registro.permite_destinatario("alguem@EXAMPLE.COM")
+    assert not registro.permite_destinatario("alguem@outro.com")
+
+def test_carregar_sqlite(tmp_path):
+    """Testa o carregamento do registro a partir de um banco SQLite."""
+    chave = "fsk_abcdef01.segredo"
+    caminho = str(tmp_path / "chaves.db")
+    conexao = sqlite3.connect(caminho)
+    conexao.execute(
+        "CREATE TABLE chaves_api (prefixo TEXT PRIMARY KEY, hash TEXT, nome TEXT, "
+        "limite TEXT, remetente TEXT, dominios_permitidos TEXT, ativa INTEGER)"
+    )
+    conexao.execute(
+        "INSERT INTO chaves_api VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ("fsk_abcdef01", hash_chave(chave), "Sistema", None, None, '["ifc.edu.br"]', 1),
+    )
+    conexao.commit()
+    conexao.close()
+
+    registro = RegistroChaves(caminho).autenticar(chave)
+
+    assert registro is not None
+    assert registro.dominios_permitidos == frozenset({"ifc.edu.br"})
+
+def test_cli_gerar(tmp_path, capsys):
+    """Testa a geração de chave pela linha de comando."""
+    caminho = str(tmp_path / "api_keys.json")
+
+    assert main(["gerar", "--arquivo", caminho, "--nome", "CLI", "--limite", "5 per minute"]) == 0
+
+    chave = capsys.readouterr().out.strip().splitlines()[-1]
+    assert RegistroChaves(caminho).autenticar(chave).nome == "CLI"
+    assert RegistroChaves(caminho).autenticar(chave).admin is False
+
+    assert main(["gerar", "--arquivo", caminho, "--nome", "Operação", "--admin"]) == 0
+    chave = capsys.readouterr().out.strip().splitlines()[-1]
+    assert RegistroChaves(caminho).autenticar(chave).admin is True
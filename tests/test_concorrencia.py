@@ -0,0 +1,119 @@
+import threading
+import time
+import pytest
+from services.concorrencia import LimiteAdaptativo
+from services.email_service import enviar_email
+from services.filas import FilaPrioridade
+from services.metricas import Metricas
+from services.transportes import TransporteNulo
+
+def janela(limitador, duracao, sobrecarga=False, em_andamento=None):
+    """Registra uma janela inteira de envios iguais."""
+    if em_andamento is None:
+        em_andamento = limitador.limite
+    for _ in range(limitador.amostras):
+        limite = limitador.registrar(duracao, sobrecarga, em_andamento)
+    return limite
+
+def test_limite_inicial_fora_da_faixa():
+    with pytest.raises(ValueError):
+        LimiteAdaptativo(inicial=10, maximo=5)
+
+def test_cresce_com_latencia_estavel(metricas, medidor):
+    limitador = LimiteAdaptativo(inicial=4, maximo=20, metricas=metricas)
+    limites = [janela(limitador, 0.05) for _ in range(30)]
+
+    assert limites == sorted(limites)
+    assert limites[-1] == 20
+    assert medidor("concorrencia_limite") == 20
+
+def test_nao_cresce_limitado_pela_demanda():
+    limitador = LimiteAdaptativo(inicial=8, maximo=20, metricas=Metricas())
+    for _ in range(10):
+        janela(limitador, 0.05, em_andamento=1)
+    assert limitador.limite == 8
+
+def test_encolhe_quando_a_latencia_sobe():
+    limitador = LimiteAdaptativo(inicial=16, maximo=16, metricas=Metricas())
+    for _ in range(10):
+        janela(limitador, 0.05)
+    assert limitador.limite == 16
+
+    limites = [janela(limitador, 0.5) for _ in range(10)]
+    assert limites == sorted(limites, reverse=True)
+    assert limites[-1] <= 10
+
+def test_falha_temporaria_reduz_multiplicativamente():
+    metricas = Metricas()
+    limitador = LimiteAdaptativo(inicial=10, recuo=0.5, metricas=metricas)
+    # Uma falha basta para a janela inteira contar como sobrecarga
+    for i in range(limitador.amostras):
+        limitador.registrar(0.05, sobrecarga=(i == 3), em_andamento=10)
+    assert limitador.limite == 5
+
+    for _ in range(10):
+        janela(limitador, 0.05, sobrecarga=True)
+    assert limitador.limite == limitador.minimo
+    reducoes = [c["valor"] for c in metricas.instantaneo()["contadores"] if c["nome"] == "concorrencia_reducoes"]
+    assert reducoes == [11]
+
+class EnvioSimultaneo:
+    """Envio fictício que mede quantos rodam ao mesmo tempo."""
+
+    def __init__(self, duracao, temporario=False):
+        self.duracao = duracao
+        self.temporario = temporario
+        self.em_andamento = 0
+        self.maximo_em_andamento = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, dados):
+        with self._lock:
+            self.em_andamento += 1
+            self.maximo_em_andamento = max(self.maximo_em_andamento, self.em_andamento)
+        time.sleep(self.duracao)
+        with self._lock:
+            self.em_andamento -= 1
+        if self.temporario:
+            return {"sucesso": False, "temporario": True}
+        return {"sucesso": True}
+
+def test_fila_amplia_envios_simultaneos():
+    """Testa que a fila passa a enviar mais em paralelo quando o servidor acompanha."""
+    metricas = Metricas()
+    limitador = LimiteAdaptativo(inicial=2, maximo=8, amostras=4, metricas=metricas)
+    envio = EnvioSimultaneo(0.01)
+    fila = FilaPrioridade(enviar=envio, workers=2, limitador=limitador, metricas=metricas)
+    futuros = [fila.submeter({"id": str(i)}, "alta") for i in range(200)]
+    assert all(futuro.result(timeout=10)["sucesso"] for futuro in futuros)
+    fila.parar(timeout=1)
+
+    assert fila.workers == 8
+    assert limitador.limite > 2
+    assert envio.maximo_em_andamento > 2
+
+def test_fila_recua_com_falhas_temporarias():
+    """Testa que falhas temporárias derrubam os envios simultâneos ao mínimo."""
+    metricas = Metricas()
+    limitador = LimiteAdaptativo(inicial=4, maximo=4, amostras=2, recuo=0.5, metricas=metricas)
+    envio = EnvioSimultaneo(0.005, temporario=True)
+    fila = FilaPrioridade(enviar=envio, workers=4, limitador=limitador, metricas=metricas)
+    for futuro in [fila.submeter({"id": str(i)}, "alta") for i in range(20)]:
+        futuro.result(timeout=10)
+    assert limitador.limite == 1
+
+    envio.maximo_em_andamento = 0
+    for futuro in [fila.submeter({"id": str(i)}, "alta") for i in range(10)]:
+        futuro.result(timeout=10)
+    fila.parar(timeout=1)
+    assert envio.maximo_em_andamento == 1
+
+def test_resposta_4xx_e_temporaria(mock_env_variables, monkeypatch):
+    monkeypatch.setenv("EMAIL_TRANSPORTE", "nulo")
+    falha = enviar_email("a@example.com", "Teste", "<p>Corpo</p>",
+                         transporte=TransporteNulo(taxa_erro=1, metricas=Metricas()))
+    sucesso = enviar_email("a@example.com", "Teste", "<p>Corpo</p>",
+                           transporte=TransporteNulo(metricas=Metricas()))
+
+    assert falha["sucesso"] is False and falha["temporario"] is True
+    assert "temporario" not in sucesso
@@ -0,0 +1,103 @@
+import io
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from services.anexos import ArmazemAnexos
+from services.dkim import AssinadorDKIM, carregar_chave, registro_dns
+from services.email_service import enviar_email, validar_configuracoes
+
+def gravar_chave(caminho, tipo):
+    chave = (rsa.generate_private_key(public_exponent=65537, key_size=2048)
+             if tipo == "rsa" else ed25519.Ed25519PrivateKey.generate())
+    caminho.write_bytes(chave.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption()))
+    return str(caminho)
+
+@pytest.fixture(params=["rsa", "ed25519"])
+def chave_dkim(request, tmp_path, mock_env_variables, monkeypatch):
+    """Fixture que configura o envio com DKIM e retorna o caminho da chave."""
+    caminho = gravar_chave(tmp_path / f"{request.param}.pem", request.param)
+    monkeypatch.setenv("DKIM_DOMINIO", "example.com")
+    monkeypatch.setenv("DKIM_SELETOR", "s1")
+    monkeypatch.setenv("DKIM_CHAVE", caminho)
+    return caminho
+
+def verificar(mensagem, caminho_chave):
+    dkim = pytest.importorskip("dkim")
+    if "ed25519" in caminho_chave:
+        pytest.importorskip("nacl")
+    return dkim.verify(mensagem, dnsfunc=lambda nome, timeout=5: registro_dns(caminho_chave).encode())
+
+def test_validar_configuracoes_dkim_incompleto(mock_env_variables, monkeypatch):
+    """Testa que DKIM_DOMINIO exige seletor e chave."""
+    monkeypatch.setenv("DKIM_DOMINIO", "example.com")
+    monkeypatch.delenv("DKIM_SELETOR", raising=False)
+
+    with pytest.raises(ValueError) as excinfo:
+        validar_configuracoes()
+    assert "DKIM_SELETOR" in str(excinfo.value)
+
+def test_chave_carregada_uma_vez(tmp_path):
+    """Testa que a chave é interpretada uma vez e relida só quando o arquivo muda."""
+    caminho = gravar_chave(tmp_path / "chave.pem", "ed25519")
+    assert carregar_chave(caminho) is carregar_chave(caminho)
+
+def test_assinatura_valida(mock_smtp, chave_dkim):
+    """Testa que a mensagem enviada tem assinatura DKIM válida."""
+    resultado = enviar_email("destinatario@example.org", "Olá  mundo", "<p>Corpo   do email</p>\n\n")
+    assert resultado["sucesso"] is True
+
+    mensagem = mock_smtp.return_value.sendmail.call_args[0][2]
+    assert mensagem.startswith(b"DKIM-Signature: v=1;")
+    assert verificar(mensagem, chave_dkim)
+
+def test_assinatura_valida_com_anexo(mock_smtp, chave_dkim, tmp_path):
+    """Testa a assinatura de uma mensagem com anexo transmitida em segmentos."""
+    smtp_instance = mock_smtp.return_value
+    smtp_instance.mail.return_value = (250, b'OK')
+    smtp_instance.rcpt.return_value = (250, b'OK')
+    smtp_instance.getreply.side_effect = [(354, b'Go'), (250, b'OK')]
+    enviados = []
+    smtp_instance.sock.sendall.side_effect = lambda dados: enviados.append(bytes(dados))
+    armazem = ArmazemAnexos(str(tmp_path / "anexos"))
+    hash_ = armazem.salvar(io.BytesIO(bytes(range(256)) * 1000))
+
+    resultado = enviar_email("destinatario@example.org", "Fatura", "<p>Segue</p>",
+                             anexos=armazem.resolver([{"hash": hash_, "nome": "fatura.pdf"}]))
+    assert resultado["sucesso"] is True
+
+    # Remover o terminador do DATA para obter a mensagem transmitida
+    mensagem = b"".join(enviados)[:-len(b".\r\n")]
+    assert verificar(mensagem, chave_dkim)
+
+def test_hash_do_corpo_reaproveitado(mock_smtp, chave_dkim, monkeypatch):
+    """Testa que o corpo é canonicalizado uma vez para vários destinatários."""
+    from services import dkim
+    canonicalizacoes = []
+    original = dkim._CorpoRelaxed.resumo
+    monkeypatch.setattr(dkim._CorpoRelaxed, "resumo",
+                        lambda self: canonicalizacoes.append(1) or original(self))
+    corpo = f"<p>Newsletter {chave_dkim}</p>"
+
+    for destinatario in ("a@example.org", "b@example.org", "c@example.org"):
+        assert enviar_email(destinatario, "Newsletter", corpo)["sucesso"] is True
+
+    assert len(canonicalizacoes) == 1
+    mensagens = [chamada[0][2] for chamada in mock_smtp.return_value.sendmail.call_args_list]
+    assert all(verificar(mensagem, chave_dkim) for mensagem in mensagens)
+
+def test_assinador_canonicalizacao_relaxed(tmp_path):
+    """Testa que espaços e linhas vazias finais não alteram o hash do corpo."""
+    assinador = AssinadorDKIM("example.com", "s1", gravar_chave(tmp_path / "c.pem", "ed25519"))
+
+    assert assinador.hash_corpo([b"linha  com \t espacos  \r\n\r\n\r\n"]) == \
+        assinador.hash_corpo([b"linha com espacos\r\n"])
+    assert assinador.hash_corpo([b"lin", b"ha\r\n"]) == assinador.hash_corpo([b"linha\r\n"])
+
+def test_cryptography_so_carregado_com_dkim():
+    """Testa que importar o serviço de email não carrega o cryptography."""
+    import subprocess
+    import sys
+    codigo = "import sys, services.email_service; print('cryptography' in sys.modules)"
+    saida = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, check=True)
+    assert saida.stdout.strip() == "False"
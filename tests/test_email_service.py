@@ -1,7 +1,7 @@
 import pytest
 from unittest.mock import patch, MagicMock
 import smtplib
-from services.email_service import enviar_email, validar_configuracoes
+from services.email_service import enviar_email, validar_configuracoes, PoolSMTP
 
 def test_validar_configuracoes(mock_env_variables):
     """Testa a função validar_configuracoes com variáveis de ambiente válidas."""
@@ -174,6 +174,24 @@ def test_enviar_email_problemas_destinatarios(mock_smtp, mock_env_variables):
     assert resultado["sucesso"] is False
     assert "problemas" in resultado["mensagem"].lower()
     assert resultado["detalhes"] is not None
+    assert resultado["devolvido"] is True
+
+def test_enviar_email_destinatario_recusado(mock_smtp, mock_env_variables):
+    """Testa que a recusa do destinatário pelo servidor é marcada como devolução."""
+    smtp_instance = mock_smtp.return_value
+    smtp_instance.sendmail.side_effect = smtplib.SMTPRecipientsRefused(
+        {"test@example.com": (550, b"Mailbox not found")}
+    )
+    
+    resultado = enviar_email(
+        destinatario="test@example.com",
+        assunto="Teste",
+        corpo="<p>Corpo do email</p>"
+    )
+    
+    assert resultado["sucesso"] is False
+    assert resultado["devolvido"] is True
+    assert "recusado" in resultado["mensagem"].lower()
 
 def test_enviar_email_falha_tls(mock_smtp, mock_env_variables):
     """Testa enviar_email com falha ao iniciar TLS."""
@@ -188,4 +206,56 @@ def test_enviar_email_falha_tls(mock_smtp, mock_env_variables):
     )
     
     assert resultado["sucesso"] is False
-    assert "tls" in resultado["mensagem"].lower() or "erro smtp" in resultado["mensagem"].lower()
\ No newline at end of file
+    assert "tls" in resultado["mensagem"].lower() or "erro smtp" in resultado["mensagem"].lower()
+
+def test_enviar_email_reutiliza_conexao_do_pool(mock_smtp, mock_env_variables):
+    """Testa que envios com pool reutilizam a conexão autenticada."""
+    pool = PoolSMTP(tamanho=2)
+    for _ in range(3):
+        resultado = enviar_email("test@example.com", "Teste", "<p>Corpo</p>", pool=pool)
+        assert resultado["sucesso"] is True
+
+    assert mock_smtp.call_count == 1
+    assert mock_smtp.return_value.login.call_count == 1
+    assert mock_smtp.return_value.sendmail.call_count == 3
+    assert len(pool) == 1
+    pool.fechar()
+    assert len(pool) == 0
+
+def test_enviar_email_pool_reconecta_apos_desconexao(mock_smtp, mock_env_variables):
+    """Testa que uma conexão ociosa derrubada pelo servidor é refeita uma vez."""
+    pool = PoolSMTP(tamanho=2)
+    enviar_email("test@example.com", "Teste", "<p>Corpo</p>", pool=pool)
+    mock_smtp.return_value.sendmail.side_effect = [smtplib.SMTPServerDisconnected("ocioso"), {}]
+
+    resultado = enviar_email("test@example.com", "Teste", "<p>Corpo</p>", pool=pool)
+
+    assert resultado["sucesso"] is True
+    assert mock_smtp.call_count == 2
+    pool.fechar()
+
+def test_pool_fechado_encerra_conexao_devolvida(mock_smtp, mock_env_variables):
+    """Testa que um envio que termina depois de fechar() encerra a própria conexão."""
+    config = validar_configuracoes()
+    pool = PoolSMTP(tamanho=2)
+    servidor, _ = pool.obter(config)
+
+    pool.fechar()
+    pool.devolver(servidor, config)
+
+    servidor.quit.assert_called_once()
+    assert len(pool) == 0
+
+def test_enviar_email_com_texto_alternativo(mock_smtp, mock_env_variables):
+    """Testa que a mensagem leva as versões texto e HTML em multipart/alternative."""
+    import email
+    resultado = enviar_email("test@example.com", "Teste", "<h1>Olá</h1><p>Corpo<br>do email</p>")
+    assert resultado["sucesso"] is True
+
+    texto = mock_smtp.return_value.sendmail.call_args[0][2]
+    mensagem = email.message_from_string(texto)
+    assert mensagem.get_content_type() == "multipart/alternative"
+    plano, html = mensagem.get_payload()
+    assert plano.get_content_type() == "text/plain"
+    assert plano.get_payload(decode=True).decode("utf-8") == "Olá\n\nCorpo\ndo email\n"
+    assert html.get_content_type() == "text/html"
@@ -0,0 +1,84 @@
+import io
+import json
+import pytest
+from services.envio_massa import EnvioMassa, Modelo, Painel, Progresso, ler_registros, main
+
+CSV = "email,nome\na@example.com,Ana\nb@example.com,Bruno <b>\ninvalido,Carla\nd@example.com,Davi\n"
+
+@pytest.fixture
+def entrada(tmp_path):
+    caminho = tmp_path / "campanha.csv"
+    caminho.write_text(CSV, encoding="utf-8")
+    return caminho
+
+def destinatarios_enviados(mock_smtp):
+    return [chamada.args[1] for chamada in mock_smtp.return_value.sendmail.call_args_list]
+
+def test_ler_registros_ndjson():
+    entrada = io.StringIO('{"email": "a@example.com"}\n\nnão é json\n{"email": "b@example.com"}\n')
+    assert list(ler_registros(entrada, "ndjson")) == [
+        (1, {"email": "a@example.com"}), (2, {}), (3, {"email": "b@example.com"})
+    ]
+
+def test_modelo_escapa_html_so_no_corpo():
+    modelo = Modelo("Olá, $nome", "<p>Olá, ${nome}</p>")
+    assert modelo.renderizar({"nome": "<Ana>"}) == ("Olá, <Ana>", "<p>Olá, &lt;Ana&gt;</p>")
+    with pytest.raises(ValueError, match="nome"):
+        modelo.renderizar({})
+
+def test_progresso_marca_dagua(tmp_path):
+    progresso = Progresso(str(tmp_path / "progresso"))
+    for numero in (2, 3, 1, 5):
+        progresso.concluir(numero)
+    assert progresso.marca == 3
+    progresso.gravar()
+    assert Progresso(str(tmp_path / "progresso")).marca == 3
+
+def test_envio_com_progresso_e_falhas(entrada, tmp_path, mock_smtp, mock_env_variables):
+    falhas = io.StringIO()
+    envio = EnvioMassa(Modelo("Olá, $nome", "<p>$nome</p>"), workers=2, falhas=falhas,
+                       painel=Painel(io.StringIO()))
+    progresso = Progresso(str(tmp_path / "progresso"))
+
+    with open(entrada, newline="", encoding="utf-8") as arquivo:
+        contagens = envio.executar(ler_registros(arquivo, "csv"), progresso)
+
+    assert contagens["enviados"] == 3
+    assert contagens["invalidos"] == 1
+    assert sorted(destinatarios_enviados(mock_smtp)) == ["a@example.com", "b@example.com", "d@example.com"]
+    assert json.loads(falhas.getvalue())["registro"] == 3
+    assert Progresso(str(tmp_path / "progresso")).marca == 4
+    # Uma conexão por worker, reutilizada entre as mensagens
+    assert mock_smtp.call_count <= 2
+
+def test_retoma_a_partir_do_progresso(entrada, tmp_path, mock_smtp, mock_env_variables):
+    progresso = Progresso(str(tmp_path / "progresso"))
+    progresso.concluir(1)
+    progresso.concluir(2)
+    envio = EnvioMassa(Modelo("Oi", "<p>$nome</p>"), painel=Painel(io.StringIO()))
+
+    with open(entrada, newline="", encoding="utf-8") as arquivo:
+        envio.executar(ler_registros(arquivo, "csv"), progresso)
+
+    assert destinatarios_enviados(mock_smtp) == ["d@example.com"]
+
+def test_respeita_lista_de_supressao(entrada, tmp_path, mock_smtp, mock_env_variables):
+    from services.supressao import ListaSupressao
+    lista = ListaSupressao(str(tmp_path / "supressao.idx"))
+    lista.adicionar("A@example.com")
+    envio = EnvioMassa(Modelo("Oi", "<p>$nome</p>"), supressao=lista, painel=Painel(io.StringIO()))
+
+    with open(entrada, newline="", encoding="utf-8") as arquivo:
+        contagens = envio.executar(ler_registros(arquivo, "csv"))
+
+    assert contagens["suprimidos"] == 1
+    assert "a@example.com" not in destinatarios_enviados(mock_smtp)
+
+def test_simular_nao_envia(entrada, mock_smtp, capsys):
+    codigo = main([str(entrada), "--assunto", "Olá, $nome", "--corpo", "<p>$nome</p>", "--simular",
+                   "--supressao", ""])
+
+    assert codigo == 1  # um registro inválido
+    assert "3 validos" in capsys.readouterr().err
+    mock_smtp.assert_not_called()
+    assert not (entrada.parent / "campanha.csv.progresso").exists()
@@ -0,0 +1,50 @@
+import pytest
+from services.esquema import Campo, Esquema, criar_esquema_envio
+
+@pytest.fixture
+def esquema_envio():
+    """Esquema de envio com validação de email simplificada e sanitização fictícia."""
+    return criar_esquema_envio(
+        validar_email=lambda email: "@" in email,
+        sanitizador=lambda texto: texto.replace("<b>", "").replace("</b>", ""),
+    )
+
+def test_payload_valido(esquema_envio):
+    """Testa que um payload válido passa sem erros e é sanitizado no próprio dicionário."""
+    dados = {"destinatario": "a@b.com", "assunto": "<b>Oi</b>", "corpo": "<b>Corpo</b>"}
+
+    resultado, erros = esquema_envio.validar(dados)
+
+    assert erros == []
+    assert resultado is dados
+    assert dados["assunto"] == "Oi"
+    # O corpo é HTML e não é sanitizado
+    assert dados["corpo"] == "<b>Corpo</b>"
+
+def test_coleta_todos_os_erros(esquema_envio):
+    """Testa que todos os erros são coletados em uma única passagem."""
+    _, erros = esquema_envio.validar({"destinatario": "invalido", "corpo": "A" * 50001})
+
+    assert "Email do destinatário inválido" in erros
+    assert "Campo obrigatório ausente: assunto" in erros
+    assert "Corpo do email muito longo" in erros
+
+def test_tipo_invalido(esquema_envio):
+    """Testa que um valor de tipo errado gera erro em vez de exceção."""
+    _, erros = esquema_envio.validar({"destinatario": "a@b.com", "assunto": 123, "corpo": "x"})
+
+    assert erros == ["Campo assunto deve ser do tipo texto"]
+
+def test_campo_numerico_rejeita_booleano():
+    """Testa que booleanos não são aceitos em campos numéricos."""
+    esquema = Esquema("Teste", {"quantidade": Campo(tipo=int)})
+
+    assert esquema.validar({"quantidade": 3})[1] == []
+    assert esquema.validar({"quantidade": True})[1] != []
+
+def test_para_swagger(esquema_envio):
+    """Testa a definição Swagger gerada a partir do esquema."""
+    definicao = esquema_envio.para_swagger()
+
+    assert definicao["required"] == ["destinatario", "assunto", "corpo"]
+    assert definicao["properties"]["assunto"]["maxLength"] == 200
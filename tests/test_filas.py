@@ -0,0 +1,173 @@
+import threading
+import time
+import pytest
+from services.filas import Faixa, FilaEncerrada, FilaPrioridade, faixas_padrao
+
+class EnvioControlado:
+    """Envio fictício que registra a ordem e só termina quando liberado."""
+
+    def __init__(self):
+        self.ordem = []
+        self.liberar = threading.Event()
+        self.em_andamento = 0
+        self.maximo_em_andamento = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, dados):
+        with self._lock:
+            self.ordem.append(dados["id"])
+            self.em_andamento += 1
+            self.maximo_em_andamento = max(self.maximo_em_andamento, self.em_andamento)
+        self.liberar.wait(timeout=5)
+        with self._lock:
+            self.em_andamento -= 1
+        return {"sucesso": True}
+
+@pytest.fixture
+def envio():
+    return EnvioControlado()
+
+def criar_fila(envio, metricas, workers=1, taxa_baixa=None):
+    return FilaPrioridade(
+        enviar=envio,
+        faixas=[Faixa("alta", 1.0), Faixa("normal", 0.75), Faixa("baixa", 0.5, taxa=taxa_baixa)],
+        workers=workers,
+        metricas=metricas,
+    )
+
+def test_alta_passa_a_frente(envio, metricas):
+    """Testa que uma mensagem de alta prioridade passa à frente das já enfileiradas."""
+    fila = criar_fila(envio, metricas)
+    try:
+        futuros = [fila.submeter({"id": "ocupando"}, "baixa")]
+        while not envio.ordem:
+            time.sleep(0.01)
+        futuros += [fila.submeter({"id": f"campanha-{i}"}, "baixa") for i in range(3)]
+        futuros.append(fila.submeter({"id": "senha"}, "alta"))
+        envio.liberar.set()
+        for futuro in futuros:
+            assert futuro.result(timeout=5) == {"sucesso": True}
+        assert envio.ordem[:2] == ["ocupando", "senha"]
+    finally:
+        fila.parar(timeout=1)
+
+def test_teto_de_envios_simultaneos_por_faixa(envio, metricas):
+    """Testa que a faixa baixa não ocupa mais que sua parcela dos workers."""
+    fila = criar_fila(envio, metricas, workers=4)
+    try:
+        futuros = [fila.submeter({"id": i}, "baixa") for i in range(6)]
+        time.sleep(0.2)
+        assert envio.em_andamento == 2
+        # Uma mensagem de alta prioridade ainda encontra worker livre
+        urgente = fila.submeter({"id": "urgente"}, "alta")
+        time.sleep(0.2)
+        assert "urgente" in envio.ordem
+        envio.liberar.set()
+        for futuro in futuros + [urgente]:
+            futuro.result(timeout=5)
+        assert envio.maximo_em_andamento == 3
+    finally:
+        fila.parar(timeout=1)
+
+def test_orcamento_de_taxa(envio, metricas):
+    """Testa que a faixa com taxa limitada respeita o balde de fichas."""
+    envio.liberar.set()
+    fila = criar_fila(envio, metricas, workers=2, taxa_baixa=10)
+    try:
+        inicio = time.monotonic()
+        futuros = [fila.submeter({"id": i}, "baixa") for i in range(4)]
+        for futuro in futuros:
+            futuro.result(timeout=5)
+        # A primeira sai na hora; as outras três a cada 0,1 s
+        assert time.monotonic() - inicio >= 0.25
+    finally:
+        fila.parar(timeout=1)
+
+def test_faixas_padrao_usadas_pela_aplicacao():
+    """Testa que a aplicação usa a tabela única de faixas, com a taxa da faixa baixa configurada."""
+    import app as app_module
+    faixas = faixas_padrao(taxa_baixa=2.0)
+    assert [(f.nome, f.parcela, f.taxa) for f in faixas] == [("alta", 1.0, None), ("normal", 0.75, None),
+                                                             ("baixa", 0.5, 2.0)]
+    assert [(f.nome, f.parcela) for f in app_module.FILA_ENVIO.faixas] == [(f.nome, f.parcela) for f in faixas]
+    assert app_module.FILA_ENVIO.por_nome["baixa"].taxa == app_module.FILA_TAXA_BAIXA
+
+def test_prioridade_desconhecida(envio, metricas):
+    """Testa que uma faixa inexistente é rejeitada."""
+    fila = criar_fila(envio, metricas)
+    with pytest.raises(ValueError):
+        fila.submeter({"id": 1}, "urgentissima")
+
+def test_metricas_por_faixa(envio, metricas):
+    """Testa o registro de contadores e latências por faixa."""
+    envio.liberar.set()
+    fila = criar_fila(envio, metricas)
+    try:
+        fila.submeter({"id": 1}).result(timeout=5)
+    finally:
+        fila.parar(timeout=1)
+
+    instantaneo = metricas.instantaneo()
+    contadores = {(c["nome"], c["rotulos"]["faixa"]): c["valor"] for c in instantaneo["contadores"]}
+    assert contadores[("envios_sucesso", "normal")] == 1
+    histogramas = {h["nome"]: h for h in instantaneo["histogramas"]}
+    assert histogramas["latencia_total_segundos"]["contagem"] == 1
+    assert histogramas["latencia_total_segundos"]["p99"] is not None
+
+def test_drenar_envia_fila_dentro_do_prazo(envio, metricas):
+    """Testa que a drenagem espera a fila esvaziar e depois recusa novas mensagens."""
+    fila = criar_fila(envio, metricas, workers=2)
+    futuros = [fila.submeter({"id": str(i)}) for i in range(4)]
+    envio.liberar.set()
+
+    assert fila.drenar(prazo=5) == []
+    assert all(futuro.result(timeout=0) == {"sucesso": True} for futuro in futuros)
+    with pytest.raises(FilaEncerrada):
+        fila.submeter({"id": "tarde"})
+
+def test_drenar_devolve_o_que_sobrou_no_prazo(envio, metricas):
+    """Testa que as mensagens não enviadas no prazo são devolvidas, sem resultado."""
+    fila = criar_fila(envio, metricas)
+    futuros = [fila.submeter({"id": str(i)}) for i in range(3)]
+    while not envio.ordem:
+        time.sleep(0.01)
+
+    restantes = fila.drenar(prazo=0.1)
+    envio.liberar.set()
+
+    assert [tarefa.dados["id"] for tarefa in restantes] == ["1", "2"]
+    assert not futuros[1].done() and not futuros[2].done()
+    assert fila.tamanho() == 0
+
+
+def test_acima_do_limite_de_memoria_vai_para_o_disco(envio, metricas, medidor, tmp_path):
+    """Testa que as mensagens além do limite esperam em disco sem perder a ordem."""
+    from services.memoria import DepositoDisco
+    deposito = DepositoDisco(str(tmp_path / "fila.db"))
+    fila = FilaPrioridade(enviar=envio, workers=1, limite_memoria=1000, deposito=deposito, metricas=metricas)
+    futuros = [fila.submeter({"id": str(i), "corpo": "x" * 400}) for i in range(6)]
+
+    # Cada mensagem estima 600 bytes: só uma cabe na memória, as demais vão para o disco
+    assert len(deposito) >= 4
+    assert medidor("fila_memoria_bytes") <= 1000
+    envio.liberar.set()
+    assert [futuro.result(timeout=5) for futuro in futuros] == [{"sucesso": True}] * 6
+    assert envio.ordem == [str(i) for i in range(6)]
+    assert len(deposito) == 0
+    fila.parar(timeout=1)
+
+def test_drenar_devolve_mensagens_do_disco(envio, metricas, tmp_path):
+    """Testa que as tarefas em disco voltam com os dados na drenagem."""
+    from services.memoria import DepositoDisco
+    deposito = DepositoDisco(str(tmp_path / "fila.db"))
+    fila = FilaPrioridade(enviar=envio, workers=1, limite_memoria=1, deposito=deposito, metricas=metricas)
+    fila.submeter({"id": "0"})
+    while not envio.ordem:
+        time.sleep(0.01)
+    fila.submeter({"id": "1", "corpo": "<p>Olá</p>"})
+
+    restantes = fila.drenar(prazo=0.1)
+    envio.liberar.set()
+
+    assert [tarefa.dados for tarefa in restantes] == [{"id": "1", "corpo": "<p>Olá</p>"}]
+    assert not (tmp_path / "fila.db").exists()
@@ -0,0 +1,74 @@
+import gc
+import os
+import pickle
+import tracemalloc
+from services.memoria import (DepositoDisco, RastreadorMemoria, atualizar_metricas, compartilhar_corpo,
+                              rss_atual_bytes, rss_pico_bytes)
+from services.mensagens import Mensagem
+from services.metricas import Metricas
+
+def test_rss_e_metricas():
+    assert rss_atual_bytes() > 1024 * 1024 and rss_pico_bytes() > 1024 * 1024
+    metricas = Metricas()
+    atualizar_metricas(metricas)
+    nomes = {m["nome"] for m in metricas.instantaneo()["medidores"]}
+    assert {"memoria_rss_bytes", "memoria_rss_pico_bytes", "memoria_corpos_compartilhados"} <= nomes
+
+def test_corpo_compartilhado_e_liberado():
+    texto = "<p>" + "campanha " * 100 + "</p>"
+    a = Mensagem("m1", "a@x.com", "Oi", texto)
+    b = Mensagem("m2", "b@x.com", "Oi", "".join(["<p>", "campanha " * 100, "</p>"]))
+
+    assert a._corpo is b._corpo and a.corpo is texto
+    referencia = a._corpo
+    del a, b, referencia
+    gc.collect()
+    assert compartilhar_corpo(texto).texto is texto
+
+def test_mensagem_compacta():
+    mensagem = Mensagem("m1", "a@x.com", "Oi", "<p>Olá</p>", chave="k1", prioridade="alta")
+
+    assert not hasattr(mensagem, "__dict__")
+    assert Mensagem.de_dict(mensagem.para_dict()).para_dict() == mensagem.para_dict()
+    # Ao voltar do disco, o corpo volta a ser compartilhado
+    copia = pickle.loads(pickle.dumps(mensagem))
+    assert copia._corpo is mensagem._corpo
+    assert copia.chave == "k1" and copia.prioridade == "alta"
+
+def test_deposito_em_disco(tmp_path):
+    deposito = DepositoDisco(str(tmp_path / "deposito.db"))
+    ids = [deposito.guardar({"id": i}) for i in range(3)]
+    assert len(deposito) == 3
+    assert deposito.retirar(ids[1]) == {"id": 1}
+    assert len(deposito) == 2
+
+    deposito.fechar()
+    assert not os.path.exists(tmp_path / "deposito.db")
+
+def test_rastreador_inativo_nao_mede():
+    rastreador = RastreadorMemoria(ativo=False, metricas=Metricas())
+    with rastreador.etapa("validar"):
+        pass
+    relatorio = rastreador.relatorio()
+    assert relatorio["rastreamento"] is False and "etapas" not in relatorio
+    assert relatorio["rss_pico_bytes"] > 0
+
+def test_rastreador_amostra_alocacoes_da_etapa():
+    ja_rastreando = tracemalloc.is_tracing()
+    metricas = Metricas()
+    rastreador = RastreadorMemoria(ativo=True, amostragem=1, metricas=metricas)
+    try:
+        with rastreador.etapa("montar"):
+            retido = [bytearray(1024) for _ in range(200)]
+        relatorio = rastreador.relatorio()
+    finally:
+        if not ja_rastreando:
+            tracemalloc.stop()
+
+    etapa = relatorio["etapas"]["montar"]
+    assert etapa["pico_bytes"] >= 200 * 1024
+    assert etapa["alocacoes"][0]["bytes"] >= 200 * 1024
+    assert "test_memoria.py" in etapa["alocacoes"][0]["local"]
+    histogramas = {h["nome"]: h for h in metricas.instantaneo()["histogramas"]}
+    assert histogramas["memoria_etapa_bytes"]["contagem"] == 1
+    del retido
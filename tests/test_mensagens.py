@@ -0,0 +1,125 @@
+import time
+import pytest
+from services.mensagens import (RegistroMensagens, codificar_cursor, decodificar_cursor,
+                                ENFILEIRADO, ENVIADO, FALHOU)
+from services.metricas import Metricas
+
+@pytest.fixture
+def historico(tmp_path):
+    historico = RegistroMensagens(str(tmp_path / "mensagens.db"), intervalo=0.05, metricas=Metricas())
+    yield historico
+    historico.parar(timeout=1)
+
+def test_registrar_e_consultar(historico):
+    historico.registrar("m1", ENFILEIRADO, chave="k1", destinatario="a@x.com", assunto="Olá")
+    historico.registrar("m1", ENVIADO, chave="k1", destinatario="a@x.com", detalhe="ok")
+    assert historico.gravar() == 2
+
+    registro = historico.consultar("m1")
+    assert registro["status"] == ENVIADO
+    assert registro["assunto"] == "Olá"
+    assert registro["detalhe"] == "ok"
+    assert registro["atualizado_em"] >= registro["criado_em"]
+
+def test_consultar_restrito_a_chave(historico):
+    historico.registrar("m1", ENVIADO, chave="k1", destinatario="a@x.com")
+    historico.gravar()
+
+    assert historico.consultar("m1", chave="k1") is not None
+    assert historico.consultar("m1", chave="k2") is None
+    assert historico.consultar("inexistente") is None
+
+def test_status_mais_recente_prevalece(historico):
+    historico.registrar("m1", ENVIADO, chave="k1", destinatario="a@x.com")
+    historico.gravar()
+    # Registro mais antigo chegando depois (outro worker) não sobrescreve o status
+    historico._pendentes.append(("m1", "k1", "a@x.com", "Assunto", ENFILEIRADO, None, 1.0, 1.0))
+    historico.gravar()
+
+    registro = historico.consultar("m1")
+    assert registro["status"] == ENVIADO
+    assert registro["assunto"] == "Assunto"
+    assert registro["criado_em"] == 1.0
+
+def test_gravacao_em_lote_pela_thread(historico):
+    for i in range(10):
+        historico.registrar(f"m{i}", ENVIADO, chave="k1", destinatario="a@x.com")
+    limite = time.monotonic() + 5
+    while historico.consultar("m9") is None and time.monotonic() < limite:
+        time.sleep(0.02)
+
+    itens, _ = historico.buscar(chave="k1")
+    assert len(itens) == 10
+
+def test_buscar_com_filtros(historico):
+    historico.registrar("m1", ENVIADO, chave="k1", destinatario="A@X.com")
+    historico.registrar("m2", FALHOU, chave="k1", destinatario="b@x.com")
+    historico.registrar("m3", ENVIADO, chave="k2", destinatario="a@x.com")
+    historico.gravar()
+
+    itens, cursor = historico.buscar(chave="k1", destinatario="a@x.com")
+    assert [item["id"] for item in itens] == ["m1"]
+    assert cursor is None
+    itens, _ = historico.buscar(chave="k1", status=FALHOU)
+    assert [item["id"] for item in itens] == ["m2"]
+    itens, _ = historico.buscar(chave="k1", desde=time.time() + 60)
+    assert itens == []
+
+def test_paginacao_por_cursor(historico):
+    for i in range(25):
+        historico._pendentes.append((f"m{i:02d}", "k1", "a@x.com", None, ENVIADO, None,
+                                     1000.0 + i // 2, 1000.0 + i // 2))
+    historico.gravar()
+
+    vistos, cursor = [], None
+    while True:
+        itens, cursor = historico.buscar(chave="k1", limite=10, cursor=cursor)
+        vistos.extend(item["id"] for item in itens)
+        if cursor is None:
+            break
+    # Sem repetições nem lacunas, mesmo com datas de criação iguais
+    assert vistos == [f"m{i:02d}" for i in reversed(range(25))]
+
+def test_cursor_invalido(historico):
+    assert decodificar_cursor(codificar_cursor(12.5, "abc")) == (12.5, "abc")
+    with pytest.raises(ValueError):
+        historico.buscar(cursor="!!!")
+
+def test_busca_usa_indices(historico):
+    historico.registrar("m1", ENVIADO, chave="k1", destinatario="a@x.com")
+    historico.gravar()
+    consultas = [
+        ("destinatario = ?", ("a@x.com",)),
+        ("chave = ?", ("k1",)),
+        ("chave = ? AND status = ?", ("k1", ENVIADO)),
+    ]
+    for condicao, parametros in consultas:
+        plano = historico._consultar(
+            f"EXPLAIN QUERY PLAN SELECT id FROM mensagens WHERE {condicao} ORDER BY criado_em DESC",
+            parametros,
+        )
+        detalhes = " ".join(linha[-1] for linha in plano)
+        assert "USING INDEX" in detalhes and "SCAN mensagens" not in detalhes.replace("USING INDEX", "")
+
+def test_limpar_antigas(historico):
+    historico._pendentes.extend([
+        ("antiga", "k1", "a@x.com", None, ENVIADO, None, 1000.0, 1000.0),
+        ("recente", "k1", "a@x.com", None, ENVIADO, None, time.time(), time.time()),
+    ])
+    historico.gravar()
+
+    assert historico.limpar_antigas(lote=1) == 1
+    assert historico.consultar("antiga") is None
+    assert historico.consultar("recente") is not None
+
+def test_capacidade_descarta_registros(tmp_path):
+    metricas = Metricas()
+    historico = RegistroMensagens(str(tmp_path / "mensagens.db"), intervalo=60, capacidade=2,
+                                  tamanho_lote=100, metricas=metricas)
+    try:
+        aceitos = [historico.registrar(f"m{i}", ENVIADO) for i in range(3)]
+    finally:
+        historico.parar(timeout=1)
+
+    assert aceitos == [True, True, False]
+    assert historico.consultar("m1") is not None
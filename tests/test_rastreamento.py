@@ -0,0 +1,160 @@
+import json
+import logging
+import threading
+import pytest
+from services.filas import FilaPrioridade
+from services.mensagens import Mensagem
+from services.metricas import Metricas
+from services.rastreamento import (
+    ID_REQUISICAO, SPAN_NULO, Rastreador, ler_traceparent, propagar, rastrear, span_atual
+)
+
+@pytest.fixture
+def rastreador(tmp_path):
+    rastreador = Rastreador(str(tmp_path / "spans.jsonl"), semente=1, metricas=Metricas())
+    yield rastreador
+    rastreador.parar(timeout=1)
+
+def ler_spans(rastreador):
+    rastreador.parar(timeout=1)
+    spans = []
+    with open(rastreador.arquivo, "rb") as arquivo:
+        for linha in arquivo:
+            recurso = json.loads(linha)["resourceSpans"][0]
+            assert recurso["resource"]["attributes"][0] == {"key": "service.name",
+                                                            "value": {"stringValue": "email-service"}}
+            spans.extend(recurso["scopeSpans"][0]["spans"])
+    return {span["name"]: span for span in spans}
+
+def atributos(span):
+    return {item["key"]: item["value"] for item in span["attributes"]}
+
+def test_desligado_nao_registra_nada(tmp_path):
+    rastreador = Rastreador(None)
+    with rastreador.span("raiz") as span:
+        assert span is SPAN_NULO
+        with rastrear("filho") as filho:
+            filho.definir("chave", "valor")
+            assert filho is SPAN_NULO
+    assert rastreador.iniciar_span("raiz") is SPAN_NULO
+    assert span_atual() is SPAN_NULO
+    rastreador.parar()
+
+def test_spans_aninhados_em_otlp(rastreador):
+    with rastreador.span("raiz", {"request.id": "abc"}) as raiz:
+        with rastrear("filho", {"tentativa": 2, "reutilizada": True, "segundos": 0.5}):
+            pass
+        with pytest.raises(ValueError):
+            with rastrear("falha"):
+                raise ValueError("quebrou")
+    assert span_atual() is SPAN_NULO
+    spans = ler_spans(rastreador)
+
+    assert set(spans) == {"raiz", "filho", "falha"}
+    assert {span["traceId"] for span in spans.values()} == {raiz.id_trace}
+    assert "parentSpanId" not in spans["raiz"]
+    assert spans["filho"]["parentSpanId"] == spans["falha"]["parentSpanId"] == raiz.id_span
+    assert atributos(spans["filho"]) == {"tentativa": {"intValue": "2"}, "reutilizada": {"boolValue": True},
+                                         "segundos": {"doubleValue": 0.5}}
+    assert atributos(spans["raiz"]) == {"request.id": {"stringValue": "abc"}}
+    assert spans["falha"]["status"] == {"code": 2, "message": "quebrou"}
+    assert int(spans["filho"]["startTimeUnixNano"]) <= int(spans["filho"]["endTimeUnixNano"])
+
+def test_amostragem_vale_para_o_trace_inteiro(tmp_path):
+    rastreador = Rastreador(str(tmp_path / "spans.jsonl"), amostragem=0.3, semente=3, metricas=Metricas())
+    amostrados = 0
+    for _ in range(200):
+        with rastreador.span("raiz") as raiz:
+            with rastrear("filho") as filho:
+                assert (filho is not SPAN_NULO) == raiz.amostrado
+            amostrados += raiz.amostrado
+    assert 30 < amostrados < 90
+    rastreador.parar()
+    with open(rastreador.arquivo, "rb") as arquivo:
+        exportados = sum(len(json.loads(linha)["resourceSpans"][0]["scopeSpans"][0]["spans"]) for linha in arquivo)
+    assert exportados == 2 * amostrados
+    with pytest.raises(ValueError):
+        Rastreador("x", amostragem=2)
+
+def test_continua_traceparent_recebido(rastreador):
+    pai = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+    with rastreador.span("raiz", pai=pai) as raiz:
+        assert raiz.id_trace == "0af7651916cd43dd8448eb211c80319c"
+        assert raiz.id_pai == "b7ad6b7169203331"
+        assert ler_traceparent(raiz.traceparent) == (raiz.id_trace, raiz.id_span, True)
+    # Não amostrado na origem: também não é registrado aqui
+    with rastreador.span("outra", pai=pai[:-2] + "00") as span:
+        assert not span.amostrado
+    for invalido in ("", "lixo", "00-xyz-b7ad6b7169203331-01", "00-" + "0" * 32 + "-b7ad6b7169203331-01"):
+        assert ler_traceparent(invalido) is None
+
+def test_propagar_e_retomar(rastreador):
+    token = ID_REQUISICAO.set("req-1")
+    try:
+        with rastreador.span("raiz") as raiz:
+            rastro = propagar()
+    finally:
+        ID_REQUISICAO.reset(token)
+    assert rastro == f"req-1;{raiz.traceparent}"
+    assert propagar() is None
+
+    with rastreador.retomar(rastro):
+        assert ID_REQUISICAO.get() == "req-1"
+        with rastrear("envio"):
+            pass
+    assert ID_REQUISICAO.get() is None
+    spans = ler_spans(rastreador)
+    assert spans["envio"]["traceId"] == raiz.id_trace
+    assert spans["envio"]["parentSpanId"] == raiz.id_span
+
+def test_mensagem_guarda_o_rastro():
+    mensagem = Mensagem(id="1", destinatario="a@example.com", assunto="A", corpo="<p>B</p>", rastro="req;00-x")
+    assert Mensagem.de_dict(mensagem.para_dict()).rastro == "req;00-x"
+
+def test_fila_leva_o_contexto_ao_worker(rastreador):
+    vistos = []
+
+    def enviar(dados):
+        with rastrear("enviar"):
+            vistos.append((ID_REQUISICAO.get(), threading.current_thread().name))
+        return {"sucesso": True}
+
+    fila = FilaPrioridade(enviar=enviar, workers=1, metricas=Metricas())
+    token = ID_REQUISICAO.set("req-2")
+    try:
+        with rastreador.span("raiz") as raiz:
+            futuro = fila.submeter({"id": "1"})
+    finally:
+        ID_REQUISICAO.reset(token)
+    futuro.result(timeout=5)
+    fila.parar(timeout=1)
+
+    assert vistos == [("req-2", "fila-envio-0")]
+    spans = ler_spans(rastreador)
+    assert spans["fila.espera"]["parentSpanId"] == spans["enviar"]["parentSpanId"] == raiz.id_span
+    assert atributos(spans["fila.espera"]) == {"fila.faixa": {"stringValue": "normal"}}
+
+def test_api_rastreia_do_http_ao_smtp(client, valid_email_payload, email_validator_mock, mock_smtp,
+                                      rastreador, monkeypatch, caplog):
+    monkeypatch.setattr('app.RASTREADOR', rastreador)
+    with caplog.at_level(logging.INFO, logger="email-api"):
+        response = client.post('/api/enviar-email', data=json.dumps(valid_email_payload),
+                               content_type='application/json')
+    assert response.status_code == 200
+    id_requisicao = response.headers["X-Request-ID"]
+    # A linha de log do worker traz o ID da requisição que enfileirou
+    worker = [registro for registro in caplog.records
+              if registro.name == "email-api" and "enviado com sucesso" in registro.getMessage()]
+    assert worker and worker[0].request_id == id_requisicao
+    client.get('/health')  # Encerra o contexto da requisição anterior
+
+    spans = ler_spans(rastreador)
+    raiz = spans["POST /api/enviar-email"]
+    esperados = {"decodificar", "validar", "enfileirar", "fila.espera", "enviar", "entregar", "smtp.sendmail"}
+    assert esperados <= set(spans)
+    assert {spans[nome]["traceId"] for nome in esperados} == {raiz["traceId"]}
+    assert raiz["kind"] == 2
+    assert atributos(raiz)["request.id"] == {"stringValue": id_requisicao}
+    assert atributos(raiz)["http.status_code"] == {"intValue": "200"}
+    assert spans["smtp.sendmail"]["parentSpanId"] == spans["entregar"]["spanId"]
+    assert spans["entregar"]["parentSpanId"] == spans["enviar"]["spanId"]
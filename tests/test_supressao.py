@@ -0,0 +1,118 @@
+import os
+import threading
+import pytest
+from services.supressao import (
+    CAPACIDADE_MINIMA, ListaSupressao, hash_endereco, main
+)
+
+@pytest.fixture
+def lista(tmp_path):
+    return ListaSupressao(str(tmp_path / "supressao.idx"))
+
+def test_lista_inexistente(lista, tmp_path):
+    """Testa que consultar uma lista ainda não criada não cria arquivos."""
+    assert lista.contem("a@example.com") is False
+    assert len(lista) == 0
+    assert list(tmp_path.iterdir()) == []
+
+def test_adicionar_e_remover(lista):
+    """Testa adição, consulta normalizada e remoção de endereços."""
+    assert lista.adicionar("Fulano@Example.com") is True
+    assert lista.adicionar("fulano@example.com ") is False
+    assert lista.contem("FULANO@example.com") is True
+    assert lista.contem("outro@example.com") is False
+    assert len(lista) == 1
+
+    assert lista.remover("fulano@example.com") is True
+    assert lista.remover("fulano@example.com") is False
+    assert lista.contem("fulano@example.com") is False
+
+    # A posição removida é reaproveitada
+    assert lista.adicionar("fulano@example.com") is True
+    assert lista.contem("fulano@example.com") is True
+
+def test_importar_cresce_o_indice(lista):
+    """Testa que uma importação maior que a capacidade reconstrói o índice."""
+    enderecos = [f"usuario{i}@example.com" for i in range(CAPACIDADE_MINIMA)]
+    lista.adicionar("antigo@example.com")
+
+    assert lista.importar(enderecos) == CAPACIDADE_MINIMA
+    assert lista.importar(enderecos[:10]) == 0
+    assert len(lista) == CAPACIDADE_MINIMA + 1
+    assert all(lista.contem(e) for e in enderecos)
+    assert lista.contem("antigo@example.com")
+    assert not lista.contem("novo@example.com")
+
+def test_outro_processo_ve_alteracoes(tmp_path):
+    """Testa que instâncias distintas (como workers diferentes) compartilham o índice."""
+    caminho = str(tmp_path / "supressao.idx")
+    leitor = ListaSupressao(caminho)
+    escritor = ListaSupressao(caminho)
+    escritor.adicionar("a@example.com")
+    assert leitor.contem("a@example.com") is True
+
+    # Crescimento troca o arquivo; o leitor reabre o novo
+    escritor.importar(f"u{i}@example.com" for i in range(CAPACIDADE_MINIMA))
+    assert leitor.contem("u7@example.com") is True
+    assert leitor.contem("a@example.com") is True
+
+    escritor.remover("a@example.com")
+    assert leitor.contem("a@example.com") is False
+
+def test_ausencia_do_arquivo_fica_em_cache(tmp_path, monkeypatch):
+    """Testa que um arquivo inexistente não é verificado a cada consulta."""
+    caminho = str(tmp_path / "supressao.idx")
+    leitor = ListaSupressao(caminho, intervalo_ausencia=60)
+    verificacoes = []
+    existe = os.path.exists
+    monkeypatch.setattr("services.supressao.os.path.exists",
+                        lambda alvo: verificacoes.append(alvo) or existe(alvo))
+    for _ in range(100):
+        assert leitor.contem("a@example.com") is False
+    assert verificacoes == [caminho]
+
+    # Escritas da própria instância são vistas na hora
+    leitor.adicionar("a@example.com")
+    assert leitor.contem("a@example.com") is True
+
+def test_consultas_concorrentes_durante_a_troca(tmp_path):
+    """Testa que threads consultando enquanto o arquivo é trocado não usam um mapa fechado."""
+    caminho = str(tmp_path / "supressao.idx")
+    leitor = ListaSupressao(caminho)
+    escritor = ListaSupressao(caminho)
+    escritor.adicionar("a@example.com")
+    parar = threading.Event()
+    erros = []
+
+    def consultar():
+        while not parar.is_set():
+            try:
+                assert leitor.contem("a@example.com")
+            except Exception as erro:
+                erros.append(erro)
+                return
+
+    threads = [threading.Thread(target=consultar) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for rodada in range(5):
+        escritor.importar(f"r{rodada}-{i}@example.com" for i in range(CAPACIDADE_MINIMA << rodada))
+    parar.set()
+    for thread in threads:
+        thread.join()
+    assert erros == []
+
+def test_hash_endereco_reserva_sentinelas():
+    """Testa que o hash nunca coincide com os marcadores de posição vazia/removida."""
+    assert all(hash_endereco(f"x{i}@example.com") > 1 for i in range(1000))
+
+def test_cli_importar(tmp_path, capsys):
+    """Testa a importação e a consulta pela linha de comando."""
+    entrada = tmp_path / "bounces.csv"
+    entrada.write_text("a@example.com,bounce\nb@example.com,descadastro\nlinha inválida\n", encoding="utf-8")
+    arquivo = str(tmp_path / "supressao.idx")
+
+    assert main(["--arquivo", arquivo, "importar", str(entrada)]) == 0
+    assert "2 endereços adicionados" in capsys.readouterr().out
+    assert main(["--arquivo", arquivo, "consultar", "b@example.com"]) == 0
+    assert main(["--arquivo", arquivo, "consultar", "c@example.com"]) == 1
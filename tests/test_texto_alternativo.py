@@ -0,0 +1,57 @@
+from services.metricas import Metricas
+from services.texto_alternativo import CacheTexto, html_para_texto
+
+def test_html_para_texto():
+    """Testa a conversão de blocos, quebras, listas, links e entidades."""
+    html = (
+        "<html><head><title>Ignorado</title><style>p { color: red }</style></head><body>"
+        "<h1>Olá &amp; bem-vindo</h1>"
+        "<p>Clique <a href=\"https://example.com/senha\">aqui</a>\n   para redefinir.<br>Obrigado</p>"
+        "<ul><li>um</li><li>dois</li></ul>"
+        "<script>alert(1)</script>"
+        "</body></html>"
+    )
+
+    assert html_para_texto(html) == (
+        "Olá & bem-vindo\n\n"
+        "Clique aqui (https://example.com/senha) para redefinir.\nObrigado\n\n"
+        "- um\n- dois\n"
+    )
+
+def test_html_para_texto_pre_e_links_repetidos():
+    """Testa que <pre> preserva espaços e que links com o próprio endereço não se repetem."""
+    html = "<p>Código:</p><pre>  a   b\nc</pre><p><a href=\"https://example.com\">https://example.com</a></p>"
+
+    assert html_para_texto(html) == "Código:\n\n  a   b\nc\n\nhttps://example.com\n"
+
+def test_html_para_texto_links_autofechados():
+    """Testa que <a/> não mexe na pilha de links, nem dentro de trechos ignorados."""
+    assert html_para_texto('<head><a href="x"/></head><p>Corpo</p>') == "Corpo\n"
+    assert html_para_texto('<p><a href="https://example.com">Clique <a/>aqui</a></p>') == \
+        "Clique aqui (https://example.com)\n"
+
+def test_html_para_texto_sem_html():
+    """Testa que texto simples passa intacto."""
+    assert html_para_texto("Apenas texto") == "Apenas texto\n"
+
+def test_cache_converte_uma_vez(monkeypatch):
+    """Testa que corpos repetidos reaproveitam a conversão, com limite de entradas."""
+    chamadas = []
+    import services.texto_alternativo as modulo
+    original = modulo.html_para_texto
+    monkeypatch.setattr(modulo, "html_para_texto", lambda html: chamadas.append(html) or original(html))
+    metricas = Metricas()
+    cache = CacheTexto(maximo=2, metricas=metricas)
+
+    for _ in range(3):
+        assert cache.texto_para("<p>Fatura</p>") == "Fatura\n"
+    assert len(chamadas) == 1
+
+    cache.texto_para("<p>a</p>")
+    cache.texto_para("<p>b</p>")
+    assert len(cache) == 2
+    cache.texto_para("<p>Fatura</p>")
+    assert len(chamadas) == 4
+
+    contadores = {c["rotulos"]["resultado"]: c["valor"] for c in metricas.instantaneo()["contadores"]}
+    assert contadores == {"acerto": 2, "falha": 4}
@@ -0,0 +1,185 @@
+import email
+import json
+import os
+import time
+import aiosmtplib
+import pytest
+from services.email_service import enviar_email, validar_configuracoes
+from services.metricas import Metricas
+from services.transportes import (
+    PoolSMTP, Transporte, TransporteArquivo, TransporteNulo, TransporteSMTPAssincrono, fechar_transportes,
+    obter_transporte
+)
+
+@pytest.fixture(autouse=True)
+def transportes_limpos():
+    """Encerra os transportes compartilhados criados a partir de EMAIL_TRANSPORTE."""
+    yield
+    fechar_transportes()
+
+@pytest.fixture
+def sem_senha(mock_env_variables, monkeypatch):
+    """Configuração sem senha SMTP, com um transporte sem rede."""
+    monkeypatch.delenv("EMAIL_HOST_PASSWORD")
+    monkeypatch.setenv("EMAIL_TRANSPORTE", "nulo")
+
+def test_transporte_incompleto_falha_ao_ser_criado():
+    """Testa que um transporte sem entregar() é recusado na criação, não no primeiro envio."""
+    class SemEntrega(Transporte):
+        nome = "incompleto"
+
+    with pytest.raises(TypeError):
+        SemEntrega()
+
+def test_transportes_sem_rede_dispensam_senha(sem_senha, monkeypatch):
+    assert validar_configuracoes()["transporte"] == "nulo"
+
+    monkeypatch.setenv("EMAIL_TRANSPORTE", "smtp_async")
+    with pytest.raises(ValueError, match="EMAIL_HOST_PASSWORD"):
+        validar_configuracoes()
+    monkeypatch.setenv("EMAIL_TRANSPORTE", "pombo")
+    with pytest.raises(ValueError, match="EMAIL_TRANSPORTE"):
+        validar_configuracoes()
+
+def test_nulo_nao_usa_a_rede(sem_senha, mock_smtp, metricas, contador):
+    resultado = enviar_email("a@example.com", "Teste", "<p>Corpo</p>",
+                             transporte=TransporteNulo(metricas=metricas))
+
+    assert resultado["sucesso"] is True
+    mock_smtp.assert_not_called()
+    assert contador("transporte_mensagens") == 1
+    assert contador("transporte_bytes") > 0
+
+def test_nulo_simula_latencia_e_erros(sem_senha):
+    transporte = TransporteNulo(latencia=0.05, taxa_erro=1, metricas=Metricas())
+    inicio = time.monotonic()
+    resultado = enviar_email("a@example.com", "Teste", "<p>Corpo</p>", transporte=transporte)
+
+    assert time.monotonic() - inicio >= 0.025
+    assert resultado["sucesso"] is False
+    assert "Falha simulada" in resultado["mensagem"]
+    with pytest.raises(ValueError):
+        TransporteNulo(taxa_erro=2)
+
+def test_nulo_taxa_de_erro_parcial(sem_senha):
+    transporte = TransporteNulo(taxa_erro=0.3, semente=7, metricas=Metricas())
+    resultados = [enviar_email("a@example.com", "Teste", "<p>Corpo</p>", transporte=transporte)
+                  for _ in range(200)]
+    falhas = sum(1 for resultado in resultados if not resultado["sucesso"])
+    assert 30 < falhas < 90
+
+def test_arquivo_grava_maildir_em_lotes(sem_senha, tmp_path, metricas, contador):
+    transporte = TransporteArquivo(str(tmp_path / "maildir"), tamanho_lote=2, metricas=metricas)
+    for i in range(5):
+        resultado = enviar_email(f"d{i}@example.com", f"Teste {i}", "<p>Olá</p>", transporte=transporte)
+        assert resultado["sucesso"] is True
+    transporte.fechar()
+
+    gravadas = sorted(os.listdir(tmp_path / "maildir" / "new"))
+    assert len(gravadas) == 5
+    assert os.listdir(tmp_path / "maildir" / "tmp") == []
+    destinatarios = set()
+    for nome in gravadas:
+        with open(tmp_path / "maildir" / "new" / nome, "rb") as arquivo:
+            mensagem = email.message_from_binary_file(arquivo)
+        destinatarios.add(mensagem["To"])
+        assert mensagem.get_content_type() == "multipart/alternative"
+    assert destinatarios == {f"d{i}@example.com" for i in range(5)}
+    assert contador("transporte_mensagens") == 5
+
+def test_arquivo_escolhido_por_variavel(sem_senha, tmp_path, monkeypatch, mock_smtp):
+    monkeypatch.setenv("EMAIL_TRANSPORTE", "arquivo")
+    monkeypatch.setenv("EMAIL_TRANSPORTE_DIR", str(tmp_path / "saida"))
+
+    assert enviar_email("a@example.com", "Teste", "<p>Corpo</p>")["sucesso"] is True
+    fechar_transportes()
+
+    assert len(os.listdir(tmp_path / "saida" / "new")) == 1
+    mock_smtp.assert_not_called()
+
+def test_api_com_transporte_nulo(client, valid_email_payload, email_validator_mock, mock_smtp,
+                                 sem_senha):
+    # Todo o pipeline da API (validação, fila, histórico) sem rede
+    response = client.post('/api/enviar-email', data=json.dumps(valid_email_payload),
+                           content_type='application/json')
+
+    assert response.status_code == 200
+    assert json.loads(response.data)["sucesso"] is True
+    mock_smtp.assert_not_called()
+
+class ClienteFalso:
+    """Substituto do aiosmtplib.SMTP, sem rede."""
+    criados = []
+    recusados = set()
+
+    def __init__(self, **opcoes):
+        self.opcoes = opcoes
+        self.is_connected = False
+        self.enviadas = []
+        ClienteFalso.criados.append(self)
+
+    async def connect(self):
+        self.is_connected = True
+
+    async def login(self, usuario, senha):
+        self.login_com = (usuario, senha)
+
+    async def sendmail(self, remetente, destinatarios, dados):
+        if destinatarios[0] in self.recusados:
+            raise aiosmtplib.SMTPRecipientsRefused(
+                [aiosmtplib.SMTPRecipientRefused(550, "Usuário inexistente", destinatarios[0])]
+            )
+        self.enviadas.append((remetente, destinatarios, dados))
+        return {}, "OK"
+
+    async def quit(self):
+        self.is_connected = False
+
+    def close(self):
+        self.is_connected = False
+
+@pytest.fixture
+def cliente_falso(monkeypatch):
+    ClienteFalso.criados = []
+    ClienteFalso.recusados = set()
+    monkeypatch.setattr(aiosmtplib, "SMTP", ClienteFalso)
+    yield ClienteFalso
+
+def test_smtp_assincrono_reutiliza_conexao(mock_env_variables, cliente_falso):
+    transporte = TransporteSMTPAssincrono(tamanho=2)
+    try:
+        for i in range(3):
+            resultado = enviar_email(f"d{i}@example.com", "Teste", "<p>Corpo</p>", transporte=transporte)
+            assert resultado["sucesso"] is True
+    finally:
+        transporte.fechar()
+
+    assert len(cliente_falso.criados) == 1
+    cliente = cliente_falso.criados[0]
+    assert cliente.opcoes["hostname"] == "smtp.test.com" and cliente.opcoes["start_tls"] is True
+    assert cliente.login_com == ("test@test.com", "test-password")
+    assert [envio[1] for envio in cliente.enviadas] == [["d0@example.com"], ["d1@example.com"], ["d2@example.com"]]
+    assert b"Subject: Teste" in cliente.enviadas[0][2]
+    # Conexões ociosas encerradas no fechamento
+    assert cliente.is_connected is False
+
+def test_smtp_assincrono_dimensionado_pelo_pool(mock_env_variables, cliente_falso, monkeypatch):
+    """Testa que o smtp_async compartilhado tem tantas conexões quanto o pool da aplicação."""
+    monkeypatch.setenv("EMAIL_TRANSPORTE", "smtp_async")
+    monkeypatch.setenv("FILA_WORKERS", "4")
+    resultado = enviar_email("d@example.com", "Teste", "<p>Corpo</p>", pool=PoolSMTP(tamanho=16))
+
+    assert resultado["sucesso"] is True
+    assert obter_transporte("smtp_async").tamanho == 16
+
+def test_smtp_assincrono_recusa_vira_devolucao(mock_env_variables, cliente_falso):
+    cliente_falso.recusados.add("nao-existe@example.com")
+    transporte = TransporteSMTPAssincrono()
+    try:
+        resultado = enviar_email("nao-existe@example.com", "Teste", "<p>Corpo</p>", transporte=transporte)
+    finally:
+        transporte.fechar()
+
+    assert resultado["sucesso"] is False
+    assert resultado["devolvido"] is True
+    assert "nao-existe@example.com" in resultado["mensagem"]
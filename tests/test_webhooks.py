@@ -0,0 +1,224 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from services.webhooks import NotificadorWebhooks, assinar, tipo_do_resultado
+
+class ServidorWebhook:
+    """Servidor HTTP local que registra os lotes recebidos."""
+
+    def __init__(self, falhas=0, status_falha=503):
+        self.lotes = []
+        self.cabecalhos = []
+        self.corpos = []
+        self.requisicoes = 0
+        self.conexoes = set()
+        self.falhas = falhas
+        self.status_falha = status_falha
+        self.recebeu = threading.Event()
+        servidor = self
+
+        class Manipulador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def do_POST(self):
+                corpo = self.rfile.read(int(self.headers["Content-Length"]))
+                servidor.requisicoes += 1
+                servidor.conexoes.add(self.client_address)
+                if servidor.falhas:
+                    servidor.falhas -= 1
+                    status = servidor.status_falha
+                else:
+                    status = 200
+                    servidor.corpos.append(corpo)
+                    servidor.cabecalhos.append(dict(self.headers))
+                    servidor.lotes.append(json.loads(corpo)["eventos"])
+                    servidor.recebeu.set()
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.http = ThreadingHTTPServer(("127.0.0.1", 0), Manipulador)
+        self.url = f"http://127.0.0.1:{self.http.server_port}/eventos"
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+
+    def eventos(self):
+        return [evento for lote in self.lotes for evento in lote]
+
+    def fechar(self):
+        self.http.shutdown()
+        self.http.server_close()
+
+@pytest.fixture
+def servidor():
+    servidor = ServidorWebhook()
+    yield servidor
+    servidor.fechar()
+
+def criar_notificador(destinos, metricas, **opcoes):
+    opcoes.setdefault("intervalo", 0.05)
+    opcoes.setdefault("espera_base", 0.01)
+    return NotificadorWebhooks(resolver=destinos.get, metricas=metricas, **opcoes)
+
+def test_tipo_do_resultado():
+    assert tipo_do_resultado({"sucesso": True}) == "enviado"
+    assert tipo_do_resultado({"sucesso": False}) == "falhou"
+    assert tipo_do_resultado({"sucesso": False, "devolvido": True}) == "devolvido"
+
+def test_eventos_agrupados_em_lote(servidor, metricas, contador):
+    notificador = criar_notificador({"k1": (servidor.url, None)}, metricas, intervalo=0.3)
+    for i in range(20):
+        notificador.publicar("k1", {"evento": "enviado", "id": str(i)})
+    assert notificador.aguardar(timeout=5)
+    notificador.parar(timeout=5)
+
+    assert [evento["id"] for evento in servidor.eventos()] == [str(i) for i in range(20)]
+    assert len(servidor.lotes) < 20
+    assert all("timestamp" in evento for evento in servidor.eventos())
+    assert contador("webhook_eventos_entregues") == 20
+
+def test_tamanho_maximo_do_lote(servidor, metricas):
+    notificador = criar_notificador({"k1": (servidor.url, None)}, metricas, tamanho_lote=3, intervalo=0.3)
+    for i in range(7):
+        notificador.publicar("k1", {"evento": "enviado", "id": str(i)})
+    assert notificador.aguardar(timeout=5)
+    notificador.parar(timeout=5)
+
+    assert len(servidor.eventos()) == 7
+    assert max(len(lote) for lote in servidor.lotes) <= 3
+
+def test_conexao_reaproveitada(servidor, metricas):
+    notificador = criar_notificador({"k1": (servidor.url, None)}, metricas, workers=1)
+    for i in range(3):
+        notificador.publicar("k1", {"evento": "enviado", "id": str(i)})
+        assert notificador.aguardar(timeout=5)
+    notificador.parar(timeout=5)
+
+    assert servidor.requisicoes == 3
+    assert len(servidor.conexoes) == 1
+
+def test_lotes_separados_por_chave(metricas):
+    primeiro, segundo = ServidorWebhook(), ServidorWebhook()
+    try:
+        notificador = criar_notificador({"k1": (primeiro.url, None), "k2": (segundo.url, None)}, metricas)
+        notificador.publicar("k1", {"evento": "enviado", "id": "a"})
+        notificador.publicar("k2", {"evento": "falhou", "id": "b"})
+        notificador.publicar("sem-webhook", {"evento": "enviado", "id": "c"})
+        assert notificador.aguardar(timeout=5)
+        notificador.parar(timeout=5)
+    finally:
+        primeiro.fechar()
+        segundo.fechar()
+
+    assert [evento["id"] for evento in primeiro.eventos()] == ["a"]
+    assert [evento["id"] for evento in segundo.eventos()] == ["b"]
+
+def test_assinatura_hmac(servidor, metricas):
+    notificador = criar_notificador({"k1": (servidor.url, "segredo")}, metricas)
+    notificador.publicar("k1", {"evento": "enviado", "id": "1"})
+    assert notificador.aguardar(timeout=5)
+    notificador.parar(timeout=5)
+
+    assert servidor.cabecalhos[0]["X-Webhook-Assinatura"] == assinar(servidor.corpos[0], "segredo")
+
+def test_repete_com_backoff_em_falha_temporaria(metricas):
+    servidor = ServidorWebhook(falhas=2)
+    try:
+        notificador = criar_notificador({"k1": (servidor.url, None)}, metricas)
+        notificador.publicar("k1", {"evento": "enviado", "id": "1"})
+        assert notificador.aguardar(timeout=5)
+        notificador.parar(timeout=5)
+    finally:
+        servidor.fechar()
+
+    assert servidor.requisicoes == 3
+    assert [evento["id"] for evento in servidor.eventos()] == ["1"]
+
+def test_descarta_apos_erro_do_cliente(metricas, contador):
+    servidor = ServidorWebhook(falhas=5, status_falha=400)
+    try:
+        notificador = criar_notificador({"k1": (servidor.url, None)}, metricas)
+        notificador.publicar("k1", {"evento": "enviado", "id": "1"})
+        assert notificador.aguardar(timeout=5)
+        notificador.parar(timeout=5)
+    finally:
+        servidor.fechar()
+
+    # 4xx não é repetido
+    assert servidor.requisicoes == 1
+    assert contador("webhook_eventos_descartados", motivo="entrega") == 1
+
+def test_destino_indisponivel_esgota_tentativas(metricas, contador):
+    notificador = criar_notificador({"k1": ("http://127.0.0.1:9/eventos", None)}, metricas,
+                                    tentativas=3, timeout=0.5)
+    notificador.publicar("k1", {"evento": "enviado", "id": "1"})
+    assert notificador.aguardar(timeout=10)
+    notificador.parar(timeout=5)
+
+    assert contador("webhook_eventos_descartados", motivo="entrega") == 1
+
+def test_publicar_nao_bloqueia_com_fila_cheia(metricas, contador):
+    liberar = threading.Event()
+
+    def resolver_lento(chave):
+        liberar.wait(timeout=5)
+        return None
+
+    notificador = NotificadorWebhooks(resolver=resolver_lento, capacidade=2, intervalo=0.01,
+                                      metricas=metricas)
+    inicio = time.monotonic()
+    aceitos = [notificador.publicar("k1", {"id": str(i)}) for i in range(50)]
+    assert time.monotonic() - inicio < 0.5
+    assert not all(aceitos)
+    assert contador("webhook_eventos_descartados", motivo="fila_cheia") >= 1
+
+    liberar.set()
+    assert notificador.aguardar(timeout=5)
+    notificador.parar(timeout=5)
+
+def test_publicar_sem_chave_e_ignorado(metricas):
+    notificador = NotificadorWebhooks(resolver=lambda chave: None, metricas=metricas)
+    assert notificador.publicar(None, {"id": "1"}) is False
+    assert notificador.aguardar(timeout=0)
+
+def test_parar_entrega_eventos_pendentes(servidor, metricas):
+    notificador = criar_notificador({"k1": (servidor.url, None)}, metricas, intervalo=10)
+    notificador.publicar("k1", {"evento": "enviado", "id": "1"})
+    notificador.parar(timeout=5)
+
+    assert [evento["id"] for evento in servidor.eventos()] == ["1"]
+
+def test_parar_respeita_o_prazo(metricas, contador):
+    """Testa que parar() não espera lotes presos além do timeout e conta os descartados."""
+    liberar = threading.Event()
+    entregues = []
+
+    def resolver(chave):
+        return ("http://127.0.0.1:9/eventos", None)
+
+    notificador = NotificadorWebhooks(resolver=resolver, workers=1, tamanho_lote=1, intervalo=0.01,
+                                      metricas=metricas)
+
+    def entregar_preso(destino, lote):
+        # O único worker fica ocupado com o primeiro lote até o fim do teste
+        liberar.wait(timeout=10)
+        entregues.extend(lote)
+        notificador._concluir(len(lote))
+
+    notificador._entregar = entregar_preso
+    for i in range(3):
+        notificador.publicar("k1", {"id": str(i)})
+    time.sleep(0.2)
+
+    inicio = time.monotonic()
+    notificador.parar(timeout=0.3)
+    assert time.monotonic() - inicio < 1
+    assert contador("webhook_eventos_descartados", motivo="encerramento") == 2
+
+    liberar.set()
+    assert notificador.aguardar(timeout=5)
+    assert [evento["id"] for evento in entregues] == ["0"]